@@ -0,0 +1,352 @@
+"""
+Exercise Donation Bot - Auto Donation
+자동 기부 실행
+
+정기 (auto_donate_type='schedule'):
+  예정일(next_auto_donate_date)이 지난 사용자를 AUTO_DONATE_BATCH_SIZE명씩 keyset 페이지로 조회해
+  누적액만큼 Invoice를 만들고, 처리한 페이지의 다음 예정일을 한 트랜잭션으로 갱신한다.
+  자정에 수천 명이 한꺼번에 몰려도 Blink 호출은 동시 AUTO_DONATE_CONCURRENCY건을 넘지 않는다.
+
+목표액 (auto_donate_type='threshold'):
+  log_exercise 트랜잭션이 목표액 도달을 판단해 auto_donation_jobs에 작업을 등록하고,
+  AUTO_DONATE_WORKERS개 워커가 이를 가져가 처리한다.
+
+두 경로 모두 Invoice 생성은 초당 AUTO_DONATE_RATE_PER_SECOND건으로 제한된다.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import aiosqlite
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import config
+import database
+import lightning_blink as lightning
+from donation_worker import donation_worker
+
+logger = logging.getLogger(__name__)
+
+# (사용자 행, 기부 ID, 금액, Invoice, QR 이미지) → 사용자에게 전달 (DM 등)
+AutoDonationNotifier = Callable[[aiosqlite.Row, int, int, str, object], Awaitable[None]]
+
+# 기부 종류별 Invoice 메모
+AUTO_DONATION_COMMENTS = {
+    'auto_schedule': '정기 자동 기부',
+    'auto_threshold': '목표액 자동 기부',
+}
+
+
+def next_auto_donate_date(schedule_type: str, schedule_day: Optional[int], after: datetime) -> str:
+    """after가 속한 날 다음부터 첫 자동 기부 예정 시각 (해당 날짜 자정, ISO 문자열)
+
+    weekly는 schedule_day가 요일 (0=월요일), monthly는 일자 (1~28).
+    """
+    base = after.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if schedule_type == 'daily':
+        next_date = base + timedelta(days=1)
+    elif schedule_type == 'weekly':
+        days = (int(schedule_day or 0) - base.weekday()) % 7
+        next_date = base + timedelta(days=days or 7)
+    elif schedule_type == 'monthly':
+        day = min(max(int(schedule_day or 1), 1), 28)
+        next_date = base.replace(day=day)
+        if next_date <= base:
+            if base.month == 12:
+                next_date = next_date.replace(year=base.year + 1, month=1)
+            else:
+                next_date = next_date.replace(month=base.month + 1)
+    else:
+        raise ValueError(f"Unknown auto donation schedule: {schedule_type}")
+
+    return next_date.isoformat()
+
+
+class RatePacer:
+    """호출 시작 간격을 1/rate초 이상으로 벌림 (rate <= 0이면 제한 없음)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# 정기/목표액 자동 기부가 함께 쓰는 Invoice 생성 속도 제한
+invoice_pacer = RatePacer(config.AUTO_DONATE_RATE_PER_SECOND)
+
+
+async def issue_auto_donation(user: aiosqlite.Row, amount: int, donation_type: str) -> Tuple[int, str, object]:
+    """Invoice 생성 후 기부 기록 (invoice_created) - (donation_id, Invoice, QR 이미지) 반환"""
+    await invoice_pacer.wait()
+    comment = f"{AUTO_DONATION_COMMENTS[donation_type]} - {user['username']}"
+    invoice, qr_buffer, payment_hash = await lightning.create_lightning_payment(amount, comment)
+
+    donation_id = await database.create_donation(
+        user['user_id'], amount, invoice, payment_hash, config.DONATION_ADDRESS,
+        donation_type=donation_type
+    )
+    if donation_id is None:
+        raise Exception("failed to save donation")
+    return donation_id, invoice, qr_buffer
+
+
+async def notify_auto_donation(notifier: Optional[AutoDonationNotifier], user: aiosqlite.Row,
+                               donation_id: int, amount: int, invoice: str, qr_buffer):
+    """사용자에게 Invoice 전달 (실패해도 기부는 결제 타임아웃으로 정리됨)"""
+    if notifier is None:
+        return
+    try:
+        await notifier(user, donation_id, amount, invoice, qr_buffer)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to notify {user['user_id']} of auto donation #{donation_id}: {e}")
+
+
+class AutoDonationScheduler:
+    """예정일이 지난 사용자에게 정기 자동 기부 Invoice 발행"""
+
+    def __init__(self):
+        self.interval = config.AUTO_DONATE_CHECK_INTERVAL
+        self.batch_size = max(config.AUTO_DONATE_BATCH_SIZE, 1)
+        self.concurrency = max(config.AUTO_DONATE_CONCURRENCY, 1)
+        self._scheduler: Optional[AsyncIOScheduler] = None
+        self._notifier: Optional[AutoDonationNotifier] = None
+        self._running: Optional[asyncio.Task] = None
+        self.stats = {'runs': 0, 'invoices': 0, 'skipped': 0, 'failed': 0}
+
+    def start(self, notifier: Optional[AutoDonationNotifier] = None):
+        """주기 작업 등록 (시작 직후 한 번 실행해 다운타임 중 밀린 사용자부터 처리)"""
+        if self.interval <= 0:
+            logger.info("Auto donation scheduler disabled")
+            return
+        if self._scheduler is not None:
+            return
+
+        self._notifier = notifier
+        self._scheduler = AsyncIOScheduler(timezone=config.LOCAL_TZ)
+        # 이전 실행이 끝나지 않았으면 겹쳐 돌지 않고, 밀린 실행은 한 번으로 합침
+        self._scheduler.add_job(
+            self.run_once, 'interval', seconds=self.interval,
+            max_instances=1, coalesce=True, next_run_time=datetime.now(config.LOCAL_TZ),
+        )
+        self._scheduler.start()
+        logger.info(f"✅ Auto donation scheduler started (every {self.interval}s)")
+
+    async def stop(self):
+        if self._scheduler is not None:
+            self._scheduler.shutdown(wait=False)
+            self._scheduler = None
+        if self._running is not None:
+            self._running.cancel()
+            await asyncio.gather(self._running, return_exceptions=True)
+            self._running = None
+
+    async def run_once(self) -> int:
+        """예정일이 지난 사용자 전체 처리 - Invoice를 만든 사용자 수 반환"""
+        self._running = asyncio.current_task()
+        try:
+            return await self._run()
+        finally:
+            self._running = None
+
+    async def _run(self) -> int:
+        now = config.local_now()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        invoices = 0
+        after = None
+        self.stats['runs'] += 1
+
+        while True:
+            users = await database.get_due_auto_donations(now.isoformat(), self.batch_size, after)
+            if not users:
+                break
+            after = (users[-1]['next_auto_donate_date'], users[-1]['user_id'])
+
+            results = await asyncio.gather(*(self._donate(user, semaphore) for user in users))
+            invoices += sum(1 for result in results if result == 'invoice')
+
+            # 실패한 사용자는 예정일을 그대로 두어 다음 실행에서 다시 시도
+            # 다운타임 동안 여러 주기가 지났어도 기준을 지금으로 잡아 한 번만 청구
+            next_dates: Dict[str, str] = {}
+            for user, result in zip(users, results):
+                if result == 'failed':
+                    continue
+                try:
+                    next_dates[user['user_id']] = next_auto_donate_date(
+                        user['auto_donate_schedule_type'], user['auto_donate_schedule_day'], now
+                    )
+                except ValueError as e:
+                    logger.warning(f"⚠️ Skipping auto donation for {user['user_id']}: {e}")
+            await database.advance_auto_donate_dates(next_dates)
+
+            if len(users) < self.batch_size:
+                break
+
+        if invoices:
+            logger.info(f"⚡ Auto donation run created {invoices} invoice(s)")
+        return invoices
+
+    async def _donate(self, user: aiosqlite.Row, semaphore: asyncio.Semaphore) -> str:
+        """사용자 한 명 처리 - 'invoice' / 'skipped' / 'failed'"""
+        user_id = user['user_id']
+        amount = min(user['accumulated_sats'] or 0, config.MAX_DONATION)
+        if amount < config.MIN_DONATION:
+            self.stats['skipped'] += 1
+            return 'skipped'
+
+        async with semaphore:
+            try:
+                donation_id, invoice, qr_buffer = await issue_auto_donation(user, amount, 'auto_schedule')
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Auto donation invoice error for {user_id}: {e}")
+                return 'failed'
+
+        self.stats['invoices'] += 1
+        donation_worker.process(donation_id)
+        await notify_auto_donation(self._notifier, user, donation_id, amount, invoice, qr_buffer)
+        return 'invoice'
+
+
+class ThresholdDonationQueue:
+    """auto_donation_jobs 작업을 AUTO_DONATE_WORKERS개 워커로 처리
+
+    워커는 Invoice를 만들 때까지만 자리를 차지하고, 결제 대기는 별도 Task가 이어받는다.
+    작업은 기부가 끝날 때까지 임대를 연장하며 running으로 남아 같은 사용자의 작업이 다시 등록되지 않는다.
+    """
+
+    def __init__(self):
+        self.owner = donation_worker.owner
+        self.workers = max(config.AUTO_DONATE_WORKERS, 1)
+        self.poll_interval = config.AUTO_DONATE_CHECK_INTERVAL
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._waiters: Set[asyncio.Task] = set()
+        self._notifier: Optional[AutoDonationNotifier] = None
+        self._listening = False
+        self.stats = {'jobs': 0, 'invoices': 0, 'skipped': 0, 'failed': 0}
+
+    def start(self, notifier: Optional[AutoDonationNotifier] = None):
+        """워커 시작 (재시작 전 남은 대기 작업부터 처리)"""
+        if self._workers:
+            return
+        self._notifier = notifier
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if not self._listening:
+            # 목표액에 도달한 사용자 행이 커밋되면 바로 깨움 (작업은 같은 트랜잭션에서 등록됨)
+            database.add_user_listener(self._on_user_update)
+            self._listening = True
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"✅ Threshold auto donation queue started ({self.workers} workers)")
+
+    async def stop(self):
+        tasks = self._workers + list(self._waiters)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._waiters.clear()
+        self._wakeup = None
+
+    def _on_user_update(self, user: aiosqlite.Row):
+        if self._wakeup is not None and database.threshold_reached(user):
+            self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            # 조회 전에 clear - 조회 이후 등록된 작업은 다시 set 되어 놓치지 않음
+            self._wakeup.clear()
+            job = await database.claim_auto_donation_job(self.owner, config.DONATION_LEASE_SECONDS)
+            if job is None:
+                # 다른 프로세스가 등록했거나 임대가 만료된 작업은 주기적으로 확인
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval or None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # 다른 워커도 남은 작업을 가져가도록
+            self._wakeup.set()
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Auto donation job #{job['job_id']} error: {e}")
+                await database.update_auto_donation_job(job['job_id'], database.AUTO_JOB_FAILED,
+                                                        error_message=str(e))
+
+    async def _process(self, job: aiosqlite.Row):
+        job_id = job['job_id']
+        self.stats['jobs'] += 1
+
+        # 이전 프로세스가 Invoice까지 만든 작업은 기부 결과만 기다림
+        if job['donation_id'] is not None:
+            self._wait_in_background(job_id, job['donation_id'])
+            return
+
+        # 등록 이후 설정이 바뀌었거나 다른 기부로 누적액이 줄었을 수 있으므로 다시 확인
+        user = await database.get_user(job['user_id'])
+        reason = None
+        if user is None or not database.threshold_reached(user):
+            reason = 'threshold_not_reached'
+        elif await database.has_unfinished_donation(user['user_id']):
+            reason = 'donation_in_progress'
+        elif min(user['accumulated_sats'], config.MAX_DONATION) < config.MIN_DONATION:
+            reason = 'below_min_donation'
+        if reason:
+            self.stats['skipped'] += 1
+            await database.update_auto_donation_job(job_id, database.AUTO_JOB_SKIPPED, error_message=reason)
+            return
+
+        amount = min(user['accumulated_sats'], config.MAX_DONATION)
+        donation_id, invoice, qr_buffer = await issue_auto_donation(user, amount, 'auto_threshold')
+        self.stats['invoices'] += 1
+        await database.update_auto_donation_job(job_id, database.AUTO_JOB_RUNNING, donation_id=donation_id)
+
+        self._wait_in_background(job_id, donation_id)
+        await notify_auto_donation(self._notifier, user, donation_id, amount, invoice, qr_buffer)
+
+    def _wait_in_background(self, job_id: int, donation_id: int):
+        task = asyncio.create_task(self._finish(job_id, donation_id))
+        self._waiters.add(task)
+        task.add_done_callback(self._waiters.discard)
+
+    async def _finish(self, job_id: int, donation_id: int):
+        """기부가 끝나면 작업 종료 (결제되지 않은 경우 목표액만큼 더 쌓이면 다시 등록됨)"""
+        # 결제 대기와 전송 재시도가 임대보다 길어져도 다른 워커가 작업을 다시 가져가지 않도록
+        keep_lease = asyncio.create_task(self._keep_lease(job_id))
+        try:
+            donation = await donation_worker.wait(donation_id)
+        finally:
+            keep_lease.cancel()
+            await asyncio.gather(keep_lease, return_exceptions=True)
+        if donation is not None and donation['status'] == database.DONATION_FORWARDED:
+            await database.update_auto_donation_job(job_id, database.AUTO_JOB_DONE)
+        else:
+            self.stats['failed'] += 1
+            status = donation['status'] if donation else 'missing'
+            await database.update_auto_donation_job(job_id, database.AUTO_JOB_FAILED,
+                                                    error_message=f"donation_{status}")
+
+    async def _keep_lease(self, job_id: int):
+        """임대 기간의 1/3마다 작업 임대 연장"""
+        interval = max(config.DONATION_LEASE_SECONDS / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            if not await database.renew_auto_donation_job(job_id, self.owner, config.DONATION_LEASE_SECONDS):
+                logger.warning(f"⚠️ Lost lease on auto donation job #{job_id}")
+                return
+
+
+# 전역 자동 기부 스케줄러 / 목표액 작업 큐
+auto_donation_scheduler = AutoDonationScheduler()
+threshold_donation_queue = ThresholdDonationQueue()
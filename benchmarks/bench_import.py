@@ -0,0 +1,107 @@
+"""
+Exercise Donation Bot - 운동 기록 가져오기 벤치마크
+10만 건 CSV / 10만 포인트 GPX 파싱 속도와 일괄 저장(import_exercise_logs) 처리량을 rows/s로 측정
+
+사용법: python benchmarks/bench_import.py [기록 수]
+"""
+import asyncio
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 실제 DB를 건드리지 않도록 config 로드 전에 임시 경로 지정
+_tmp_dir = tempfile.mkdtemp(prefix='bench_import_')
+os.environ['DATABASE_PATH'] = os.path.join(_tmp_dir, 'bench.db')
+
+import config  # noqa: E402
+import database  # noqa: E402
+import workout_import  # noqa: E402
+
+USER_ID = '300000000000000000'
+
+
+def write_csv_fixture(path: str, rows: int):
+    """기록 rows건짜리 CSV (1분 간격, 운동 종류 무작위)"""
+    exercise_types = [key for key in config.EXERCISE_TYPES if key != 'weight']
+    start = datetime(2020, 1, 1, 6, 0)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('date,type,value,memo\n')
+        for i in range(rows):
+            logged_at = (start + timedelta(minutes=i)).isoformat()
+            f.write(f"{logged_at},{random.choice(exercise_types)},{random.uniform(1, 20):.2f},bench {i}\n")
+
+
+def write_gpx_fixture(path: str, points: int, points_per_track: int = 1000):
+    """트랙 포인트 points개짜리 GPX (트랙당 points_per_track개)"""
+    start = datetime(2020, 1, 1, 6, 0)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        for track in range(math.ceil(points / points_per_track)):
+            f.write(f'<trk><name>run {track}</name><type>running</type><trkseg>\n')
+            for i in range(min(points_per_track, points - track * points_per_track)):
+                logged_at = start + timedelta(days=track, seconds=i)
+                f.write(f'<trkpt lat="{37.5 + i * 0.00005:.6f}" lon="{127.0 + i * 0.00003:.6f}">'
+                        f'<time>{logged_at.isoformat()}Z</time></trkpt>\n')
+            f.write('</trkseg></trk>\n')
+        f.write('</gpx>\n')
+
+
+def report(label: str, count: int, elapsed: float):
+    print(f"{label:<28} {count:>8,} rows {elapsed:>8.2f}s {count / elapsed:>12,.0f} rows/s")
+
+
+async def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    # 로그 출력이 측정에 섞이지 않도록
+    database.logger.setLevel('WARNING')
+
+    csv_path = os.path.join(_tmp_dir, 'fixture.csv')
+    gpx_path = os.path.join(_tmp_dir, 'fixture.gpx')
+    try:
+        write_csv_fixture(csv_path, rows)
+        write_gpx_fixture(gpx_path, rows)
+        print(f"CSV fixture {os.path.getsize(csv_path) / 1e6:.1f}MB, GPX fixture {os.path.getsize(gpx_path) / 1e6:.1f}MB")
+
+        # 파싱 (현재 프로세스 / 워커 프로세스)
+        start = time.perf_counter()
+        parsed, _ = workout_import.parse_workout_file(csv_path, 'csv', max_rows=rows)
+        report('parse csv (inline)', len(parsed), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        parsed, _ = await workout_import.parse_in_worker(csv_path, 'csv')
+        report('parse csv (worker)', len(parsed), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        tracks, _ = workout_import.parse_workout_file(gpx_path, 'gpx')
+        report(f'parse gpx ({len(tracks)} tracks)', rows, time.perf_counter() - start)
+
+        # 일괄 저장 (첫 가져오기 / 같은 파일 다시 가져오기 = 전부 중복)
+        await database.init_db()
+        await database.create_user(USER_ID, 'importer')
+        for exercise_type in config.EXERCISE_TYPES:
+            await database.update_donation_setting(USER_ID, exercise_type, 100)
+
+        start = time.perf_counter()
+        result = await database.import_exercise_logs(USER_ID, parsed)
+        report('import (new rows)', result['imported'], time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = await database.import_exercise_logs(USER_ID, parsed)
+        report('import (all duplicates)', result['duplicates'], time.perf_counter() - start)
+    finally:
+        workout_import.close_import_executor()
+        await database.db_manager.close()
+        for name in os.listdir(_tmp_dir):
+            os.remove(os.path.join(_tmp_dir, name))
+        os.rmdir(_tmp_dir)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""
+Exercise Donation Bot - 인덱스 벤치마크
+운동 기록/기부 내역 조회 지연 시간을 인덱스 마이그레이션 전후로 측정
+
+사용법: python benchmarks/bench_indexes.py [운동 기록 수] [사용자 수]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 실제 DB를 건드리지 않도록 config 로드 전에 임시 경로 지정
+_tmp_dir = tempfile.mkdtemp(prefix='bench_indexes_')
+os.environ['DATABASE_PATH'] = os.path.join(_tmp_dir, 'bench.db')
+
+import config  # noqa: E402
+import database  # noqa: E402
+
+INDEX_VERSION = 3  # 복합 인덱스를 추가하는 마이그레이션
+QUERY_ROUNDS = 200
+INSERT_CHUNK = 50_000
+
+
+async def populate(log_rows: int, user_count: int):
+    """사용자, 운동 기록, 기부 내역 생성 (기부는 운동 기록의 1/10)"""
+    user_ids = [str(100000000000000000 + i) for i in range(user_count)]
+    exercise_types = list(config.EXERCISE_TYPES)
+    statuses = ['forwarded', 'forwarded', 'forwarded', 'failed', 'completed']
+    start = datetime(2024, 1, 1)
+
+    async with database.db_manager.transaction() as db:
+        await db.executemany(
+            'INSERT INTO users (user_id, username, created_at) VALUES (?, ?, ?)',
+            [(user_id, f'user{i}', start.isoformat()) for i, user_id in enumerate(user_ids)]
+        )
+
+    for offset in range(0, log_rows, INSERT_CHUNK):
+        count = min(INSERT_CHUNK, log_rows - offset)
+        logs = []
+        donations = []
+        for i in range(offset, offset + count):
+            user_id = random.choice(user_ids)
+            timestamp = (start + timedelta(seconds=i * 30)).isoformat()
+            logs.append((user_id, random.choice(exercise_types), random.uniform(1, 20), 'km',
+                         random.randint(10, 500), None, timestamp))
+            if i % 10 == 0:
+                donations.append((user_id, random.randint(100, 5000), 'bench@blink.sv',
+                                  'bolt11', 'manual', random.choice(statuses), timestamp))
+
+        async with database.db_manager.transaction() as db:
+            await db.executemany('''
+                INSERT INTO exercise_logs
+                (user_id, exercise_type, value, unit, calculated_sats, memo, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', logs)
+            await db.executemany('''
+                INSERT INTO donation_history
+                (user_id, amount, lightning_address, lightning_invoice, donation_type, status, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', donations)
+
+    return user_ids
+
+
+async def time_query(sql: str, params_list) -> float:
+    """쿼리 평균 지연 시간 (ms)"""
+    db = await database.db_manager.get_connection()
+    start = time.perf_counter()
+    for params in params_list:
+        async with db.execute(sql, params) as cursor:
+            await cursor.fetchall()
+    return (time.perf_counter() - start) * 1000 / len(params_list)
+
+
+async def run_queries(user_ids):
+    samples = [random.choice(user_ids) for _ in range(QUERY_ROUNDS)]
+    placeholders = ', '.join('?' for _ in database.DONATION_DONE_STATES)
+    queries = {
+        'recent logs': (
+            'SELECT * FROM exercise_logs WHERE user_id = ? ORDER BY timestamp DESC LIMIT 20',
+            [(user_id,) for user_id in samples]
+        ),
+        'recent donations': (
+            f'''SELECT * FROM donation_history
+                WHERE user_id = ? AND status IN ({placeholders})
+                ORDER BY timestamp DESC LIMIT 10''',
+            [(user_id, *database.DONATION_DONE_STATES) for user_id in samples]
+        ),
+        'unfinished donations': (
+            f'''SELECT donation_id FROM donation_history
+                WHERE status IN ({', '.join('?' for _ in database.DONATION_UNFINISHED_STATES)})''',
+            [database.DONATION_UNFINISHED_STATES] * 20
+        ),
+    }
+
+    results = {}
+    for name, (sql, params_list) in queries.items():
+        results[name] = await time_query(sql, params_list)
+    return results
+
+
+async def main():
+    log_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    user_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+
+    try:
+        await database.run_migrations(target_version=INDEX_VERSION - 1)
+
+        start = time.perf_counter()
+        user_ids = await populate(log_rows, user_count)
+        print(f"Inserted {log_rows:,} log rows for {user_count:,} users in {time.perf_counter() - start:.1f}s")
+
+        before = await run_queries(user_ids)
+
+        start = time.perf_counter()
+        version = await database.run_migrations()
+        print(f"Migrated to schema v{version} in {time.perf_counter() - start:.1f}s")
+
+        after = await run_queries(user_ids)
+
+        print(f"{'query':<22} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for name in before:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            print(f"{name:<22} {before[name]:>10.3f} {after[name]:>10.3f} {speedup:>7.1f}x")
+    finally:
+        await database.db_manager.close()
+        for name in os.listdir(_tmp_dir):
+            os.remove(os.path.join(_tmp_dir, name))
+        os.rmdir(_tmp_dir)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Exercise Donation Bot - 리더보드 벤치마크
+카테고리별 top-N / 순위 조회 지연 시간을 리더보드 인덱스 마이그레이션 전후로 측정
+
+사용법: python benchmarks/bench_leaderboard.py [사용자 수]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 실제 DB를 건드리지 않도록 config 로드 전에 임시 경로 지정
+_tmp_dir = tempfile.mkdtemp(prefix='bench_leaderboard_')
+os.environ['DATABASE_PATH'] = os.path.join(_tmp_dir, 'bench.db')
+
+import database  # noqa: E402
+
+INDEX_VERSION = 4  # 리더보드 인덱스를 추가하는 마이그레이션
+QUERY_ROUNDS = 100
+
+
+async def populate(user_count: int):
+    """운동량/기부액이 무작위인 사용자 생성 (일부는 기록 없음)"""
+    rows = []
+    for i in range(user_count):
+        active = random.random() < 0.8
+        rows.append((
+            str(100000000000000000 + i), f'user{i}',
+            random.uniform(0, 500) if active else 0,
+            random.uniform(0, 2000) if active else 0,
+            random.uniform(0, 800) if active else 0,
+            random.uniform(0, 50) if active else 0,
+            random.uniform(0, 10000) if active else 0,
+            random.randint(0, 1_000_000) if active else 0,
+            random.randint(0, 200) if active else 0,
+            random.randint(0, 365) if active else 0,
+        ))
+
+    async with database.db_manager.transaction() as db:
+        await db.executemany('''
+            INSERT INTO users
+            (user_id, username, total_walking_km, total_cycling_km, total_running_km,
+             total_swimming_km, total_weight_kg, total_donated_sats, total_donation_count, streak_days)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return [row[0] for row in rows]
+
+
+async def run_queries(user_ids):
+    """카테고리별 (top-10 ms, 순위 ms)"""
+    samples = [random.choice(user_ids) for _ in range(QUERY_ROUNDS)]
+    results = {}
+    for category in database.LEADERBOARD_CATEGORIES:
+        start = time.perf_counter()
+        for _ in range(QUERY_ROUNDS):
+            await database.get_leaderboard(category, 10)
+        top_ms = (time.perf_counter() - start) * 1000 / QUERY_ROUNDS
+
+        start = time.perf_counter()
+        for user_id in samples:
+            await database.get_user_rank(user_id, category)
+        rank_ms = (time.perf_counter() - start) * 1000 / QUERY_ROUNDS
+
+        results[category] = (top_ms, rank_ms)
+    return results
+
+
+async def main():
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    try:
+        await database.run_migrations(target_version=INDEX_VERSION - 1)
+        user_ids = await populate(user_count)
+        print(f"Inserted {user_count:,} users")
+
+        before = await run_queries(user_ids)
+
+        start = time.perf_counter()
+        version = await database.run_migrations()
+        print(f"Migrated to schema v{version} in {time.perf_counter() - start:.1f}s")
+
+        after = await run_queries(user_ids)
+
+        print(f"{'category':<15} {'top10 before':>12} {'top10 after':>12} {'rank before':>12} {'rank after':>11}")
+        for category in before:
+            print(f"{category:<15} {before[category][0]:>12.3f} {after[category][0]:>12.3f} "
+                  f"{before[category][1]:>12.3f} {after[category][1]:>11.3f}")
+    finally:
+        await database.db_manager.close()
+        for name in os.listdir(_tmp_dir):
+            os.remove(os.path.join(_tmp_dir, name))
+        os.rmdir(_tmp_dir)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
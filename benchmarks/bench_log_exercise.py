@@ -0,0 +1,91 @@
+"""
+Exercise Donation Bot - 운동 기록 부하 테스트
+동시 사용자 수별 log_exercise 처리량/지연 시간을 건별 커밋과 group commit으로 비교
+
+사용법: python benchmarks/bench_log_exercise.py [동시 사용자 수] [사용자당 기록 수]
+(fsync 비용까지 보려면 DB_SYNCHRONOUS=FULL 로 실행)
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 실제 DB를 건드리지 않도록 config 로드 전에 임시 경로 지정
+_tmp_dir = tempfile.mkdtemp(prefix='bench_log_exercise_')
+os.environ['DATABASE_PATH'] = os.path.join(_tmp_dir, 'bench.db')
+
+import config  # noqa: E402
+import database  # noqa: E402
+
+BATCH_WINDOWS_MS = [0, 2, 5, 10]
+
+
+async def setup_users(count: int):
+    """모든 운동에 기부 설정이 된 사용자 생성"""
+    user_ids = [str(200000000000000000 + i) for i in range(count)]
+    for i, user_id in enumerate(user_ids):
+        await database.create_user(user_id, f'runner{i}')
+        for exercise_type in config.EXERCISE_TYPES:
+            await database.update_donation_setting(user_id, exercise_type, 100)
+    return user_ids
+
+
+async def client(user_id: str, logs: int, latencies: list, failures: list):
+    """사용자 한 명이 연달아 기록 (응답을 받은 뒤 다음 기록)"""
+    exercise_types = list(config.EXERCISE_TYPES)
+    for _ in range(logs):
+        value = round(random.uniform(1, 10), 1)
+        start = time.perf_counter()
+        user = await database.log_exercise(user_id, random.choice(exercise_types), value, None, int(value * 100))
+        latencies.append(time.perf_counter() - start)
+        if user is None:
+            failures.append(user_id)
+
+
+async def run(window_ms: int, user_ids, logs_per_user: int):
+    database.exercise_log_batcher = database.ExerciseLogBatcher(window_ms=window_ms)
+    latencies, failures = [], []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(user_id, logs_per_user, latencies, failures) for user_id in user_ids))
+    elapsed = time.perf_counter() - start
+
+    stats = database.exercise_log_batcher.stats
+    await database.exercise_log_batcher.close()
+
+    latencies.sort()
+    total = len(latencies)
+    commits = stats['batches'] if window_ms > 0 else total
+    print(f"{window_ms:>9} {total / elapsed:>10.0f} {latencies[total // 2] * 1000:>8.2f} "
+          f"{latencies[int(total * 0.99) - 1] * 1000:>8.2f} {commits:>8} {len(failures):>7}")
+
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logs_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    # 로그 출력이 측정에 섞이지 않도록
+    database.logger.setLevel('WARNING')
+
+    try:
+        await database.init_db()
+        user_ids = await setup_users(concurrency)
+        print(f"{concurrency} concurrent users x {logs_per_user} logs, "
+              f"journal={config.DB_JOURNAL_MODE} synchronous={config.DB_SYNCHRONOUS}")
+        print(f"{'window ms':>9} {'logs/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'commits':>8} {'failed':>7}")
+
+        for window_ms in BATCH_WINDOWS_MS:
+            await run(window_ms, user_ids, logs_per_user)
+    finally:
+        await database.db_manager.close()
+        for name in os.listdir(_tmp_dir):
+            os.remove(os.path.join(_tmp_dir, name))
+        os.rmdir(_tmp_dir)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+"""
+Exercise Donation Bot - QR 렌더링 벤치마크
+Invoice 길이별 렌더링 시간과 PNG 크기 측정
+
+사용법: python benchmarks/bench_qr.py [반복 횟수]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lightning_blink import render_qr_png  # noqa: E402
+
+BECH32_CHARS = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+INVOICE_LENGTHS = [200, 300, 400, 600, 800]
+
+
+def make_invoice(length: int) -> str:
+    """테스트용 BOLT11 형태 문자열"""
+    return 'lnbc' + ''.join(random.choice(BECH32_CHARS) for _ in range(length - 4))
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'length':>6} {'mode':>8} {'ms/render':>10} {'bytes':>8}")
+
+    for length in INVOICE_LENGTHS:
+        invoices = [make_invoice(length) for _ in range(rounds)]
+        for optimize in (False, True):
+            start = time.perf_counter()
+            sizes = [len(render_qr_png(invoice, optimize)) for invoice in invoices]
+            elapsed_ms = (time.perf_counter() - start) * 1000 / rounds
+            mode = 'optimize' if optimize else 'default'
+            print(f"{length:>6} {mode:>8} {elapsed_ms:>10.2f} {sum(sizes) // len(sizes):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,9 +8,18 @@ from discord.ext import commands
 from discord.ui import Button, View, Modal, TextInput
 import asyncio
 import logging
+import os
+import tempfile
+from datetime import date
+from typing import Optional, Set
 import config
 import database
 import lightning_blink as lightning
+import leaderboard as rankings
+import workout_import
+import data_export
+from donation_worker import donation_worker
+from auto_donation import auto_donation_scheduler, threshold_donation_queue, next_auto_donate_date
 
 # 로깅 설정
 logger = logging.getLogger(__name__)
@@ -25,11 +34,73 @@ class MyBot(discord.Client):
         self.tree = app_commands.CommandTree(self)
     
     async def setup_hook(self):
+        # 프로세스 시작 시 한 번만 실행 (on_ready는 재연결마다 다시 호출됨)
+        await database.init_db()
+        
+        # 메모리 리더보드 구성 (이후 기록/기부 시 해당 사용자만 갱신)
+        if config.LEADERBOARD_MEMORY_ENABLED:
+            await rankings.leaderboard.load()
+            rankings.leaderboard.start_verifier()
+        
+        # BTC 지갑 ID 미리 확인 (이후 기부마다 Me 쿼리 생략)
+        try:
+            await lightning.get_blink().get_btc_wallet_id()
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to resolve Blink wallet at startup: {e}")
+        
+        # 재시작 전 완료되지 못한 기부 이어서 처리
+        await donation_worker.resume()
+        
+        # 자동 기부 (정기: 예정일이 지난 사용자, 목표액: 운동 기록 시 등록된 작업 → DM으로 Invoice 전송)
+        auto_donation_scheduler.start(send_auto_donation_invoice)
+        threshold_donation_queue.start(send_auto_donation_invoice)
+        
         await self.tree.sync()
         logger.info("✅ Slash commands synced")
+    
+    async def close(self):
+        # 공유 리소스 정리
+        await auto_donation_scheduler.stop()
+        await threshold_donation_queue.stop()
+        await donation_worker.stop()
+        await rankings.leaderboard.stop()
+        await lightning.stop_invoice_watcher()
+        await lightning.close_http_session()
+        lightning.close_qr_executor()
+        workout_import.close_import_executor()
+        await database.exercise_log_batcher.close()
+        logger.info(f"User cache stats: {database.user_cache.stats}")
+        await database.db_manager.close()
+        await super().close()
 
 bot = MyBot()
 
+async def send_auto_donation_invoice(user, donation_id: int, amount: int, invoice: str, qr_buffer):
+    """자동 기부 Invoice를 사용자 DM으로 전송"""
+    member = bot.get_user(int(user['user_id'])) or await bot.fetch_user(int(user['user_id']))
+    
+    is_threshold = user['auto_donate_type'] == database.AUTO_DONATE_THRESHOLD
+    embed = discord.Embed(
+        title="🤖 목표액 자동 기부" if is_threshold else "🤖 정기 자동 기부",
+        description=f"누적된 **{amount:,} sats** 기부 Invoice입니다. (기부 번호 #{donation_id})",
+        color=0xF7931A
+    )
+    embed.add_field(name="📍 받는 곳", value=f"`{config.DONATION_ADDRESS}`", inline=False)
+    
+    invoice_chunks = [invoice[i:i+1024] for i in range(0, len(invoice), 1024)]
+    for idx, chunk in enumerate(invoice_chunks):
+        field_name = "⚡ Lightning Invoice" if idx == 0 else f"⚡ Invoice (계속 {idx+1})"
+        embed.add_field(name=field_name, value=f"`{chunk}`", inline=False)
+    
+    embed.set_image(url="attachment://invoice_qr.png")
+    embed.set_footer(text=f"⏱️ {config.PAYMENT_TIMEOUT // 60}분 안에 결제해주세요 · /자동기부설정 으로 끌 수 있습니다")
+    
+    await member.send(embed=embed, file=discord.File(qr_buffer, filename="invoice_qr.png"))
+
+def guild_key(interaction: discord.Interaction):
+    """순위 범위 (서버에서는 해당 서버 멤버만, DM에서는 전체)"""
+    return str(interaction.guild_id) if interaction.guild_id else None
+
 # ============================================
 # UI Components
 # ============================================
@@ -202,14 +273,7 @@ class ExerciseInputModal(Modal, title="운동 기록"):
                 return
             
             # Define reasonable limits based on exercise type
-            max_limits = {
-                'walking': 1000,  # km
-                'cycling': 1000,  # km
-                'running': 500,   # km
-                'swimming': 100,  # km
-                'weight': 500     # kg
-            }
-            max_value = max_limits.get(self.exercise_type, 1000)
+            max_value = config.EXERCISE_MAX_VALUES.get(self.exercise_type, 1000)
             if value > max_value:
                 unit = config.EXERCISE_TYPES[self.exercise_type]['unit']
                 await interaction.response.send_message(
@@ -239,11 +303,11 @@ class ExerciseInputModal(Modal, title="운동 기록"):
             # 기부금 계산
             calculated_sats = int(value * rate)
             
-            # 운동 기록
-            await database.log_exercise(self.user_id, self.exercise_type, value, memo, calculated_sats)
-            
-            # 사용자 정보 다시 조회
-            user = await database.get_user(self.user_id)
+            # 운동 기록 (갱신된 누적 기부금/연속 운동을 함께 반환)
+            user = await database.log_exercise(self.user_id, self.exercise_type, value, memo, calculated_sats)
+            if not user:
+                await interaction.response.send_message("❌ 운동 기록 저장에 실패했습니다. 잠시 후 다시 시도하세요.", ephemeral=True)
+                return
             
             # 응답
             embed = discord.Embed(title="운동 기록 완료! 🎉", color=0x00FF00)
@@ -263,10 +327,19 @@ class ExerciseInputModal(Modal, title="운동 기록"):
         except ValueError:
             await interaction.response.send_message("❌ 숫자만 입력하세요.", ephemeral=True)
 
+async def fetch_leaders(interaction: discord.Interaction, category: str, period_range=None):
+    """리더보드 상위 10명 (period_range가 있으면 해당 기간 일별 집계 합산)"""
+    if period_range:
+        start_day, end_day = period_range
+        return await database.get_period_leaderboard(category, start_day, end_day, 10, guild_key(interaction))
+    return await rankings.get_leaderboard(category, 10, guild_key(interaction))
+
 class LeaderboardView(View):
     """리더보드 카테고리 선택 뷰"""
-    def __init__(self):
+    def __init__(self, period_range=None, period_label=None):
         super().__init__(timeout=120)
+        self.period_range = period_range  # (시작일, 종료일) - 없으면 전체 기간
+        self.period_label = period_label
         
         categories = [
             ('🚶', '걷기', 'walking'),
@@ -279,6 +352,9 @@ class LeaderboardView(View):
         ]
         
         for emoji, name, category in categories:
+            # 기간별 순위는 운동 기록 카테고리만 지원
+            if period_range and category not in database.PERIOD_LEADERBOARD_CATEGORIES:
+                continue
             button = Button(
                 label=name,
                 emoji=emoji,
@@ -290,13 +366,15 @@ class LeaderboardView(View):
     
     def make_callback(self, category, name, emoji):
         async def callback(interaction: discord.Interaction):
-            leaders = await database.get_leaderboard(category, 10)
+            leaders = await fetch_leaders(interaction, category, self.period_range)
             
             if not leaders:
                 await interaction.response.send_message("❌ 순위 정보가 없습니다.", ephemeral=True)
                 return
             
             title = f"{emoji} {name} 랭킹 TOP 10"
+            if self.period_label:
+                title = f"{emoji} {self.period_label} {name} 랭킹 TOP 10"
             embed = discord.Embed(title=title, color=0xFFD700)
             
             rank_text = ""
@@ -319,11 +397,11 @@ class LeaderboardView(View):
             embed.description = rank_text
             
             if category == 'donation':
-                total_users = await database.get_total_users()
+                total_users = await rankings.get_total_users(guild_key(interaction))
                 embed.set_footer(text=f"참여자: {total_users}명")
             
             # 버튼 유지
-            view = LeaderboardView()
+            view = LeaderboardView(self.period_range, self.period_label)
             await interaction.response.edit_message(embed=embed, view=view)
         
         return callback
@@ -335,7 +413,52 @@ class LeaderboardView(View):
 @bot.event
 async def on_ready():
     print(f'✅ Logged in as {bot.user}')
-    await database.init_db()
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    # 서버별 순위를 위해 상호작용한 사용자의 서버 멤버십 기록 (이미 기록된 경우 DB 접근 없음)
+    if interaction.guild_id:
+        await database.touch_guild_member(str(interaction.guild_id), str(interaction.user.id))
+
+# 이 프로세스에서 멤버 목록을 이미 맞춘 길드 (이후 변경은 멤버 입장/퇴장 이벤트로 반영)
+synced_guilds: Set[int] = set()
+
+async def sync_guild_members(guild: discord.Guild):
+    """길드 멤버 목록으로 guild_members 맞추기 (배포 전 사용자, 봇이 꺼져 있던 동안의 탈퇴 반영)"""
+    if guild.id in synced_guilds:
+        return
+    synced_guilds.add(guild.id)
+    try:
+        if not guild.chunked:
+            await guild.chunk()
+        await database.sync_guild_members(str(guild.id), (str(member.id) for member in guild.members))
+    except Exception as e:
+        synced_guilds.discard(guild.id)
+        logger.warning(f"⚠️ Failed to sync members of guild {guild.id}: {e}")
+
+@bot.event
+async def on_guild_available(guild: discord.Guild):
+    # 시작/재연결 시 길드마다 호출됨 - 전체 목록은 프로세스당 한 번만 맞춤
+    await sync_guild_members(guild)
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    await sync_guild_members(guild)
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    # 다시 들어온 기존 사용자만 기록 (새 사용자는 처음 명령을 쓸 때 on_interaction에서 기록)
+    if await database.get_user(str(member.id)):
+        await database.touch_guild_member(str(member.guild.id), str(member.id))
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    await database.remove_guild_member(str(member.guild.id), str(member.id))
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    synced_guilds.discard(guild.id)
+    await database.remove_guild(str(guild.id))
 
 @bot.tree.command(name="운동설정", description="운동별 기부 설정")
 @commands.cooldown(1, 30, commands.BucketType.user)
@@ -367,10 +490,102 @@ async def my_settings(interaction: discord.Interaction):
     embed.add_field(name="📍 기부 지갑", value=f"`{config.DONATION_ADDRESS}`", inline=False)
     
     auto_status = "ON" if user['auto_donate_enabled'] else "OFF"
+    if user['auto_donate_enabled'] and user['auto_donate_type'] == database.AUTO_DONATE_SCHEDULE:
+        schedule_text = format_auto_donate_schedule(user['auto_donate_schedule_type'], user['auto_donate_schedule_day'])
+        next_date = (user['next_auto_donate_date'] or '')[:10]
+        auto_status = f"ON - {schedule_text} (다음: {next_date})"
+    elif user['auto_donate_enabled'] and user['auto_donate_type'] == database.AUTO_DONATE_THRESHOLD:
+        auto_status = f"ON - 누적 {user['auto_donate_target_amount']:,} sats 도달 시"
     embed.add_field(name="🤖 자동 기부", value=auto_status, inline=False)
     
     await interaction.response.send_message(embed=embed)
 
+AUTO_DONATE_WEEKDAYS = ['월', '화', '수', '목', '금', '토', '일']
+
+def format_auto_donate_schedule(schedule_type: str, schedule_day: Optional[int]) -> str:
+    """자동 기부 주기 표시용 문자열"""
+    if schedule_type == 'weekly':
+        return f"매주 {AUTO_DONATE_WEEKDAYS[schedule_day or 0]}요일"
+    if schedule_type == 'monthly':
+        return f"매월 {schedule_day}일"
+    return "매일"
+
+@bot.tree.command(name="자동기부설정", description="자동 기부 설정")
+@app_commands.rename(schedule='주기', day='기부일', target='목표액')
+@app_commands.describe(
+    schedule='자동 기부 주기',
+    day='매주: 요일 (0=월 ~ 6=일), 매월: 날짜 (1~28)',
+    target='목표액 도달 시: 누적 목표 금액 (sats)'
+)
+@app_commands.choices(schedule=[
+    app_commands.Choice(name='끄기', value='off'),
+    app_commands.Choice(name='매일', value='daily'),
+    app_commands.Choice(name='매주', value='weekly'),
+    app_commands.Choice(name='매월', value='monthly'),
+    app_commands.Choice(name='목표액 도달 시', value='threshold'),
+])
+async def auto_donate_settings(interaction: discord.Interaction, schedule: app_commands.Choice[str],
+                               day: Optional[int] = None, target: Optional[int] = None):
+    """자동 기부 설정"""
+    user_id = str(interaction.user.id)
+    if not await database.get_user(user_id):
+        await interaction.response.send_message("❌ 먼저 /운동설정 명령으로 설정을 진행하세요.", ephemeral=True)
+        return
+    
+    if schedule.value == 'off':
+        await database.update_auto_donate_setting(user_id, False)
+        await interaction.response.send_message("🤖 자동 기부를 껐습니다.", ephemeral=True)
+        return
+    
+    if schedule.value == 'threshold':
+        if target is None or not config.MIN_AUTO_AMOUNT <= target <= config.MAX_DONATION:
+            await interaction.response.send_message(
+                f"❌ 목표액은 {config.MIN_AUTO_AMOUNT:,} ~ {config.MAX_DONATION:,} sats 사이로 입력하세요.",
+                ephemeral=True
+            )
+            return
+        user = await database.update_auto_donate_setting(
+            user_id, True, database.AUTO_DONATE_THRESHOLD, target_amount=target
+        )
+        if user is None:
+            await interaction.response.send_message("❌ 설정을 저장하지 못했습니다. 다시 시도해주세요.", ephemeral=True)
+            return
+        await interaction.response.send_message(
+            f"🤖 자동 기부: **누적 {target:,} sats 도달 시**\n"
+            f"현재 누적: {user['accumulated_sats']:,} sats\n"
+            f"목표액을 넘는 운동을 기록하면 누적된 sats만큼 Invoice를 DM으로 보내드립니다.",
+            ephemeral=True
+        )
+        return
+    
+    if schedule.value == 'weekly':
+        day = 0 if day is None else day
+        if not 0 <= day <= 6:
+            await interaction.response.send_message("❌ 요일은 0(월) ~ 6(일) 사이로 입력하세요.", ephemeral=True)
+            return
+    elif schedule.value == 'monthly':
+        day = 1 if day is None else day
+        if not 1 <= day <= 28:
+            await interaction.response.send_message("❌ 날짜는 1 ~ 28 사이로 입력하세요.", ephemeral=True)
+            return
+    else:
+        day = None
+    
+    next_date = next_auto_donate_date(schedule.value, day, config.local_now())
+    user = await database.update_auto_donate_setting(
+        user_id, True, database.AUTO_DONATE_SCHEDULE, schedule.value, day, next_date=next_date
+    )
+    if user is None:
+        await interaction.response.send_message("❌ 설정을 저장하지 못했습니다. 다시 시도해주세요.", ephemeral=True)
+        return
+    
+    await interaction.response.send_message(
+        f"🤖 자동 기부: **{format_auto_donate_schedule(schedule.value, day)}**\n"
+        f"다음 기부일: {next_date[:10]}\n"
+        f"예정일이 되면 누적된 sats만큼 Invoice를 DM으로 보내드립니다.",
+        ephemeral=True
+    )
+
 @bot.tree.command(name="운동", description="운동 기록")
 @commands.cooldown(1, 60, commands.BucketType.user)
 async def exercise(interaction: discord.Interaction):
@@ -382,15 +597,90 @@ async def exercise(interaction: discord.Interaction):
     )
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
+@bot.tree.command(name="운동가져오기", description="운동 기록 파일 가져오기 (CSV/GPX/FIT)")
+@commands.cooldown(1, 60, commands.BucketType.user)
+@app_commands.rename(file='파일', exercise_type='종류')
+@app_commands.describe(
+    file='CSV (date,type,value,memo), GPX 또는 FIT 파일',
+    exercise_type='파일에 운동 종류가 없을 때 사용할 종류'
+)
+@app_commands.choices(exercise_type=[
+    app_commands.Choice(name=ex_type['name'], value=key) for key, ex_type in config.EXERCISE_TYPES.items()
+])
+async def import_exercise(interaction: discord.Interaction, file: discord.Attachment,
+                          exercise_type: Optional[app_commands.Choice[str]] = None):
+    """운동 기록 파일 가져오기"""
+    user_id = str(interaction.user.id)
+    if not await database.get_user(user_id):
+        await interaction.response.send_message("❌ 먼저 /운동설정 명령으로 설정을 진행하세요.", ephemeral=True)
+        return
+    
+    file_format = workout_import.detect_format(file.filename)
+    if file_format is None:
+        await interaction.response.send_message("❌ CSV, GPX, FIT 파일만 가져올 수 있습니다.", ephemeral=True)
+        return
+    if file.size > config.IMPORT_MAX_FILE_SIZE:
+        await interaction.response.send_message(
+            f"❌ 파일이 너무 큽니다. (최대 {config.IMPORT_MAX_FILE_SIZE // (1024 * 1024)}MB)", ephemeral=True
+        )
+        return
+    
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    
+    # 첨부 파일은 디스크에 받은 뒤 워커 프로세스가 스트리밍으로 파싱
+    fd, path = tempfile.mkstemp(suffix=f'.{file_format}')
+    os.close(fd)
+    try:
+        await file.save(path)
+        rows, skipped = await workout_import.parse_in_worker(
+            path, file_format, exercise_type.value if exercise_type else None
+        )
+    except workout_import.WorkoutImportError as e:
+        await interaction.followup.send(f"❌ {e}", ephemeral=True)
+        return
+    except Exception as e:
+        logger.error(f"Workout import parse error for {user_id}: {e}")
+        await interaction.followup.send("❌ 파일을 읽지 못했습니다. 형식을 확인해주세요.", ephemeral=True)
+        return
+    finally:
+        os.remove(path)
+    
+    if not rows:
+        await interaction.followup.send(f"❌ 가져올 수 있는 기록이 없습니다. (건너뛴 항목 {skipped:,}건)", ephemeral=True)
+        return
+    
+    result = await database.import_exercise_logs(user_id, rows)
+    if result is None:
+        await interaction.followup.send("❌ 기록 저장에 실패했습니다. 잠시 후 다시 시도하세요.", ephemeral=True)
+        return
+    
+    user = result['user']
+    embed = discord.Embed(title="📥 운동 기록 가져오기 완료", color=0x00FF00)
+    embed.add_field(name="저장", value=f"{result['imported']:,}건", inline=True)
+    embed.add_field(name="추가 기부금", value=f"{result['sats']:,} sats", inline=True)
+    embed.add_field(name="💼 누적 기부금", value=f"{user['accumulated_sats']:,} sats", inline=True)
+    
+    notes = []
+    if result['duplicates']:
+        notes.append(f"이미 있는 기록 {result['duplicates']:,}건")
+    if result['unrated']:
+        notes.append(f"기부 설정이 없는 운동 {result['unrated']:,}건 (/운동설정)")
+    if skipped:
+        notes.append(f"읽을 수 없거나 범위를 벗어난 항목 {skipped:,}건")
+    if notes:
+        embed.add_field(name="건너뜀", value="\n".join(notes), inline=False)
+    
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="내통계", description="개인 통계 조회")
 async def my_stats(interaction: discord.Interaction):
     """개인 통계 조회"""
-    user = await database.get_user(str(interaction.user.id))
-    if not user:
+    # 통계와 순위를 한 번에 조회
+    stats = await rankings.get_user_stats_with_ranks(str(interaction.user.id), guild_key(interaction))
+    if not stats:
         await interaction.response.send_message("❌ 기록된 통계가 없습니다.")
         return
     
-    stats = await database.get_user_stats(str(interaction.user.id))
     embed = discord.Embed(title="🏃 운동 통계", color=0x2E75B6)
     
     exercise_text = ""
@@ -411,10 +701,10 @@ async def my_stats(interaction: discord.Interaction):
     donation_text += f"💸 총 기부액: {stats['total_donated_sats']:,} sats"
     embed.add_field(name="【기부 정보】", value=donation_text, inline=False)
     
-    donation_rank = await database.get_user_rank(str(interaction.user.id), 'donation')
-    distance_rank = await database.get_user_rank(str(interaction.user.id), 'distance')
-    weight_rank = await database.get_user_rank(str(interaction.user.id), 'weight')
-    total_users = await database.get_total_users()
+    donation_rank = stats['ranks']['donation']
+    distance_rank = stats['ranks']['distance']
+    weight_rank = stats['ranks']['weight']
+    total_users = stats['total_users']
     
     rank_text = f"🏆 기부 순위: {donation_rank}위 / {total_users}명\n"
     rank_text += f"📊 거리 순위: {distance_rank}위 / {total_users}명\n"
@@ -424,16 +714,47 @@ async def my_stats(interaction: discord.Interaction):
     await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="운동순위", description="리더보드 조회")
-async def leaderboard(interaction: discord.Interaction):
+@app_commands.rename(period='기간', start='시작일', end='종료일')
+@app_commands.describe(
+    period='순위 기간 (기본: 전체)',
+    start='직접 지정 시작일 (YYYY-MM-DD)',
+    end='직접 지정 종료일 (YYYY-MM-DD)'
+)
+@app_commands.choices(period=[
+    app_commands.Choice(name='전체', value='all'),
+    app_commands.Choice(name='이번 주', value='week'),
+    app_commands.Choice(name='이번 달', value='month'),
+])
+async def leaderboard(interaction: discord.Interaction, period: Optional[app_commands.Choice[str]] = None,
+                      start: Optional[str] = None, end: Optional[str] = None):
     """리더보드 조회"""
-    # 기본값: 전체 거리 순위
-    leaders = await database.get_leaderboard('distance', 10)
+    period_range = None
+    period_label = '전체'
+    
+    if start or end:
+        try:
+            start_day = date.fromisoformat(start or '').isoformat()
+            end_day = date.fromisoformat(end or '').isoformat()
+        except ValueError:
+            await interaction.response.send_message("❌ 시작일과 종료일을 YYYY-MM-DD 형식으로 모두 입력하세요.", ephemeral=True)
+            return
+        if start_day > end_day:
+            await interaction.response.send_message("❌ 시작일이 종료일보다 늦습니다.", ephemeral=True)
+            return
+        period_range = (start_day, end_day)
+        period_label = f"{start_day}~{end_day}"
+    elif period and period.value != 'all':
+        period_range = database.get_period_range(period.value)
+        period_label = period.name
+    
+    # 기본값: 거리 순위
+    leaders = await fetch_leaders(interaction, 'distance', period_range)
     
     if not leaders:
         await interaction.response.send_message("❌ 순위 정보가 없습니다.")
         return
     
-    embed = discord.Embed(title="📊 전체 거리 랭킹 TOP 10", color=0xFFD700)
+    embed = discord.Embed(title=f"📊 {period_label} 거리 랭킹 TOP 10", color=0xFFD700)
     
     rank_text = ""
     medals = ['🥇', '🥈', '🥉']
@@ -446,12 +767,15 @@ async def leaderboard(interaction: discord.Interaction):
     
     embed.description = rank_text
     
-    total_users = await database.get_total_users()
+    total_users = await rankings.get_total_users(guild_key(interaction))
     embed.set_footer(text=f"참여자: {total_users}명\n\n다른 순위를 보려면 아래 버튼을 선택하세요")
     
-    view = LeaderboardView()
+    view = LeaderboardView(period_range, period_label if period_range else None)
     await interaction.response.send_message(embed=embed, view=view)
 
+# Invoice를 만드는 중인 사용자 (기부가 저장되기 전 같은 명령을 다시 실행해도 하나만 생성)
+issuing_donations: Set[str] = set()
+
 @bot.tree.command(name="운동기부", description="기부 실행")
 @commands.cooldown(1, 300, commands.BucketType.user)
 async def donate(interaction: discord.Interaction):
@@ -475,14 +799,34 @@ async def donate(interaction: discord.Interaction):
         )
         return
     
-    # 즉시 응답 (Lightning Invoice 생성 중) - 본인만 보이게
-    await interaction.response.send_message("⏳ Lightning Invoice 생성 중...", ephemeral=True)
+    # 처리 중인 기부가 있으면 새 Invoice를 만들지 않음 (중복 결제/전송 방지)
+    user_id = str(interaction.user.id)
+    pending = await database.get_unfinished_donation(user_id)
+    if pending is not None or user_id in issuing_donations:
+        pending_info = f" (기부 번호 #{pending['donation_id']})" if pending is not None else ""
+        await interaction.response.send_message(
+            f"⏳ 이미 처리 중인 기부가 있습니다{pending_info}.\n"
+            f"결제를 마치거나 만료된 뒤 다시 시도해주세요.",
+            ephemeral=True
+        )
+        return
+    # 확인 직후 바로 표시 (await 없이) - 동시에 실행된 같은 명령은 위에서 걸러짐
+    issuing_donations.add(user_id)
     
     try:
+        # 즉시 응답 (Lightning Invoice 생성 중) - 본인만 보이게
+        await interaction.response.send_message("⏳ Lightning Invoice 생성 중...", ephemeral=True)
+        
         # Lightning Invoice 생성
         comment = f"운동 기부 - {interaction.user.name}"
         invoice, qr_buffer, payment_hash = await lightning.create_lightning_payment(amount, comment)
         
+        donation_id = await database.create_donation(
+            user_id, amount, invoice, payment_hash, config.DONATION_ADDRESS
+        )
+        if donation_id is None:
+            raise Exception("기부 정보를 저장하지 못했습니다")
+        
         # QR 코드 이미지
         qr_file = discord.File(qr_buffer, filename="invoice_qr.png")
         
@@ -524,88 +868,45 @@ async def donate(interaction: discord.Interaction):
         # 결제 대기 메시지 (본인만 보이게)
         await interaction.followup.send("⏳ 결제 확인 중... (최대 5분)", ephemeral=True)
         
-        # 결제 확인 (5분 타임아웃) - invoice로 확인
-        if invoice:
-            payment_result = await lightning.verify_payment(invoice, timeout=300)
-            
-            if payment_result:
-                # 결제 완료 - citadel@blink.sv로 자동 전송
-                try:
-                    # Lightning Address로 자동 전송
-                    transfer_result = await lightning.send_to_lightning_address(
-                        destination=config.DONATION_ADDRESS,
-                        amount_sats=amount,
-                        memo=f"운동 기부 - {interaction.user.name}"
-                    )
-                    
-                    fee = transfer_result.get("fee", 0)
-                    status = transfer_result.get("status")
-                    
-                    if status == "SUCCESS":
-                        # DB 업데이트
-                        async with database.aiosqlite.connect(config.DATABASE_PATH) as db:
-                            await db.execute('''
-                                UPDATE users 
-                                SET accumulated_sats = accumulated_sats - ?,
-                                    total_donated_sats = total_donated_sats + ?,
-                                    total_donation_count = total_donation_count + 1
-                                WHERE user_id = ?
-                            ''', (amount, amount, str(interaction.user.id)))
-                            
-                            await db.execute('''
-                                INSERT INTO donation_history 
-                                (user_id, amount, lightning_address, donation_type, status, timestamp, lightning_invoice)
-                                VALUES (?, ?, ?, 'manual', 'completed', ?, ?)
-                            ''', (str(interaction.user.id), amount, config.DONATION_ADDRESS, 
-                                  discord.utils.utcnow().isoformat(), invoice))
-                            
-                            await db.commit()
-                        
-                        # 완료 메시지 (공개)
-                        fee_info = "**무료!** (Blink 내부 거래)" if fee == 0 else f"수수료: {fee} sats"
-                        
-                        success_embed = discord.Embed(
-                            title="✅ 기부 완료!",
-                            description=f"**{amount:,} sats** 기부가 완료되었습니다!",
-                            color=0x00FF00
-                        )
-                        success_embed.add_field(name="받는 곳", value=config.DONATION_ADDRESS, inline=False)
-                        success_embed.add_field(name="수수료", value=fee_info, inline=False)
-                        success_embed.add_field(name="감사합니다! 🙏", value="당신의 운동과 기부가 세상을 바꿉니다!", inline=False)
-                        
-                        await interaction.followup.send(embed=success_embed)
-                    else:
-                        await interaction.followup.send(
-                            f"❌ 전송 실패: {status}\n금액은 mrb@blink.sv에 보관되어 있습니다.",
-                            ephemeral=True
-                        )
-                    
-                except Exception as transfer_error:
-                    # 전송 실패
-                    await interaction.followup.send(
-                        f"❌ 기부 전송 중 오류가 발생했습니다.\n"
-                        f"오류: {str(transfer_error)}\n\n"
-                        f"금액은 mrb@blink.sv에 보관되어 있습니다.\n"
-                        f"수동으로 전송해주세요.",
-                        ephemeral=True
-                    )
+        # 결제 확인 → 기부 지갑 전송 (상태는 DB에 저장되어 재시작 후에도 이어서 처리)
+        donation = await donation_worker.wait(donation_id)
+        status = donation['status'] if donation else None
+        
+        if status == database.DONATION_FORWARDED:
+            # 완료 메시지 (공개)
+            fee = donation['fee'] or 0
+            fee_info = "**무료!** (Blink 내부 거래)" if fee == 0 else f"수수료: {fee} sats"
             
-            elif payment_result is False:
-                # 결제 실패 (본인만)
-                await interaction.followup.send("❌ 결제가 실패했습니다. 다시 시도해주세요.", ephemeral=True)
+            success_embed = discord.Embed(
+                title="✅ 기부 완료!",
+                description=f"**{amount:,} sats** 기부가 완료되었습니다!",
+                color=0x00FF00
+            )
+            success_embed.add_field(name="받는 곳", value=config.DONATION_ADDRESS, inline=False)
+            success_embed.add_field(name="수수료", value=fee_info, inline=False)
+            success_embed.add_field(name="감사합니다! 🙏", value="당신의 운동과 기부가 세상을 바꿉니다!", inline=False)
             
-            else:
-                # verify_url 없음 (결제 확인 불가) - 본인만
-                await interaction.followup.send(
-                    "⚠️ 자동 결제 확인이 불가능합니다.\n"
-                    "결제 후 `/기부내역`으로 확인해주세요.",
-                    ephemeral=True
-                )
+            await interaction.followup.send(embed=success_embed)
+        
+        elif status == database.DONATION_FAILED and not donation['paid_at']:
+            # 결제 실패 (본인만)
+            await interaction.followup.send("❌ 결제가 실패했습니다. 다시 시도해주세요.", ephemeral=True)
+        
+        elif status == database.DONATION_FAILED:
+            # 결제는 됐지만 전송 실패 (본인만)
+            await interaction.followup.send(
+                f"❌ 기부 전송 중 오류가 발생했습니다.\n"
+                f"오류: {donation['error_message']}\n\n"
+                f"결제된 금액은 봇 지갑에 남아 있으며 자동으로 다시 전송되지 않습니다.\n"
+                f"관리자에게 기부 번호 #{donation_id}를 알려주시면 다시 전송할 수 있습니다.",
+                ephemeral=True
+            )
+        
         else:
-            # verify_url 없음 - 본인만
+            # 아직 처리 중 (다른 프로세스가 이어받았거나 재시도 대기)
             await interaction.followup.send(
-                "⚠️ 자동 결제 확인이 불가능합니다.\n"
-                "결제 완료 후 관리자에게 문의하거나 `/기부내역`으로 확인해주세요.",
+                "⏳ 기부를 처리 중입니다.\n"
+                "완료되면 `/기부내역`에서 확인할 수 있습니다.",
                 ephemeral=True
             )
     
@@ -618,20 +919,14 @@ async def donate(interaction: discord.Interaction):
             ephemeral=True  # 에러도 본인만
         )
         print(f"Lightning payment error: {e}")
+    finally:
+        issuing_donations.discard(user_id)
 
 
 @bot.tree.command(name="기부내역", description="기부 내역 조회")
 async def donation_history(interaction: discord.Interaction):
     """기부 내역 조회"""
-    async with database.aiosqlite.connect(config.DATABASE_PATH) as db:
-        db.row_factory = database.aiosqlite.Row
-        async with db.execute('''
-            SELECT * FROM donation_history 
-            WHERE user_id = ? AND status = 'completed'
-            ORDER BY timestamp DESC
-            LIMIT 10
-        ''', (str(interaction.user.id),)) as cursor:
-            donations = await cursor.fetchall()
+    donations = await database.get_recent_donations(str(interaction.user.id), 10)
     
     if not donations:
         await interaction.response.send_message("❌ 기부 내역이 없습니다.")
@@ -653,6 +948,81 @@ async def donation_history(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="데이터내보내기", description="운동 기록/기부 내역 파일로 받기")
+@commands.cooldown(1, 300, commands.BucketType.user)
+@app_commands.rename(data='데이터', file_format='형식', scope='범위')
+@app_commands.describe(
+    data='내보낼 데이터 (기본: 전체)',
+    file_format='파일 형식 (기본: CSV)',
+    scope='내 기록 또는 이 서버 멤버 전체 (서버 관리 권한 필요)'
+)
+@app_commands.choices(
+    data=[
+        app_commands.Choice(name='전체', value='all'),
+        app_commands.Choice(name='운동 기록', value='exercise_logs'),
+        app_commands.Choice(name='기부 내역', value='donation_history'),
+    ],
+    file_format=[
+        app_commands.Choice(name='CSV', value='csv'),
+        app_commands.Choice(name='Parquet', value='parquet'),
+    ],
+    scope=[
+        app_commands.Choice(name='나', value='user'),
+        app_commands.Choice(name='이 서버', value='guild'),
+    ]
+)
+async def export_data(interaction: discord.Interaction, data: Optional[app_commands.Choice[str]] = None,
+                      file_format: Optional[app_commands.Choice[str]] = None,
+                      scope: Optional[app_commands.Choice[str]] = None):
+    """운동 기록/기부 내역 내보내기"""
+    scope_value = scope.value if scope else 'user'
+    if scope_value == 'guild':
+        if interaction.guild is None:
+            await interaction.response.send_message("❌ 서버 범위는 서버 채널에서만 사용할 수 있습니다.", ephemeral=True)
+            return
+        if not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message("❌ 서버 전체 내보내기는 서버 관리 권한이 필요합니다.", ephemeral=True)
+            return
+        scope_id = str(interaction.guild_id)
+    else:
+        scope_id = str(interaction.user.id)
+    
+    tables = list(data_export.EXPORT_TABLES) if data is None or data.value == 'all' else [data.value]
+    fmt = file_format.value if file_format else 'csv'
+    
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    
+    # 임시 디렉터리에 묶음 단위로 쓴 뒤 첨부 (업로드가 끝나면 삭제)
+    with tempfile.TemporaryDirectory(prefix='export_') as directory:
+        prefix = f"{scope_value}_{scope_id}_{config.local_now().date().isoformat()}"
+        try:
+            results = await data_export.export_data(directory, tables, fmt, scope_value, scope_id, prefix)
+        except data_export.ExportError as e:
+            await interaction.followup.send(f"❌ {e}", ephemeral=True)
+            return
+        except Exception as e:
+            logger.error(f"Export error for {scope_value} {scope_id}: {e}")
+            await interaction.followup.send("❌ 내보내기에 실패했습니다. 잠시 후 다시 시도하세요.", ephemeral=True)
+            return
+        
+        upload_limit = config.EXPORT_MAX_UPLOAD_SIZE
+        if interaction.guild is not None:
+            upload_limit = min(upload_limit, interaction.guild.filesize_limit)
+        
+        files = []
+        summary = []
+        for table, (path, count) in results.items():
+            size = os.path.getsize(path)
+            if size > upload_limit:
+                summary.append(f"⚠️ {table}: {count:,}행 - 파일이 너무 큽니다 ({size / (1024 * 1024):.1f}MB)")
+                continue
+            files.append(discord.File(path, filename=os.path.basename(path)))
+            summary.append(f"📄 {table}: {count:,}행")
+        
+        if not files:
+            summary.append("관리자에게 `manage.py export`로 받아달라고 요청하세요.")
+        await interaction.followup.send("\n".join(summary), files=files, ephemeral=True)
+
 @bot.tree.command(name="사용법", description="사용법 안내")
 async def help_command(interaction: discord.Interaction):
     """사용법 안내"""
@@ -664,25 +1034,25 @@ async def help_command(interaction: discord.Interaction):
     
     embed.add_field(
         name="⚙️ 설정",
-        value="`/운동설정` - 기부액 설정\n`/내설정` - 현재 설정 확인",
+        value="`/운동설정` - 기부액 설정\n`/자동기부설정` - 자동 기부 (매일/매주/매월/목표액 도달 시)\n`/내설정` - 현재 설정 확인",
         inline=False
     )
     
     embed.add_field(
         name="🏃 운동 기록",
-        value="`/운동` - 운동 기록하기",
+        value="`/운동` - 운동 기록하기\n`/운동가져오기` - CSV/GPX/FIT 파일로 여러 기록 가져오기",
         inline=False
     )
     
     embed.add_field(
         name="📊 통계",
-        value="`/내통계` - 개인 통계\n`/운동순위` - 리더보드",
+        value="`/내통계` - 개인 통계\n`/운동순위` - 리더보드 (기간: 전체/이번 주/이번 달)",
         inline=False
     )
     
     embed.add_field(
         name="💰 기부",
-        value="`/운동기부` - 기부하기\n`/기부내역` - 기부 이력",
+        value="`/운동기부` - 기부하기\n`/기부내역` - 기부 이력\n`/데이터내보내기` - 운동 기록/기부 내역 파일로 받기",
         inline=False
     )
     
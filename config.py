@@ -4,6 +4,8 @@ Exercise Donation Bot - Configuration
 """
 import os
 import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 
 # 환경변수 로드
@@ -28,11 +30,23 @@ DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 # ===========================================
 BLINK_API_KEY = os.getenv('BLINK_API_KEY')
 BLINK_API_ENDPOINT = os.getenv('BLINK_API_ENDPOINT', 'https://api.blink.sv/graphql')
+BLINK_WS_ENDPOINT = os.getenv('BLINK_WS_ENDPOINT', 'wss://ws.blink.sv/graphql')
+WALLET_ID_CACHE_TTL = int(os.getenv('WALLET_ID_CACHE_TTL', '86400'))  # seconds (24시간)
 
 # ===========================================
 # Database 설정
 # ===========================================
 DATABASE_PATH = os.getenv('DATABASE_PATH', './data/exercise_bot.db')
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'WAL')  # WAL: 쓰기 중에도 읽기 가능
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')  # WAL에서는 NORMAL로도 손상 없음
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '-16000'))  # 음수면 KiB 단위 (16MB)
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', '268435456'))  # bytes (256MB)
+DB_TEMP_STORE = os.getenv('DB_TEMP_STORE', 'MEMORY')
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', '5000'))  # milliseconds
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))  # 읽기 전용 연결 수 (0이면 쓰기 연결 공유)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))  # 메모리에 유지할 사용자 행 수 (0이면 캐시 안 함)
+EXERCISE_BATCH_WINDOW_MS = int(os.getenv('EXERCISE_BATCH_WINDOW_MS', '5'))  # 운동 기록 group commit 대기 시간 (0이면 건별 커밋)
+EXERCISE_BATCH_MAX_SIZE = int(os.getenv('EXERCISE_BATCH_MAX_SIZE', '100'))  # 한 트랜잭션에 묶을 최대 기록 수
 
 # ===========================================
 # Donation 설정
@@ -44,6 +58,14 @@ DONATION_ADDRESS = os.getenv('DONATION_ADDRESS', 'citadel@blink.sv')
 # ===========================================
 ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
 IS_PRODUCTION = ENVIRONMENT == 'production'
+TIMEZONE = os.getenv('TZ') or 'Asia/Seoul'  # 날짜 경계 기준 시간대 (연속 운동일, 일별 집계)
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+
+def local_now() -> datetime:
+    """설정 시간대(TZ) 기준 현재 시각 (저장된 시각과 같은 naive ISO 형식)"""
+    return datetime.now(LOCAL_TZ).replace(tzinfo=None)
+
 
 # ===========================================
 # Donation Limits
@@ -68,6 +90,71 @@ RETRY_DELAY = int(os.getenv('RETRY_DELAY', '1'))  # seconds
 # ===========================================
 PAYMENT_CHECK_INTERVAL = int(os.getenv('PAYMENT_CHECK_INTERVAL', '5'))  # seconds
 PAYMENT_TIMEOUT = int(os.getenv('PAYMENT_TIMEOUT', '300'))  # seconds (5분)
+PAYMENT_CHECK_MAX_INTERVAL = int(os.getenv('PAYMENT_CHECK_MAX_INTERVAL', '30'))  # seconds (오류 시 최대 간격)
+PAYMENT_BATCH_SIZE = int(os.getenv('PAYMENT_BATCH_SIZE', '50'))  # 요청당 최대 Invoice 수
+PAYMENT_SUBSCRIPTIONS_ENABLED = os.getenv('PAYMENT_SUBSCRIPTIONS_ENABLED', 'true').lower() == 'true'
+PAYMENT_WS_FALLBACK_INTERVAL = int(os.getenv('PAYMENT_WS_FALLBACK_INTERVAL', '60'))  # seconds (구독 중 보조 폴링)
+PAYMENT_WS_IDLE_TIMEOUT = int(os.getenv('PAYMENT_WS_IDLE_TIMEOUT', '60'))  # seconds (대기 Invoice 없을 때 연결 종료)
+
+# ===========================================
+# 기부 처리 설정
+# ===========================================
+FORWARD_MAX_ATTEMPTS = int(os.getenv('FORWARD_MAX_ATTEMPTS', '5'))  # 기부 지갑 전송 최대 시도 횟수
+FORWARD_BATCH_SIZE = int(os.getenv('FORWARD_BATCH_SIZE', '20'))  # 이 건수가 모이면 즉시 묶음 전송
+FORWARD_BATCH_WINDOW = int(os.getenv('FORWARD_BATCH_WINDOW', '30'))  # seconds (0이면 묶지 않고 바로 전송)
+FORWARD_PENDING_CHECK_INTERVAL = int(os.getenv('FORWARD_PENDING_CHECK_INTERVAL', '30'))  # seconds (진행 중 전송 상태 재확인)
+DONATION_LEASE_SECONDS = int(os.getenv('DONATION_LEASE_SECONDS', str(PAYMENT_TIMEOUT + 300)))  # 처리 중 기부 점유 시간
+
+# ===========================================
+# LNURL-pay 캐시 설정
+# ===========================================
+LNURL_CACHE_SIZE = int(os.getenv('LNURL_CACHE_SIZE', '256'))  # 캐시할 Lightning Address 수
+LNURL_CACHE_TTL = int(os.getenv('LNURL_CACHE_TTL', '3600'))  # seconds
+LNURL_NEGATIVE_CACHE_TTL = int(os.getenv('LNURL_NEGATIVE_CACHE_TTL', '60'))  # seconds (확정적인 조회 실패 캐시)
+
+# ===========================================
+# HTTP 커넥션 풀 설정
+# ===========================================
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '20'))  # 전체 동시 연결 수
+HTTP_POOL_SIZE_PER_HOST = int(os.getenv('HTTP_POOL_SIZE_PER_HOST', '10'))  # 호스트당 동시 연결 수
+HTTP_KEEPALIVE_TIMEOUT = int(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '60'))  # seconds
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))  # seconds
+
+# ===========================================
+# QR 코드 설정
+# ===========================================
+QR_RENDER_EXECUTOR = os.getenv('QR_RENDER_EXECUTOR', 'thread')  # thread / process
+QR_RENDER_WORKERS = int(os.getenv('QR_RENDER_WORKERS', '2'))
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '128'))  # 캐시할 QR 이미지 수
+QR_OPTIMIZE_PNG = os.getenv('QR_OPTIMIZE_PNG', 'false').lower() == 'true'  # 1bit PNG 최적화 압축 (용량 감소)
+
+# ===========================================
+# 리더보드 설정
+# ===========================================
+LEADERBOARD_MEMORY_ENABLED = os.getenv('LEADERBOARD_MEMORY_ENABLED', 'true').lower() == 'true'  # 메모리 리더보드 사용
+LEADERBOARD_VERIFY_INTERVAL = int(os.getenv('LEADERBOARD_VERIFY_INTERVAL', '3600'))  # seconds (DB 일치 검사, 0이면 끔)
+
+# ===========================================
+# 자동 기부 설정
+# ===========================================
+AUTO_DONATE_CHECK_INTERVAL = int(os.getenv('AUTO_DONATE_CHECK_INTERVAL', '300'))  # seconds (예정일 지난 사용자 확인 주기, 0이면 끔)
+AUTO_DONATE_BATCH_SIZE = int(os.getenv('AUTO_DONATE_BATCH_SIZE', '200'))  # 한 번에 조회/갱신할 사용자 수
+AUTO_DONATE_CONCURRENCY = int(os.getenv('AUTO_DONATE_CONCURRENCY', '5'))  # 동시에 만드는 Invoice 수
+AUTO_DONATE_WORKERS = int(os.getenv('AUTO_DONATE_WORKERS', '2'))  # 목표액 자동 기부 작업을 동시에 처리할 워커 수
+AUTO_DONATE_RATE_PER_SECOND = float(os.getenv('AUTO_DONATE_RATE_PER_SECOND', '5'))  # 초당 최대 Invoice 생성 수 (0이면 제한 없음)
+
+# ===========================================
+# 운동 기록 가져오기 설정
+# ===========================================
+IMPORT_MAX_FILE_SIZE = int(os.getenv('IMPORT_MAX_FILE_SIZE', '26214400'))  # bytes (25MB)
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', '100000'))  # 파일 하나에서 가져올 최대 기록 수
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', '1'))  # 파일 파싱 워커 프로세스 수
+
+# ===========================================
+# 데이터 내보내기 설정
+# ===========================================
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))  # DB에서 한 번에 읽어 파일에 쓰는 행 수
+EXPORT_MAX_UPLOAD_SIZE = int(os.getenv('EXPORT_MAX_UPLOAD_SIZE', '10485760'))  # bytes (Discord 첨부 한도, 10MB)
 
 # ===========================================
 # Exercise Types
@@ -110,6 +197,15 @@ EXERCISE_TYPES = {
     }
 }
 
+# 기록 1건당 최대 입력값 (직접 입력/파일 가져오기 공통)
+EXERCISE_MAX_VALUES = {
+    'walking': 1000,  # km
+    'cycling': 1000,  # km
+    'running': 500,   # km
+    'swimming': 100,  # km
+    'weight': 500     # kg
+}
+
 # ===========================================
 # Validation
 # ===========================================
@@ -137,8 +233,9 @@ def validate_config():
 def print_config():
     """설정 정보 출력 (디버깅용, 민감정보 마스킹)"""
     logger.info("=== Configuration ===")
-    logger.info(f"ENVIRONMENT: {ENVIRONMENT}")
+    logger.info(f"ENVIRONMENT: {ENVIRONMENT}, TIMEZONE: {TIMEZONE}")
     logger.info(f"DATABASE_PATH: {DATABASE_PATH}")
+    logger.info(f"DB_JOURNAL_MODE: {DB_JOURNAL_MODE}, DB_SYNCHRONOUS: {DB_SYNCHRONOUS}")
     logger.info(f"DONATION_ADDRESS: {DONATION_ADDRESS}")
     logger.info(f"BLINK_API_ENDPOINT: {BLINK_API_ENDPOINT}")
     logger.info(f"DISCORD_TOKEN: {'*' * 10}...{DISCORD_TOKEN[-4:] if DISCORD_TOKEN else 'NOT SET'}")
@@ -0,0 +1,102 @@
+"""
+Exercise Donation Bot - Data Export
+exercise_logs / donation_history 내보내기 (CSV / Parquet)
+
+database.iter_export_rows가 EXPORT_CHUNK_SIZE행씩 넘겨주는 대로 파일에 바로 쓰므로
+기록이 아무리 많아도 메모리에는 한 묶음만 올라간다. Parquet은 묶음마다 row group 하나를 쓴다.
+"""
+import asyncio
+import csv
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+import database
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet 내보내기는 선택 기능
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_TABLES = tuple(database.EXPORT_COLUMNS)
+
+# Parquet 컬럼 타입 (나머지는 문자열)
+PARQUET_INT_COLUMNS = {'log_id', 'donation_id', 'calculated_sats', 'amount', 'fee'}
+PARQUET_FLOAT_COLUMNS = {'value'}
+
+
+class ExportError(Exception):
+    """내보낼 수 없음 (메시지는 사용자에게 그대로 표시)"""
+
+
+def _parquet_schema(columns: Tuple[str, ...]):
+    fields = []
+    for column in columns:
+        if column in PARQUET_INT_COLUMNS:
+            fields.append((column, pa.int64()))
+        elif column in PARQUET_FLOAT_COLUMNS:
+            fields.append((column, pa.float64()))
+        else:
+            fields.append((column, pa.string()))
+    return pa.schema(fields)
+
+
+async def _write_csv(path: str, table: str, scope: str, scope_id: Optional[str]) -> int:
+    count = 0
+    # utf-8-sig: 엑셀에서 한글 메모가 깨지지 않도록
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(database.EXPORT_COLUMNS[table])
+        async for rows in database.iter_export_rows(table, scope, scope_id):
+            writer.writerows(tuple(row) for row in rows)
+            count += len(rows)
+    return count
+
+
+async def _write_parquet(path: str, table: str, scope: str, scope_id: Optional[str]) -> int:
+    if pa is None:
+        raise ExportError("Parquet으로 내보내려면 서버에 pyarrow 패키지가 설치되어 있어야 합니다.")
+
+    columns = database.EXPORT_COLUMNS[table]
+    schema = _parquet_schema(columns)
+    count = 0
+    writer = pq.ParquetWriter(path, schema)
+    try:
+        async for rows in database.iter_export_rows(table, scope, scope_id):
+            # 행 묶음 → 컬럼별 목록
+            data = {column: list(values) for column, values in zip(columns, zip(*rows))}
+            batch = pa.Table.from_pydict(data, schema=schema)
+            await asyncio.to_thread(writer.write_table, batch)
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+
+async def export_table(path: str, table: str, file_format: str, scope: str,
+                       scope_id: Optional[str] = None) -> int:
+    """테이블 하나를 파일로 내보내기 - 행 수 반환"""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Invalid export table: {table}")
+    if file_format == 'csv':
+        count = await _write_csv(path, table, scope, scope_id)
+    elif file_format == 'parquet':
+        count = await _write_parquet(path, table, scope, scope_id)
+    else:
+        raise ValueError(f"Invalid export format: {file_format}")
+
+    logger.info(f"Exported {count} {table} rows ({scope} {scope_id or ''}) to {path}")
+    return count
+
+
+async def export_data(directory: str, tables: List[str], file_format: str, scope: str,
+                      scope_id: Optional[str] = None, prefix: str = 'export') -> Dict[str, Tuple[str, int]]:
+    """여러 테이블을 directory에 내보내기 - {테이블: (파일 경로, 행 수)}"""
+    results = {}
+    for table in tables:
+        path = os.path.join(directory, f"{prefix}_{table}.{file_format}")
+        results[table] = (path, await export_table(path, table, file_format, scope, scope_id))
+    return results
@@ -3,10 +3,13 @@ Exercise Donation Bot - Database Manager
 데이터베이스 연결 및 쿼리 관리
 """
 import aiosqlite
+import asyncio
 import os
 import logging
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Iterable, Tuple
 import config
 
 logger = logging.getLogger(__name__)
@@ -22,14 +25,140 @@ ALLOWED_TOTAL_FIELDS = {
 }
 ALLOWED_RANKING_FIELDS = {
     'total_walking_km', 'total_cycling_km', 'total_running_km',
-    'total_swimming_km', 'total_weight_kg', 'total_donated_sats', 'streak_days'
+    'total_swimming_km', 'total_weight_kg', 'total_donated_sats', 'total_donation_count',
+    'streak_days'
 }
 
+# 리더보드 카테고리별 정렬 식 (migration에서 같은 식으로 인덱스 생성)
+DISTANCE_TOTAL_COLUMNS = ('total_walking_km', 'total_cycling_km', 'total_running_km', 'total_swimming_km')
+DISTANCE_TOTAL_EXPRESSION = '(' + ' + '.join(DISTANCE_TOTAL_COLUMNS) + ')'
+LEADERBOARD_CATEGORIES = {
+    'distance': DISTANCE_TOTAL_EXPRESSION,
+    'donation': 'total_donated_sats',
+    'donation_count': 'total_donation_count',
+    'walking': 'total_walking_km',
+    'cycling': 'total_cycling_km',
+    'running': 'total_running_km',
+    'swimming': 'total_swimming_km',
+    'weight': 'total_weight_kg',
+    'streak': 'streak_days',
+}
+# 기간별 리더보드 카테고리 -> 합산할 운동 종류 (exercise_daily_rollups 기준)
+PERIOD_LEADERBOARD_CATEGORIES = {
+    'distance': ('walking', 'cycling', 'running', 'swimming'),
+    'walking': ('walking',),
+    'cycling': ('cycling',),
+    'running': ('running',),
+    'swimming': ('swimming',),
+    'weight': ('weight',),
+}
+
+for _expression in LEADERBOARD_CATEGORIES.values():
+    if _expression != DISTANCE_TOTAL_EXPRESSION and _expression not in ALLOWED_RANKING_FIELDS:
+        raise ValueError(f"Invalid ranking field name: {_expression}")
+
+# 기부 진행 상태 (donation_history.status)
+DONATION_INVOICE_CREATED = 'invoice_created'
+DONATION_PAID = 'paid'
+DONATION_FORWARDING = 'forwarding'
+DONATION_FORWARDED = 'forwarded'
+DONATION_FAILED = 'failed'
+DONATION_UNFINISHED_STATES = (DONATION_INVOICE_CREATED, DONATION_PAID, DONATION_FORWARDING)
+DONATION_UNPAID_ERROR = 'payment_not_received'  # 결제 시간 안에 결제되지 않아 failed가 된 기부의 error_message
+# 이전 버전에서 완료된 기부는 'completed'로 저장됨
+DONATION_DONE_STATES = (DONATION_FORWARDED, 'completed')
+
+# 자동 기부 방식 (users.auto_donate_type)
+AUTO_DONATE_SCHEDULE = 'schedule'  # 정해진 주기마다
+AUTO_DONATE_THRESHOLD = 'threshold'  # 누적액이 목표에 도달하면
+# 자동 기부 주기 (users.auto_donate_schedule_type)
+AUTO_DONATE_SCHEDULE_TYPES = ('daily', 'weekly', 'monthly')
+
+# 목표액 자동 기부 작업 상태 (auto_donation_jobs.status)
+AUTO_JOB_PENDING = 'pending'  # 대기 (운동 기록 트랜잭션에서 등록)
+AUTO_JOB_RUNNING = 'running'  # 워커가 Invoice 생성 ~ 기부 종료까지 점유
+AUTO_JOB_DONE = 'done'
+AUTO_JOB_SKIPPED = 'skipped'  # 처리 시점에 조건이 맞지 않음
+AUTO_JOB_FAILED = 'failed'
+AUTO_JOB_OPEN_STATES = (AUTO_JOB_PENDING, AUTO_JOB_RUNNING)
+
+# 묶음 전송 상태 (donation_payouts.status)
+PAYOUT_PENDING = 'pending'
+PAYOUT_FORWARDING = 'forwarding'
+PAYOUT_FORWARDED = 'forwarded'
+PAYOUT_FAILED = 'failed'
+
+# 상태 전이 시 함께 갱신할 수 있는 컬럼
+ALLOWED_DONATION_UPDATE_FIELDS = {
+    'error_message', 'attempts', 'paid_at'
+}
+ALLOWED_AUTO_JOB_UPDATE_FIELDS = {
+    'donation_id', 'error_message', 'locked_by', 'lease_until'
+}
+ALLOWED_PAYOUT_UPDATE_FIELDS = {
+    'error_message', 'forward_invoice', 'attempts'
+}
+
+# 기존 DB에 없을 수 있는 donation_history 컬럼
+DONATION_HISTORY_EXTRA_COLUMNS = {
+    'updated_at': 'TEXT',
+    'paid_at': 'TEXT',
+    'fee': 'INTEGER',
+    'attempts': 'INTEGER DEFAULT 0',
+    'locked_by': 'TEXT',
+    'lease_until': 'TEXT',
+    'payout_id': 'INTEGER',
+}
+
+# 내보내기 컬럼 (첫 컬럼이 기본 키, 처리용 내부 컬럼 제외)
+EXPORT_COLUMNS = {
+    'exercise_logs': (
+        'log_id', 'user_id', 'exercise_type', 'value', 'unit', 'calculated_sats', 'memo', 'timestamp'
+    ),
+    'donation_history': (
+        'donation_id', 'user_id', 'amount', 'lightning_address', 'donation_type', 'status', 'fee',
+        'error_message', 'timestamp', 'paid_at', 'payment_hash', 'lightning_invoice'
+    ),
+}
+EXPORT_SCOPES = ('user', 'guild', 'all')
+
+
+# 연결 시 적용할 PRAGMA 허용값 (PRAGMA는 파라미터 바인딩 불가)
+ALLOWED_JOURNAL_MODES = {'WAL', 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'OFF'}
+ALLOWED_SYNCHRONOUS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+ALLOWED_TEMP_STORE = {'DEFAULT', 'FILE', 'MEMORY'}
+
+
+def get_connection_pragmas() -> List[tuple]:
+    """설정값으로 연결 PRAGMA 목록 생성"""
+    journal_mode = config.DB_JOURNAL_MODE.upper()
+    synchronous = config.DB_SYNCHRONOUS.upper()
+    temp_store = config.DB_TEMP_STORE.upper()
+    
+    if journal_mode not in ALLOWED_JOURNAL_MODES:
+        raise ValueError(f"Invalid DB_JOURNAL_MODE: {journal_mode}")
+    if synchronous not in ALLOWED_SYNCHRONOUS:
+        raise ValueError(f"Invalid DB_SYNCHRONOUS: {synchronous}")
+    if temp_store not in ALLOWED_TEMP_STORE:
+        raise ValueError(f"Invalid DB_TEMP_STORE: {temp_store}")
+    
+    return [
+        ('busy_timeout', int(config.DB_BUSY_TIMEOUT)),
+        ('journal_mode', journal_mode),
+        ('synchronous', synchronous),
+        ('cache_size', int(config.DB_CACHE_SIZE)),
+        ('mmap_size', int(config.DB_MMAP_SIZE)),
+        ('temp_store', temp_store),
+    ]
+
 
 class DatabaseManager:
     """데이터베이스 연결 관리 (싱글톤 패턴)"""
     _instance = None
     _connection = None
+    _write_lock = None
+    _readers = None  # 읽기 전용 연결 풀 (asyncio.Queue)
+    _reader_connections = None
     
     def __new__(cls):
         if cls._instance is None:
@@ -44,93 +173,552 @@ class DatabaseManager:
                 os.makedirs(db_dir)
                 logger.info(f"Created database directory: {db_dir}")
             
-            self._connection = await aiosqlite.connect(config.DATABASE_PATH)
+            # autocommit 모드 - 쓰기는 transaction()에서 명시적으로 BEGIN/COMMIT
+            self._connection = await aiosqlite.connect(config.DATABASE_PATH, isolation_level=None)
             self._connection.row_factory = aiosqlite.Row
+            await self._apply_pragmas(self._connection)
             logger.info(f"Database connected: {config.DATABASE_PATH}")
         
         return self._connection
     
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """쓰기 트랜잭션 (BEGIN IMMEDIATE ~ COMMIT, 예외 시 ROLLBACK)
+
+        공유 연결 하나에서 여러 코루틴의 쓰기가 섞이지 않도록 잠금으로 직렬화한다.
+        """
+        db = await self.get_connection()
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        
+        async with self._write_lock:
+            await db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                await db.rollback()
+                raise
+            else:
+                await db.commit()
+    
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """읽기 전용 연결 대여 (풀이 비어 있으면 반납될 때까지 대기)
+
+        aiosqlite는 연결마다 스레드 하나를 쓰므로, 읽기를 여러 연결로 나누면
+        리더보드/통계 조회가 쓰기 연결 스레드 뒤에 줄 서지 않는다 (WAL 필요).
+        """
+        if config.DB_READ_POOL_SIZE <= 0:
+            yield await self.get_connection()
+            return
+        
+        if self._readers is None:
+            await self._open_readers()
+        
+        connection = await self._readers.get()
+        try:
+            yield connection
+        finally:
+            self._readers.put_nowait(connection)
+    
+    async def _open_readers(self):
+        # DB 파일/스키마는 쓰기 연결이 먼저 만든다
+        await self.get_connection()
+        if self._readers is not None:
+            return
+        
+        readers = asyncio.Queue()
+        connections = []
+        uri = f"file:{os.path.abspath(config.DATABASE_PATH)}?mode=ro"
+        for _ in range(config.DB_READ_POOL_SIZE):
+            connection = await aiosqlite.connect(uri, uri=True)
+            connection.row_factory = aiosqlite.Row
+            await self._apply_pragmas(connection, read_only=True)
+            connections.append(connection)
+            readers.put_nowait(connection)
+        
+        self._reader_connections = connections
+        self._readers = readers
+        logger.info(f"Database read pool opened: {len(connections)} connection(s)")
+    
+    async def _apply_pragmas(self, connection: aiosqlite.Connection, read_only: bool = False):
+        """연결 프로필 (WAL, synchronous, 캐시 등) 적용"""
+        for name, value in get_connection_pragmas():
+            # 저널 모드/동기화는 DB 파일 단위 설정이라 쓰기 연결에서만 적용
+            if read_only and name in ('journal_mode', 'synchronous'):
+                continue
+            await connection.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            await connection.execute('PRAGMA query_only = 1')
+    
+    async def get_connection_profile(self) -> Dict[str, Any]:
+        """현재 연결에 적용된 PRAGMA 값 조회"""
+        db = await self.get_connection()
+        profile = {}
+        for name, _ in get_connection_pragmas():
+            async with db.execute(f'PRAGMA {name}') as cursor:
+                row = await cursor.fetchone()
+                profile[name] = row[0] if row else None
+        return profile
+    
     async def close(self):
         """DB 연결 종료"""
+        if self._reader_connections:
+            for connection in self._reader_connections:
+                await connection.close()
+            self._reader_connections = None
+            self._readers = None
+        
         if self._connection:
             await self._connection.close()
             self._connection = None
             logger.info("Database connection closed")
+        
+        # 잠금은 처음 경합한 이벤트 루프에 묶이므로 다음 연결(다른 루프일 수 있음)에서 새로 만듦
+        self._write_lock = None
 
 
 # 전역 DB 매니저
 db_manager = DatabaseManager()
 
+# 사용자 행 변경 리스너 (커밋 후 변경된 users 행으로 호출, 예: 메모리 리더보드)
+_user_listeners: List[Callable[[aiosqlite.Row], None]] = []
 
-async def init_db():
-    """데이터베이스 초기화"""
-    try:
-        db = await db_manager.get_connection()
-        
-        # users 테이블
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                username TEXT,
-                walking_sats_per_km INTEGER DEFAULT 0,
-                cycling_sats_per_km INTEGER DEFAULT 0,
-                running_sats_per_km INTEGER DEFAULT 0,
-                weight_sats_per_kg INTEGER DEFAULT 0,
-                swimming_sats_per_km INTEGER DEFAULT 0,
-                total_walking_km REAL DEFAULT 0,
-                total_cycling_km REAL DEFAULT 0,
-                total_running_km REAL DEFAULT 0,
-                total_weight_kg REAL DEFAULT 0,
-                total_swimming_km REAL DEFAULT 0,
-                accumulated_sats INTEGER DEFAULT 0,
-                total_donated_sats INTEGER DEFAULT 0,
-                total_donation_count INTEGER DEFAULT 0,
-                created_at TEXT,
-                last_exercise_date TEXT,
-                streak_days INTEGER DEFAULT 0,
-                auto_donate_enabled INTEGER DEFAULT 0,
-                auto_donate_type TEXT,
-                auto_donate_target_amount INTEGER,
-                auto_donate_schedule_type TEXT,
-                auto_donate_schedule_day INTEGER,
-                next_auto_donate_date TEXT
-            )
-        ''')
-        
-        # exercise_logs 테이블
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS exercise_logs (
-                log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                exercise_type TEXT,
-                value REAL,
-                unit TEXT,
-                calculated_sats INTEGER,
-                memo TEXT,
-                timestamp TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-        
-        # donation_history 테이블
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS donation_history (
-                donation_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                amount INTEGER,
-                lightning_address TEXT,
-                lightning_invoice TEXT,
-                payment_hash TEXT,
-                donation_type TEXT,
-                status TEXT,
-                error_message TEXT,
-                timestamp TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
+
+def add_user_listener(listener: Callable[[aiosqlite.Row], None]):
+    """users 행 변경 리스너 등록"""
+    _user_listeners.append(listener)
+
+
+async def _fetch_users(db: aiosqlite.Connection, user_ids: List[str]) -> List[aiosqlite.Row]:
+    """트랜잭션 안에서 변경된 users 행 다시 조회"""
+    if not _user_listeners or not user_ids:
+        return []
+    placeholders = ', '.join('?' for _ in user_ids)
+    async with db.execute(f'SELECT * FROM users WHERE user_id IN ({placeholders})', tuple(user_ids)) as cursor:
+        return await cursor.fetchall()
+
+
+# 길드 멤버십 변경 리스너 (guild_id, user_id, 가입 여부)
+_membership_listeners: List[Callable[[str, str, bool], None]] = []
+
+
+def add_membership_listener(listener: Callable[[str, str, bool], None]):
+    """guild_members 변경 리스너 등록"""
+    _membership_listeners.append(listener)
+
+
+def _notify_membership(guild_id: str, user_id: str, joined: bool):
+    for listener in _membership_listeners:
+        try:
+            listener(guild_id, user_id, joined)
+        except Exception as e:
+            logger.error(f"Membership listener error for {guild_id}/{user_id}: {e}")
+
+
+def _notify_user_updates(rows: List[aiosqlite.Row]):
+    """커밋된 users 행을 리스너에 전달 (리스너 오류는 쓰기 결과에 영향 없음)"""
+    for row in rows:
+        for listener in _user_listeners:
+            try:
+                listener(row)
+            except Exception as e:
+                logger.error(f"User listener error for {row['user_id']}: {e}")
+
+
+class UserCache:
+    """users 행 LRU 캐시 (쓰기 후 커밋된 행으로 갱신하는 write-through)"""
+    
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size if max_size is not None else config.USER_CACHE_SIZE
+        self._entries: "OrderedDict[str, aiosqlite.Row]" = OrderedDict()
+        self._writes = 0  # 쓰기 반영 횟수 (조회 도중 쓰기가 있었는지 확인용)
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0}
+    
+    @property
+    def write_count(self) -> int:
+        return self._writes
+    
+    def get(self, user_id: str) -> Optional[aiosqlite.Row]:
+        row = self._entries.get(user_id)
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.stats['hits'] += 1
+        return row
+    
+    def put(self, row: aiosqlite.Row):
+        """커밋된 쓰기 결과 반영 (user 리스너)"""
+        self._writes += 1
+        self.stats['writes'] += 1
+        self._store(row)
+    
+    def put_if_unchanged(self, row: aiosqlite.Row, write_count: int):
+        """조회 결과 저장 - 조회 도중 쓰기가 반영됐다면 오래된 행일 수 있으므로 버림"""
+        if write_count == self._writes:
+            self._store(row)
+    
+    def _store(self, row: aiosqlite.Row):
+        if self.max_size <= 0:
+            return
+        self._entries[row['user_id']] = row
+        self._entries.move_to_end(row['user_id'])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+# 전역 사용자 캐시 (users를 바꾸는 모든 쓰기는 _fetch_users/_notify_user_updates로 갱신해야 함)
+user_cache = UserCache()
+add_user_listener(user_cache.put)
+
+
+async def _ensure_columns(db: aiosqlite.Connection, table: str, columns: Dict[str, str]):
+    """기존 테이블에 누락된 컬럼 추가"""
+    async with db.execute(f'PRAGMA table_info({table})') as cursor:
+        existing = {row[1] for row in await cursor.fetchall()}
+    
+    for name, column_type in columns.items():
+        if name not in existing:
+            await db.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+            logger.info(f"Added column {table}.{name}")
+
+
+async def _migrate_base_schema(db: aiosqlite.Connection):
+    """v1: 기본 테이블"""
+    # users 테이블
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT,
+            walking_sats_per_km INTEGER DEFAULT 0,
+            cycling_sats_per_km INTEGER DEFAULT 0,
+            running_sats_per_km INTEGER DEFAULT 0,
+            weight_sats_per_kg INTEGER DEFAULT 0,
+            swimming_sats_per_km INTEGER DEFAULT 0,
+            total_walking_km REAL DEFAULT 0,
+            total_cycling_km REAL DEFAULT 0,
+            total_running_km REAL DEFAULT 0,
+            total_weight_kg REAL DEFAULT 0,
+            total_swimming_km REAL DEFAULT 0,
+            accumulated_sats INTEGER DEFAULT 0,
+            total_donated_sats INTEGER DEFAULT 0,
+            total_donation_count INTEGER DEFAULT 0,
+            created_at TEXT,
+            last_exercise_date TEXT,
+            streak_days INTEGER DEFAULT 0,
+            auto_donate_enabled INTEGER DEFAULT 0,
+            auto_donate_type TEXT,
+            auto_donate_target_amount INTEGER,
+            auto_donate_schedule_type TEXT,
+            auto_donate_schedule_day INTEGER,
+            next_auto_donate_date TEXT
+        )
+    ''')
+    
+    # exercise_logs 테이블
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS exercise_logs (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            exercise_type TEXT,
+            value REAL,
+            unit TEXT,
+            calculated_sats INTEGER,
+            memo TEXT,
+            timestamp TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+    
+    # donation_history 테이블
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS donation_history (
+            donation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            amount INTEGER,
+            lightning_address TEXT,
+            lightning_invoice TEXT,
+            payment_hash TEXT,
+            donation_type TEXT,
+            status TEXT,
+            error_message TEXT,
+            timestamp TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+
+async def _migrate_donation_pipeline(db: aiosqlite.Connection):
+    """v2: 기부 상태 머신 컬럼, 묶음 전송, 캐시 테이블"""
+    await _ensure_columns(db, 'donation_history', DONATION_HISTORY_EXTRA_COLUMNS)
+    
+    # donation_payouts 테이블 (여러 기부를 묶어 한 번에 전송)
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS donation_payouts (
+            payout_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lightning_address TEXT,
+            amount INTEGER,
+            donation_count INTEGER,
+            forward_invoice TEXT,
+            fee INTEGER,
+            status TEXT,
+            attempts INTEGER DEFAULT 0,
+            error_message TEXT,
+            locked_by TEXT,
+            lease_until TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )
+    ''')
+    
+    # app_cache 테이블 (지갑 ID 등 외부 API 결과 캐시)
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS app_cache (
+            cache_key TEXT PRIMARY KEY,
+            cache_value TEXT,
+            expires_at TEXT
+        )
+    ''')
+
+
+async def _migrate_indexes(db: aiosqlite.Connection):
+    """v3: 사용자별 조회용 복합 인덱스"""
+    # 사용자별 운동 기록 (최근순)
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_exercise_logs_user_time
+        ON exercise_logs(user_id, timestamp)
+    ''')
+    # /기부내역 (user_id + status 조건, timestamp 정렬)
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_donation_history_user_status_time
+        ON donation_history(user_id, status, timestamp)
+    ''')
+    # 재시작 시 미완료 기부 조회
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_donation_history_status
+        ON donation_history(status)
+    ''')
+    # payout 완료/실패 시 묶인 기부 갱신
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_donation_history_payout
+        ON donation_history(payout_id)
+    ''')
+
+
+async def _migrate_leaderboard_indexes(db: aiosqlite.Connection):
+    """v4: 리더보드 카테고리별 정렬 인덱스 (top-N, 순위 COUNT를 인덱스 범위 스캔으로)"""
+    for category, expression in LEADERBOARD_CATEGORIES.items():
+        # user_id, username까지 포함해 top-N 조회 시 테이블 접근 최소화
+        await db.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_users_rank_{category}
+            ON users({expression}, user_id, username)
         ''')
+
+
+async def _migrate_guild_members(db: aiosqlite.Connection):
+    """v5: 길드 멤버십 (길드별 리더보드/순위)"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS guild_members (
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            joined_at TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    # 탈퇴/사용자별 멤버십 조회
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_guild_members_user
+        ON guild_members(user_id)
+    ''')
+
+
+# 일별 집계 다시 만들기 (exercise_logs 기준, since가 있으면 그 날짜부터)
+ROLLUP_REBUILD_QUERY = '''
+    INSERT INTO exercise_daily_rollups (user_id, day, exercise_type, total_value, total_sats, log_count)
+    SELECT user_id, substr(timestamp, 1, 10), exercise_type,
+           SUM(value), SUM(calculated_sats), COUNT(*)
+    FROM exercise_logs
+    WHERE timestamp >= ?
+    GROUP BY user_id, substr(timestamp, 1, 10), exercise_type
+'''
+
+
+async def _migrate_daily_rollups(db: aiosqlite.Connection):
+    """v6: 사용자/운동별 일별 집계 (기간별 리더보드)"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS exercise_daily_rollups (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            exercise_type TEXT NOT NULL,
+            total_value REAL DEFAULT 0,
+            total_sats INTEGER DEFAULT 0,
+            log_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, day, exercise_type)
+        ) WITHOUT ROWID
+    ''')
+    # 기간 + 운동 종류로 범위 조회 후 사용자별 합산 (total_value까지 포함해 테이블 접근 없음)
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_rollups_day_type
+        ON exercise_daily_rollups(day, exercise_type, user_id, total_value)
+    ''')
+    # 기존 운동 기록으로 채우기
+    await db.execute('DELETE FROM exercise_daily_rollups')
+    await db.execute(ROLLUP_REBUILD_QUERY, ('',))
+
+
+# 연속 운동일 다시 계산 (gaps-and-islands)
+# 날짜에서 사용자별 순번을 빼면 연속된 날짜끼리 같은 값(island)이 되므로,
+# island별 길이 중 가장 최근 island의 길이가 streak_days (마지막 운동일까지의 연속 일수)
+STREAK_REBUILD_TEMPLATE = '''
+    WITH active_days AS (
+        SELECT DISTINCT user_id, substr(timestamp, 1, 10) AS day
+        FROM exercise_logs{user_filter}
+    ),
+    islands AS (
+        SELECT user_id, day,
+               julianday(day) - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day) AS island
+        FROM active_days
+    ),
+    runs AS (
+        SELECT user_id, COUNT(*) AS length,
+               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY MAX(day) DESC) AS recency
+        FROM islands
+        GROUP BY user_id, island
+    )
+    UPDATE users
+    SET streak_days = runs.length
+    FROM runs
+    WHERE runs.user_id = users.user_id
+      AND runs.recency = 1
+      AND users.streak_days IS NOT runs.length
+    RETURNING *
+'''
+STREAK_REBUILD_QUERY = STREAK_REBUILD_TEMPLATE.format(user_filter='')
+# 한 사용자만 (과거 기록을 가져온 경우)
+STREAK_REBUILD_USER_QUERY = STREAK_REBUILD_TEMPLATE.format(user_filter='\n        WHERE user_id = ?')
+# 운동 기록이 없는 사용자
+STREAK_RESET_QUERY = '''
+    UPDATE users
+    SET streak_days = 0
+    WHERE streak_days != 0
+      AND NOT EXISTS (SELECT 1 FROM exercise_logs WHERE exercise_logs.user_id = users.user_id)
+    RETURNING *
+'''
+
+
+async def _rebuild_streaks(db: aiosqlite.Connection) -> List[aiosqlite.Row]:
+    """트랜잭션 안에서 전체 사용자 연속 운동일 재계산 - 바뀐 users 행 반환"""
+    updated = []
+    for query in (STREAK_REBUILD_QUERY, STREAK_RESET_QUERY):
+        async with db.execute(query) as cursor:
+            updated.extend(await cursor.fetchall())
+    return updated
+
+
+async def _migrate_auto_donate_index(db: aiosqlite.Connection):
+    """v7: 자동 기부 예정일 인덱스 (자동 기부 사용자만 담는 partial index)"""
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_next_auto_donate
+        ON users(next_auto_donate_date, user_id)
+        WHERE auto_donate_enabled = 1
+    ''')
+
+
+async def _migrate_auto_donation_jobs(db: aiosqlite.Connection):
+    """v8: 목표액 자동 기부 작업 큐 (사용자당 미완료 작업 1개)"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS auto_donation_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            trigger_sats INTEGER,
+            donation_id INTEGER,
+            status TEXT,
+            attempts INTEGER DEFAULT 0,
+            error_message TEXT,
+            locked_by TEXT,
+            lease_until TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+    # 미완료 작업 중복 방지 + 대기 작업 조회 (둘 다 미완료 작업만 담는 partial index)
+    await db.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_auto_donation_jobs_user_open
+        ON auto_donation_jobs(user_id)
+        WHERE status IN ('pending', 'running')
+    ''')
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_auto_donation_jobs_open
+        ON auto_donation_jobs(status, job_id)
+        WHERE status IN ('pending', 'running')
+    ''')
+
+
+async def _migrate_streaks(db: aiosqlite.Connection):
+    """v9: 그동안 갱신되지 않던 streak_days를 운동 기록으로 채우기"""
+    await _rebuild_streaks(db)
+
+
+async def _migrate_auto_donation_job_history(db: aiosqlite.Connection):
+    """v10: 사용자별 마지막 목표액 작업 조회 (결제되지 않은 Invoice 재발급 억제)"""
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_auto_donation_jobs_user
+        ON auto_donation_jobs(user_id, job_id)
+    ''')
+
+
+# 스키마 마이그레이션 (PRAGMA user_version 기준으로 순서대로 한 번씩 적용)
+# user_version이 0인 기존 DB에도 안전하도록 모두 IF NOT EXISTS / 컬럼 확인 후 추가
+SCHEMA_MIGRATIONS = [
+    (1, 'base schema', _migrate_base_schema),
+    (2, 'donation pipeline', _migrate_donation_pipeline),
+    (3, 'lookup indexes', _migrate_indexes),
+    (4, 'leaderboard indexes', _migrate_leaderboard_indexes),
+    (5, 'guild members', _migrate_guild_members),
+    (6, 'daily exercise rollups', _migrate_daily_rollups),
+    (7, 'auto donation schedule index', _migrate_auto_donate_index),
+    (8, 'threshold auto donation jobs', _migrate_auto_donation_jobs),
+    (9, 'backfill streak days', _migrate_streaks),
+    (10, 'auto donation job history index', _migrate_auto_donation_job_history),
+]
+
+
+async def get_schema_version() -> int:
+    """현재 스키마 버전 (PRAGMA user_version)"""
+    db = await db_manager.get_connection()
+    async with db.execute('PRAGMA user_version') as cursor:
+        row = await cursor.fetchone()
+    return row[0]
+
+
+async def run_migrations(target_version: Optional[int] = None) -> int:
+    """아직 적용되지 않은 마이그레이션 실행 후 스키마 버전 반환"""
+    current = await get_schema_version()
+    
+    for version, description, migrate in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        if target_version is not None and version > target_version:
+            break
         
-        await db.commit()
-        logger.info("✅ Database initialized successfully")
+        # 마이그레이션과 버전 갱신을 한 트랜잭션으로 (중간 실패 시 다음 실행에서 재시도)
+        async with db_manager.transaction() as db:
+            await migrate(db)
+            await db.execute(f'PRAGMA user_version = {int(version)}')
+        current = version
+        logger.info(f"Applied schema migration v{version}: {description}")
+    
+    return current
+
+
+async def init_db():
+    """데이터베이스 초기화 (스키마 마이그레이션)"""
+    try:
+        version = await run_migrations()
+        logger.info(f"✅ Database initialized successfully (schema v{version})")
+        logger.info(f"Database connection profile: {await db_manager.get_connection_profile()}")
         
     except Exception as e:
         logger.error(f"❌ Database initialization failed: {e}")
@@ -138,11 +726,19 @@ async def init_db():
 
 
 async def get_user(user_id: str) -> Optional[aiosqlite.Row]:
-    """사용자 정보 조회"""
+    """사용자 정보 조회 (캐시 우선)"""
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    
     try:
-        db = await db_manager.get_connection()
-        async with db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
-            return await cursor.fetchone()
+        write_count = user_cache.write_count
+        async with db_manager.reader() as db:
+            async with db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
+                user = await cursor.fetchone()
+        if user is not None:
+            user_cache.put_if_unchanged(user, write_count)
+        return user
     except Exception as e:
         logger.error(f"Error getting user {user_id}: {e}")
         return None
@@ -151,12 +747,13 @@ async def get_user(user_id: str) -> Optional[aiosqlite.Row]:
 async def create_user(user_id: str, username: str) -> bool:
     """새 사용자 생성"""
     try:
-        db = await db_manager.get_connection()
-        await db.execute('''
-            INSERT INTO users (user_id, username, created_at)
-            VALUES (?, ?, ?)
-        ''', (user_id, username, datetime.now().isoformat()))
-        await db.commit()
+        async with db_manager.transaction() as db:
+            await db.execute('''
+                INSERT INTO users (user_id, username, created_at)
+                VALUES (?, ?, ?)
+            ''', (user_id, username, config.local_now().isoformat()))
+            updated = await _fetch_users(db, [user_id])
+        _notify_user_updates(updated)
         logger.info(f"New user created: {username} ({user_id})")
         return True
     except Exception as e:
@@ -172,11 +769,12 @@ async def update_donation_setting(user_id: str, exercise_type: str, sats_amount:
         if field not in ALLOWED_EXERCISE_FIELDS:
             raise ValueError(f"Invalid field name: {field}")
         
-        db = await db_manager.get_connection()
-        await db.execute(f'''
-            UPDATE users SET {field} = ? WHERE user_id = ?
-        ''', (sats_amount, user_id))
-        await db.commit()
+        async with db_manager.transaction() as db:
+            await db.execute(f'''
+                UPDATE users SET {field} = ? WHERE user_id = ?
+            ''', (sats_amount, user_id))
+            updated = await _fetch_users(db, [user_id])
+        _notify_user_updates(updated)
         logger.debug(f"Updated {exercise_type} setting for {user_id}: {sats_amount} sats")
         return True
     except Exception as e:
@@ -184,221 +782,1336 @@ async def update_donation_setting(user_id: str, exercise_type: str, sats_amount:
         return False
 
 
-async def log_exercise(user_id: str, exercise_type: str, value: float, memo: str, calculated_sats: int) -> bool:
-    """운동 기록 저장"""
+def threshold_reached(user: aiosqlite.Row) -> bool:
+    """목표액 자동 기부 조건 (누적액이 목표액 이상)"""
+    target = user['auto_donate_target_amount']
+    return bool(user['auto_donate_enabled'] and user['auto_donate_type'] == AUTO_DONATE_THRESHOLD
+                and target and user['accumulated_sats'] >= target)
+
+
+async def _enqueue_threshold_donation(db: aiosqlite.Connection, user: aiosqlite.Row,
+                                      retry_unpaid: bool = False) -> bool:
+    """트랜잭션 안에서 목표액 도달 여부 확인 후 자동 기부 작업 등록
+
+    다음 경우에는 등록하지 않는다.
+    - 이미 미완료 작업이 있음 (partial unique index)
+    - 결제를 기다리는 기부가 있음
+    - 마지막 목표액 Invoice가 결제되지 않았고, 그 뒤로 목표액만큼 더 쌓이지 않음
+      (운동을 기록할 때마다 같은 Invoice를 다시 만들어 DM을 보내지 않도록, retry_unpaid면 무시)
+    """
+    if not threshold_reached(user):
+        return False
+    user_id = user['user_id']
+    now = config.local_now().isoformat()
+    placeholders = ', '.join('?' for _ in DONATION_UNFINISHED_STATES)
+    cursor = await db.execute(f'''
+        INSERT INTO auto_donation_jobs (user_id, trigger_sats, status, attempts, created_at, updated_at)
+        SELECT ?, ?, ?, 0, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM donation_history
+            WHERE user_id = ? AND status IN ({placeholders})
+        )
+        AND (? OR NOT EXISTS (
+            SELECT 1
+            FROM (
+                SELECT trigger_sats, donation_id FROM auto_donation_jobs
+                WHERE user_id = ? AND donation_id IS NOT NULL
+                ORDER BY job_id DESC
+                LIMIT 1
+            ) j
+            JOIN donation_history d ON d.donation_id = j.donation_id
+            WHERE d.status = ? AND d.error_message = ? AND ? < j.trigger_sats + ?
+        ))
+        ON CONFLICT DO NOTHING
+    ''', (user_id, user['accumulated_sats'], AUTO_JOB_PENDING, now, now,
+          user_id, *DONATION_UNFINISHED_STATES,
+          1 if retry_unpaid else 0, user_id,
+          DONATION_FAILED, DONATION_UNPAID_ERROR, user['accumulated_sats'], user['auto_donate_target_amount']))
+    return cursor.rowcount == 1
+
+
+async def update_auto_donate_setting(user_id: str, enabled: bool, donate_type: Optional[str] = None,
+                                     schedule_type: Optional[str] = None, schedule_day: Optional[int] = None,
+                                     target_amount: Optional[int] = None,
+                                     next_date: Optional[str] = None) -> Optional[aiosqlite.Row]:
+    """자동 기부 설정 저장 - 갱신된 users 행 반환"""
     try:
-        unit = config.EXERCISE_TYPES[exercise_type]['unit']
-        total_field = config.EXERCISE_TYPES[exercise_type]['total_field']
+        async with db_manager.transaction() as db:
+            async with db.execute('''
+                UPDATE users
+                SET auto_donate_enabled = ?,
+                    auto_donate_type = ?,
+                    auto_donate_schedule_type = ?,
+                    auto_donate_schedule_day = ?,
+                    auto_donate_target_amount = ?,
+                    next_auto_donate_date = ?
+                WHERE user_id = ?
+                RETURNING *
+            ''', (1 if enabled else 0, donate_type, schedule_type, schedule_day,
+                  target_amount, next_date, user_id)) as cursor:
+                user = await cursor.fetchone()
+            # 설정 시점에 이미 목표액을 넘었으면 바로 등록 (사용자가 직접 저장했으므로 결제되지 않은 Invoice도 다시 발급)
+            if user is not None:
+                await _enqueue_threshold_donation(db, user, retry_unpaid=True)
+        if user is not None:
+            _notify_user_updates([user])
+        logger.info(f"Auto donation setting for {user_id}: enabled={enabled} type={donate_type} "
+                    f"schedule={schedule_type}/{schedule_day} next={next_date}")
+        return user
+    except Exception as e:
+        logger.error(f"Error updating auto donation setting for {user_id}: {e}")
+        return None
+
+
+async def get_due_auto_donations(due_before: str, limit: int = 200,
+                                 after: Optional[tuple] = None) -> List[aiosqlite.Row]:
+    """예정일이 지난 정기 자동 기부 사용자 (예정일, user_id 순 keyset 페이지)
+
+    after=(next_auto_donate_date, user_id)를 넘기면 그 다음부터 조회한다.
+    처리 중인 기부가 있는 사용자는 제외 (같은 누적액을 두 번 청구하지 않도록).
+    """
+    try:
+        after_date, after_user = after or ('', '')
+        placeholders = ', '.join('?' for _ in DONATION_UNFINISHED_STATES)
+        async with db_manager.reader() as db:
+            async with db.execute(f'''
+                SELECT * FROM users
+                WHERE auto_donate_enabled = 1
+                  AND next_auto_donate_date <= ?
+                  AND (next_auto_donate_date, user_id) > (?, ?)
+                  AND auto_donate_type = ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM donation_history d
+                      WHERE d.user_id = users.user_id AND d.status IN ({placeholders})
+                  )
+                ORDER BY next_auto_donate_date, user_id
+                LIMIT ?
+            ''', (due_before, after_date, after_user, AUTO_DONATE_SCHEDULE,
+                  *DONATION_UNFINISHED_STATES, limit)) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting due auto donations: {e}")
+        return []
+
+
+async def advance_auto_donate_dates(next_dates: Dict[str, str]) -> int:
+    """여러 사용자의 다음 자동 기부일을 한 트랜잭션으로 갱신 - 갱신된 행 수 반환"""
+    if not next_dates:
+        return 0
+    try:
+        items = list(next_dates.items())
+        updated = []
+        async with db_manager.transaction() as db:
+            # VALUES 목록과 조인해 한 문장으로 갱신 (바인딩 변수 한도를 넘지 않게 나눔)
+            for start in range(0, len(items), 500):
+                chunk = items[start:start + 500]
+                values = ', '.join('(?, ?)' for _ in chunk)
+                params = [value for item in chunk for value in item]
+                async with db.execute(f'''
+                    UPDATE users
+                    SET next_auto_donate_date = v.column2
+                    FROM (VALUES {values}) AS v
+                    WHERE users.user_id = v.column1
+                    RETURNING *
+                ''', params) as cursor:
+                    updated.extend(await cursor.fetchall())
+        _notify_user_updates(updated)
+        return len(updated)
+    except Exception as e:
+        logger.error(f"Error advancing auto donation dates: {e}")
+        return 0
+
+
+async def claim_auto_donation_job(owner: str, lease_seconds: int) -> Optional[aiosqlite.Row]:
+    """대기 작업(또는 임대가 만료된 작업) 하나를 가져와 running으로 점유"""
+    try:
+        now = config.local_now()
+        async with db_manager.transaction() as db:
+            async with db.execute('''
+                UPDATE auto_donation_jobs
+                SET status = ?, locked_by = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                WHERE job_id = (
+                    SELECT job_id FROM auto_donation_jobs
+                    WHERE status IN ('pending', 'running')
+                      AND (status = ? OR lease_until < ?)
+                    ORDER BY job_id
+                    LIMIT 1
+                )
+                RETURNING *
+            ''', (AUTO_JOB_RUNNING, owner, (now + timedelta(seconds=lease_seconds)).isoformat(),
+                  now.isoformat(), AUTO_JOB_PENDING, now.isoformat())) as cursor:
+                return await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error claiming auto donation job: {e}")
+        return None
+
+
+async def renew_auto_donation_job(job_id: int, owner: str, lease_seconds: int) -> bool:
+    """running 작업 임대 연장 (기부 결과를 기다리는 동안)"""
+    try:
+        return await _claim_row('auto_donation_jobs', 'job_id', job_id, owner, lease_seconds)
+    except Exception as e:
+        logger.error(f"Error renewing auto donation job {job_id}: {e}")
+        return False
+
+
+async def update_auto_donation_job(job_id: int, to_status: str, **fields) -> bool:
+    """running 작업 갱신/종료 (종료 시 점유 해제)"""
+    try:
+        if to_status != AUTO_JOB_RUNNING:
+            fields.update(locked_by=None, lease_until=None)
+        return await _transition_row('auto_donation_jobs', 'job_id', ALLOWED_AUTO_JOB_UPDATE_FIELDS,
+                                     job_id, AUTO_JOB_RUNNING, to_status, fields)
+    except Exception as e:
+        logger.error(f"Error updating auto donation job {job_id}: {e}")
+        return False
+
+
+async def get_unfinished_donation(user_id: str) -> Optional[aiosqlite.Row]:
+    """사용자의 처리 중인 기부 (가장 최근 것)"""
+    try:
+        placeholders = ', '.join('?' for _ in DONATION_UNFINISHED_STATES)
+        async with db_manager.reader() as db:
+            async with db.execute(f'''
+                SELECT * FROM donation_history
+                WHERE user_id = ? AND status IN ({placeholders})
+                ORDER BY donation_id DESC
+                LIMIT 1
+            ''', (user_id, *DONATION_UNFINISHED_STATES)) as cursor:
+                return await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error checking unfinished donations for {user_id}: {e}")
+        return None
+
+
+async def has_unfinished_donation(user_id: str) -> bool:
+    """처리 중인 기부가 있는지"""
+    return await get_unfinished_donation(user_id) is not None
+
+
+async def _apply_exercise_log(db: aiosqlite.Connection, user_id: str, exercise_type: str, value: float,
+                              memo: str, calculated_sats: int) -> aiosqlite.Row:
+    """트랜잭션 안에서 운동 기록 1건 반영 - 갱신된 users 행 반환"""
+    unit = config.EXERCISE_TYPES[exercise_type]['unit']
+    total_field = config.EXERCISE_TYPES[exercise_type]['total_field']
+    
+    # Validate total_field name against whitelist to prevent SQL injection
+    if total_field not in ALLOWED_TOTAL_FIELDS:
+        raise ValueError(f"Invalid total field name: {total_field}")
+    
+    now = config.local_now()
+    logged_at = now.isoformat()
+    today = now.date()
+    
+    # 사용자 총계 업데이트 (갱신된 행을 바로 받아 다시 조회하지 않음)
+    # 연속 운동일은 이전 last_exercise_date만 보고 갱신 (오늘 이미 기록: 유지, 어제: +1, 그 외: 1)
+    async with db.execute(f'''
+        UPDATE users 
+        SET {total_field} = {total_field} + ?,
+            accumulated_sats = accumulated_sats + ?,
+            streak_days = CASE substr(last_exercise_date, 1, 10)
+                WHEN ? THEN MAX(streak_days, 1)
+                WHEN ? THEN streak_days + 1
+                ELSE 1
+            END,
+            last_exercise_date = ?
+        WHERE user_id = ?
+        RETURNING *
+    ''', (value, calculated_sats, today.isoformat(), (today - timedelta(days=1)).isoformat(),
+          logged_at, user_id)) as cursor:
+        user = await cursor.fetchone()
+    
+    if user is None:
+        raise ValueError(f"Unknown user: {user_id}")
+    
+    # 운동 로그 저장
+    await db.execute('''
+        INSERT INTO exercise_logs (user_id, exercise_type, value, unit, calculated_sats, memo, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, exercise_type, value, unit, calculated_sats, memo, logged_at))
+    
+    # 일별 집계 갱신 (기간별 리더보드)
+    await db.execute('''
+        INSERT INTO exercise_daily_rollups (user_id, day, exercise_type, total_value, total_sats, log_count)
+        VALUES (?, substr(?, 1, 10), ?, ?, ?, 1)
+        ON CONFLICT(user_id, day, exercise_type) DO UPDATE SET
+            total_value = total_value + excluded.total_value,
+            total_sats = total_sats + excluded.total_sats,
+            log_count = log_count + 1
+    ''', (user_id, logged_at, exercise_type, value, calculated_sats))
+    
+    # 목표액 자동 기부 (같은 트랜잭션에서 판단하므로 users 테이블을 주기적으로 훑지 않음)
+    await _enqueue_threshold_donation(db, user)
+    
+    return user
+
+
+class ExerciseLogBatcher:
+    """운동 기록 group commit
+
+    EXERCISE_BATCH_WINDOW_MS 동안 모인 기록을 한 트랜잭션(커밋 1회)으로 저장한다.
+    기록마다 SAVEPOINT를 써서 한 건이 실패해도 나머지는 커밋되며,
+    각 호출자는 커밋이 끝난 뒤에 결과를 받는다.
+    """
+    
+    def __init__(self, window_ms: int = None, max_size: int = None):
+        window_ms = window_ms if window_ms is not None else config.EXERCISE_BATCH_WINDOW_MS
+        self.window = window_ms / 1000
+        self.max_size = max_size or config.EXERCISE_BATCH_MAX_SIZE
+        self._queue: List[tuple] = []
+        self._full = None  # asyncio.Event - 이벤트 루프 안에서 생성
+        self._task = None
+        self._closing = False
+        self.stats = {'batches': 0, 'logs': 0, 'failed': 0, 'largest_batch': 0}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+    
+    async def submit(self, *args) -> aiosqlite.Row:
+        """기록 1건 등록 후 커밋될 때까지 대기 (_apply_exercise_log 인자)"""
+        if self._full is None:
+            self._full = asyncio.Event()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((args, future))
         
-        # Validate total_field name against whitelist to prevent SQL injection
-        if total_field not in ALLOWED_TOTAL_FIELDS:
-            raise ValueError(f"Invalid total field name: {total_field}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if len(self._queue) >= self.max_size:
+            self._full.set()
+        return await future
+    
+    async def close(self):
+        """대기 중인 기록까지 모두 커밋"""
+        if self._task is not None:
+            # 루프가 아직 대기에 들어가기 전이어도 기다리지 않도록 플래그로 알림
+            self._closing = True
+            self._full.set()
+            try:
+                await asyncio.gather(self._task, return_exceptions=True)
+            finally:
+                self._closing = False
+            self._task = None
+        # 이벤트는 처음 기다린 이벤트 루프에 묶이므로 다음 루프에서 새로 만듦
+        self._full = None
+        logger.info(f"Exercise log batcher stopped: {self.stats}")
+    
+    async def _run(self):
+        while self._queue:
+            if len(self._queue) < self.max_size and not self._closing:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            
+            batch = self._queue[:self.max_size]
+            self._queue = self._queue[self.max_size:]
+            await self._commit(batch)
+    
+    async def _commit(self, batch: List[tuple]):
+        results = []
+        try:
+            async with db_manager.transaction() as db:
+                for args, future in batch:
+                    await db.execute('SAVEPOINT exercise_log')
+                    try:
+                        user = await _apply_exercise_log(db, *args)
+                        results.append((future, user, None))
+                    except Exception as e:
+                        await db.execute('ROLLBACK TO exercise_log')
+                        results.append((future, None, e))
+                    await db.execute('RELEASE exercise_log')
+        except Exception as e:
+            # 커밋 실패 - 묶인 기록 모두 실패
+            self.stats['failed'] += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
         
-        db = await db_manager.get_connection()
+        self.stats['batches'] += 1
+        self.stats['logs'] += len(batch)
+        self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
         
-        # 운동 로그 저장
-        await db.execute('''
-            INSERT INTO exercise_logs (user_id, exercise_type, value, unit, calculated_sats, memo, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, exercise_type, value, unit, calculated_sats, memo, datetime.now().isoformat()))
+        _notify_user_updates([user for _, user, _ in results if user is not None])
+        for future, user, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                self.stats['failed'] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(user)
+
+
+# 전역 운동 기록 배치 (EXERCISE_BATCH_WINDOW_MS가 0이면 기록마다 바로 커밋)
+exercise_log_batcher = ExerciseLogBatcher()
+
+
+async def log_exercise(user_id: str, exercise_type: str, value: float, memo: str,
+                       calculated_sats: int) -> Optional[aiosqlite.Row]:
+    """운동 기록 저장 - 갱신된 users 행 반환 (실패 시 None)"""
+    try:
+        args = (user_id, exercise_type, value, memo, calculated_sats)
+        if exercise_log_batcher.enabled:
+            user = await exercise_log_batcher.submit(*args)
+        else:
+            async with db_manager.transaction() as db:
+                user = await _apply_exercise_log(db, *args)
+            _notify_user_updates([user])
         
-        # 사용자 총계 업데이트
-        await db.execute(f'''
-            UPDATE users 
-            SET {total_field} = {total_field} + ?,
-                accumulated_sats = accumulated_sats + ?,
-                last_exercise_date = ?
-            WHERE user_id = ?
-        ''', (value, calculated_sats, datetime.now().isoformat(), user_id))
-        
-        await db.commit()
+        unit = config.EXERCISE_TYPES[exercise_type]['unit']
         logger.info(f"Exercise logged: {user_id} - {exercise_type} {value}{unit} = {calculated_sats} sats")
-        return True
+        return user
         
     except Exception as e:
         logger.error(f"Error logging exercise: {e}")
-        return False
+        return None
+
+
+async def import_exercise_logs(user_id: str, rows: List[tuple]) -> Optional[Dict[str, Any]]:
+    """운동 기록 일괄 저장 (파일 가져오기) - 한 트랜잭션으로 기록/일별 집계/사용자 총계 반영
+
+    rows: (운동 종류, 값, 기록 시각 ISO, 메모) 목록
+    같은 시각/종류의 기록이 이미 있으면 건너뛰므로 같은 파일을 다시 가져와도 중복되지 않는다.
+
+    Returns:
+        dict: {'user': 갱신된 users 행, 'imported': 저장 건수, 'duplicates': 중복 건수,
+               'unrated': 기부 설정이 없어 건너뛴 건수, 'sats': 추가된 sats}
+    """
+    try:
+        async with db_manager.transaction() as db:
+            async with db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
+                user = await cursor.fetchone()
+            if user is None:
+                return None
+            
+            # 기부 설정(sats/단위)이 있는 운동만 (직접 입력과 같은 조건)
+            logs = []
+            unrated = 0
+            for exercise_type, value, logged_at, memo in rows:
+                ex_type = config.EXERCISE_TYPES[exercise_type]
+                rate = user[ex_type['db_field']]
+                if not rate:
+                    unrated += 1
+                    continue
+                logs.append((user_id, exercise_type, value, ex_type['unit'], int(value * rate), memo, logged_at,
+                             user_id, logged_at, exercise_type))
+            
+            async with db.execute('SELECT COALESCE(MAX(log_id), 0) FROM exercise_logs') as cursor:
+                last_log_id = (await cursor.fetchone())[0]
+            
+            # 중복 확인은 (user_id, timestamp) 인덱스로 한 건씩
+            await db.executemany('''
+                INSERT INTO exercise_logs (user_id, exercise_type, value, unit, calculated_sats, memo, timestamp)
+                SELECT ?, ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM exercise_logs
+                    WHERE user_id = ? AND timestamp = ? AND exercise_type = ?
+                )
+            ''', logs)
+            
+            # 이번에 저장된 기록만 모아 일별 집계와 사용자 총계에 반영
+            await db.execute('''
+                INSERT INTO exercise_daily_rollups (user_id, day, exercise_type, total_value, total_sats, log_count)
+                SELECT user_id, substr(timestamp, 1, 10), exercise_type,
+                       SUM(value), SUM(calculated_sats), COUNT(*)
+                FROM exercise_logs
+                WHERE log_id > ? AND user_id = ?
+                GROUP BY user_id, substr(timestamp, 1, 10), exercise_type
+                ON CONFLICT(user_id, day, exercise_type) DO UPDATE SET
+                    total_value = total_value + excluded.total_value,
+                    total_sats = total_sats + excluded.total_sats,
+                    log_count = log_count + excluded.log_count
+            ''', (last_log_id, user_id))
+            
+            async with db.execute('''
+                SELECT exercise_type, SUM(value), SUM(calculated_sats), COUNT(*), MAX(timestamp)
+                FROM exercise_logs
+                WHERE log_id > ? AND user_id = ?
+                GROUP BY exercise_type
+            ''', (last_log_id, user_id)) as cursor:
+                totals = await cursor.fetchall()
+            
+            imported = sum(row[3] for row in totals)
+            added_sats = sum(row[2] for row in totals)
+            if imported:
+                assignments = []
+                params = []
+                for exercise_type, total_value, _, _, _ in totals:
+                    total_field = config.EXERCISE_TYPES[exercise_type]['total_field']
+                    # Validate total_field name against whitelist to prevent SQL injection
+                    if total_field not in ALLOWED_TOTAL_FIELDS:
+                        raise ValueError(f"Invalid total field name: {total_field}")
+                    assignments.append(f'{total_field} = {total_field} + ?')
+                    params.append(total_value)
+                last_logged_at = max(row[4] for row in totals)
+                
+                async with db.execute(f'''
+                    UPDATE users
+                    SET {', '.join(assignments)},
+                        accumulated_sats = accumulated_sats + ?,
+                        last_exercise_date = MAX(COALESCE(last_exercise_date, ''), ?)
+                    WHERE user_id = ?
+                    RETURNING *
+                ''', (*params, added_sats, last_logged_at, user_id)) as cursor:
+                    user = await cursor.fetchone()
+                
+                # 과거 날짜가 섞여 들어오므로 연속 운동일은 이 사용자만 다시 계산
+                async with db.execute(STREAK_REBUILD_USER_QUERY, (user_id,)) as cursor:
+                    user = await cursor.fetchone() or user
+                
+                await _enqueue_threshold_donation(db, user)
+        
+        if imported:
+            _notify_user_updates([user])
+        logger.info(f"Exercise imported: {user_id} - {imported} logs = {added_sats} sats "
+                    f"({len(logs) - imported} duplicates, {unrated} unrated)")
+        return {
+            'user': user,
+            'imported': imported,
+            'duplicates': len(logs) - imported,
+            'unrated': unrated,
+            'sats': added_sats,
+        }
+        
+    except Exception as e:
+        logger.error(f"Error importing exercise logs for {user_id}: {e}")
+        return None
+
+
+def _build_user_stats(user: aiosqlite.Row) -> Dict[str, Any]:
+    """users 행을 통계 dict로 변환"""
+    return {
+        'walking': {
+            'distance': user['total_walking_km'],
+            'sats': user['total_walking_km'] * user['walking_sats_per_km']
+        },
+        'cycling': {
+            'distance': user['total_cycling_km'],
+            'sats': user['total_cycling_km'] * user['cycling_sats_per_km']
+        },
+        'running': {
+            'distance': user['total_running_km'],
+            'sats': user['total_running_km'] * user['running_sats_per_km']
+        },
+        'weight': {
+            'weight': user['total_weight_kg'],
+            'sats': user['total_weight_kg'] * user['weight_sats_per_kg']
+        },
+        'swimming': {
+            'distance': user['total_swimming_km'],
+            'sats': user['total_swimming_km'] * user['swimming_sats_per_km']
+        },
+        'total_distance': user['total_walking_km'] + user['total_cycling_km'] + user['total_running_km'] + user['total_swimming_km'],
+        'total_weight': user['total_weight_kg'],
+        'accumulated_sats': user['accumulated_sats'],
+        'total_donated_sats': user['total_donated_sats'],
+        'total_donation_count': user['total_donation_count'],
+        'streak_days': user['streak_days']
+    }
 
 
 async def get_user_stats(user_id: str) -> Optional[Dict[str, Any]]:
     """사용자 통계 조회"""
     try:
-        db = await db_manager.get_connection()
-        async with db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
-            user = await cursor.fetchone()
-            
+        user = await get_user(user_id)
         if not user:
             return None
             
-        return {
-            'walking': {
-                'distance': user['total_walking_km'],
-                'sats': user['total_walking_km'] * user['walking_sats_per_km']
-            },
-            'cycling': {
-                'distance': user['total_cycling_km'],
-                'sats': user['total_cycling_km'] * user['cycling_sats_per_km']
-            },
-            'running': {
-                'distance': user['total_running_km'],
-                'sats': user['total_running_km'] * user['running_sats_per_km']
-            },
-            'weight': {
-                'weight': user['total_weight_kg'],
-                'sats': user['total_weight_kg'] * user['weight_sats_per_kg']
-            },
-            'swimming': {
-                'distance': user['total_swimming_km'],
-                'sats': user['total_swimming_km'] * user['swimming_sats_per_km']
-            },
-            'total_distance': user['total_walking_km'] + user['total_cycling_km'] + user['total_running_km'] + user['total_swimming_km'],
-            'total_weight': user['total_weight_kg'],
-            'accumulated_sats': user['accumulated_sats'],
-            'total_donated_sats': user['total_donated_sats'],
-            'total_donation_count': user['total_donation_count'],
-            'streak_days': user['streak_days']
-        }
+        return _build_user_stats(user)
         
     except Exception as e:
         logger.error(f"Error getting user stats: {e}")
         return None
 
 
-async def get_leaderboard(category: str = 'distance', limit: int = 10) -> List[aiosqlite.Row]:
-    """리더보드 조회"""
+def _qualified_expression(category: str, alias: str) -> str:
+    """리더보드 정렬 식을 테이블 별칭으로 한정"""
+    expression = LEADERBOARD_CATEGORIES[category]
+    if expression == DISTANCE_TOTAL_EXPRESSION:
+        return '(' + ' + '.join(f'{alias}.{column}' for column in DISTANCE_TOTAL_COLUMNS) + ')'
+    return f'{alias}.{expression}'
+
+
+def _build_stats_with_ranks_query(guild_scoped: bool = False) -> str:
+    """사용자 행 + 카테고리별 순위 + 사용자 수를 한 번에 조회하는 쿼리
+
+    순위는 카테고리 인덱스를 쓰는 스칼라 서브쿼리(COUNT 범위 스캔)로 계산한다.
+    RANK() OVER는 매번 users 전체를 정렬하므로 한 사용자 조회에는 더 느리다.
+    길드 범위에서는 길드 멤버만 한 번 모은 뒤(members) 그 안에서 센다.
+    """
+    source = 'members' if guild_scoped else 'users'
+    rank_columns = ',\n               '.join(
+        f'(SELECT COUNT(*) FROM {source} WHERE {expression} > {_qualified_expression(category, "u")}) + 1'
+        f' AS rank_{category}'
+        for category, expression in LEADERBOARD_CATEGORIES.items()
+    )
+    members_cte = ''
+    if guild_scoped:
+        columns = ', '.join(f'u.{column}' for column in sorted(ALLOWED_RANKING_FIELDS))
+        # CROSS JOIN으로 guild_members부터 읽도록 고정 (비용이 길드 멤버 수에 비례)
+        members_cte = f'''
+        WITH members AS (
+            SELECT {columns}
+            FROM guild_members gm CROSS JOIN users u ON u.user_id = gm.user_id
+            WHERE gm.guild_id = :guild_id
+        )'''
+    return f'''{members_cte}
+        SELECT u.*,
+               {rank_columns},
+               (SELECT COUNT(*) FROM {source}) AS total_users
+        FROM users u
+        WHERE u.user_id = :user_id
+    '''
+
+
+STATS_WITH_RANKS_QUERY = _build_stats_with_ranks_query()
+GUILD_STATS_WITH_RANKS_QUERY = _build_stats_with_ranks_query(guild_scoped=True)
+
+
+async def get_user_stats_with_ranks(user_id: str, guild_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """사용자 통계 + 모든 카테고리 순위 + 사용자 수 (쿼리 1회, guild_id가 있으면 길드 범위)"""
     try:
-        db = await db_manager.get_connection()
+        query = GUILD_STATS_WITH_RANKS_QUERY if guild_id else STATS_WITH_RANKS_QUERY
+        async with db_manager.reader() as db:
+            async with db.execute(query, {'user_id': user_id, 'guild_id': guild_id}) as cursor:
+                user = await cursor.fetchone()
         
-        if category == 'distance':
-            query = '''
-                SELECT user_id, username, 
-                       (total_walking_km + total_cycling_km + total_running_km + total_swimming_km) as total
-                FROM users
-                WHERE (total_walking_km + total_cycling_km + total_running_km + total_swimming_km) > 0
-                ORDER BY total DESC
-                LIMIT ?
-            '''
-        elif category == 'donation':
-            query = '''
-                SELECT user_id, username, total_donated_sats as total
-                FROM users
-                WHERE total_donated_sats > 0
-                ORDER BY total DESC
-                LIMIT ?
-            '''
-        elif category == 'donation_count':
-            query = '''
-                SELECT user_id, username, total_donation_count as total
-                FROM users
-                WHERE total_donation_count > 0
-                ORDER BY total DESC
-                LIMIT ?
-            '''
-        elif category in ['walking', 'cycling', 'running', 'swimming']:
-            field = f'total_{category}_km'
-            # Validate field name against whitelist to prevent SQL injection
-            if field not in ALLOWED_RANKING_FIELDS:
-                raise ValueError(f"Invalid ranking field name: {field}")
+        if not user:
+            return None
+        
+        stats = _build_user_stats(user)
+        stats['ranks'] = {category: user[f'rank_{category}'] for category in LEADERBOARD_CATEGORIES}
+        stats['total_users'] = user['total_users']
+        return stats
+        
+    except Exception as e:
+        logger.error(f"Error getting user stats with ranks: {e}")
+        return None
+
+
+async def get_leaderboard(category: str = 'distance', limit: int = 10,
+                          guild_id: Optional[str] = None) -> List[aiosqlite.Row]:
+    """리더보드 조회 (guild_id가 있으면 해당 길드 멤버만)"""
+    try:
+        expression = LEADERBOARD_CATEGORIES.get(category)
+        if expression is None:
+            return []
+        
+        if guild_id:
+            # guild_members부터 읽어 길드 멤버 수만큼만 정렬
+            qualified = _qualified_expression(category, 'u')
             query = f'''
-                SELECT user_id, username, {field} as total
-                FROM users
-                WHERE {field} > 0
-                ORDER BY total DESC
+                SELECT u.user_id, u.username, {qualified} as total
+                FROM guild_members gm CROSS JOIN users u ON u.user_id = gm.user_id
+                WHERE gm.guild_id = ? AND {qualified} > 0
+                ORDER BY total DESC, u.user_id
                 LIMIT ?
             '''
-        elif category == 'weight':
-            query = '''
-                SELECT user_id, username, total_weight_kg as total
+            params = (guild_id, limit)
+        else:
+            # ORDER BY/WHERE 식이 인덱스 식과 같아야 인덱스 범위 스캔으로 처리됨
+            # 동점은 user_id 순 (메모리 리더보드와 같은 순서, 동점 구간만 추가 정렬)
+            query = f'''
+                SELECT user_id, username, {expression} as total
                 FROM users
-                WHERE total_weight_kg > 0
-                ORDER BY total DESC
+                WHERE {expression} > 0
+                ORDER BY total DESC, user_id
                 LIMIT ?
             '''
-        else:
-            return []
+            params = (limit,)
         
-        async with db.execute(query, (limit,)) as cursor:
-            return await cursor.fetchall()
+        async with db_manager.reader() as db:
+            async with db.execute(query, params) as cursor:
+                return await cursor.fetchall()
             
     except Exception as e:
         logger.error(f"Error getting leaderboard: {e}")
         return []
 
 
-async def get_user_rank(user_id: str, category: str = 'distance') -> Optional[int]:
-    """사용자 순위 조회"""
+async def get_user_rank(user_id: str, category: str = 'distance', guild_id: Optional[str] = None) -> Optional[int]:
+    """사용자 순위 조회 (guild_id가 있으면 해당 길드 안에서)"""
     try:
-        db = await db_manager.get_connection()
+        expression = LEADERBOARD_CATEGORIES.get(category)
+        if expression is None:
+            return None
         
-        if category == 'distance':
-            query = '''
-                SELECT COUNT(*) + 1 as rank
-                FROM users
-                WHERE (total_walking_km + total_cycling_km + total_running_km + total_swimming_km) > 
-                      (SELECT total_walking_km + total_cycling_km + total_running_km + total_swimming_km
-                       FROM users WHERE user_id = ?)
-            '''
-        elif category == 'donation':
-            query = '''
+        if guild_id:
+            query = f'''
                 SELECT COUNT(*) + 1 as rank
-                FROM users
-                WHERE total_donated_sats > (SELECT total_donated_sats FROM users WHERE user_id = ?)
+                FROM guild_members gm CROSS JOIN users u ON u.user_id = gm.user_id
+                WHERE gm.guild_id = ?
+                  AND {_qualified_expression(category, 'u')} > (SELECT {expression} FROM users WHERE user_id = ?)
             '''
-        elif category == 'weight':
-            query = '''
+            params = (guild_id, user_id)
+        else:
+            query = f'''
                 SELECT COUNT(*) + 1 as rank
                 FROM users
-                WHERE total_weight_kg > (SELECT total_weight_kg FROM users WHERE user_id = ?)
+                WHERE {expression} > (SELECT {expression} FROM users WHERE user_id = ?)
             '''
-        else:
-            return None
+            params = (user_id,)
         
-        async with db.execute(query, (user_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else None
+        async with db_manager.reader() as db:
+            async with db.execute(query, params) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
             
     except Exception as e:
         logger.error(f"Error getting user rank: {e}")
         return None
 
 
-async def get_total_users() -> int:
-    """전체 사용자 수"""
+def get_period_range(period: str, today: Optional[date] = None) -> Optional[tuple]:
+    """기간 이름 -> (시작일, 종료일) 'YYYY-MM-DD' (week: 이번 주 월요일부터, month: 이번 달 1일부터)"""
+    today = today or config.local_now().date()
+    if period == 'week':
+        start = today - timedelta(days=today.weekday())
+    elif period == 'month':
+        start = today.replace(day=1)
+    else:
+        return None
+    return start.isoformat(), today.isoformat()
+
+
+async def get_period_leaderboard(category: str, start_day: str, end_day: str, limit: int = 10,
+                                 guild_id: Optional[str] = None) -> List[aiosqlite.Row]:
+    """기간별 리더보드 (start_day ~ end_day, 일별 집계 합산)"""
+    try:
+        exercise_types = PERIOD_LEADERBOARD_CATEGORIES.get(category)
+        if exercise_types is None:
+            return []
+        
+        type_placeholders = ', '.join('?' for _ in exercise_types)
+        guild_filter = ''
+        params = [start_day, end_day, *exercise_types]
+        if guild_id:
+            guild_filter = 'AND r.user_id IN (SELECT user_id FROM guild_members WHERE guild_id = ?)'
+            params.append(guild_id)
+        params.append(limit)
+        
+        query = f'''
+            SELECT r.user_id, u.username, SUM(r.total_value) as total
+            FROM exercise_daily_rollups r
+            JOIN users u ON u.user_id = r.user_id
+            WHERE r.day BETWEEN ? AND ?
+              AND r.exercise_type IN ({type_placeholders})
+              {guild_filter}
+            GROUP BY r.user_id
+            HAVING total > 0
+            ORDER BY total DESC
+            LIMIT ?
+        '''
+        
+        async with db_manager.reader() as db:
+            async with db.execute(query, params) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting period leaderboard: {e}")
+        return []
+
+
+async def rebuild_daily_rollups(since: Optional[str] = None) -> int:
+    """exercise_logs로 일별 집계 다시 만들기 (since: 'YYYY-MM-DD', 없으면 전체) - 생성된 행 수 반환"""
+    since = since or ''
+    async with db_manager.transaction() as db:
+        await db.execute('DELETE FROM exercise_daily_rollups WHERE day >= ?', (since,))
+        cursor = await db.execute(ROLLUP_REBUILD_QUERY, (since,))
+        count = cursor.rowcount
+    logger.info(f"Rebuilt {count} daily rollup rows since {since or 'the beginning'}")
+    return count
+
+
+async def rebuild_streaks() -> int:
+    """exercise_logs로 전체 사용자 연속 운동일 다시 계산 - 바뀐 사용자 수 반환
+
+    변경은 이 프로세스의 리스너에만 전달된다. manage.py처럼 별도 프로세스에서 실행하면
+    실행 중인 봇의 user_cache와 메모리 리더보드는 그대로이므로 봇을 멈춘 뒤 실행해야 한다.
+    """
+    async with db_manager.transaction() as db:
+        updated = await _rebuild_streaks(db)
+    _notify_user_updates(updated)
+    logger.info(f"Rebuilt streak days for {len(updated)} users")
+    return len(updated)
+
+
+async def get_ranking_rows() -> List[aiosqlite.Row]:
+    """전체 사용자의 리더보드 집계 컬럼 (메모리 리더보드 구성/검증용)"""
     try:
-        db = await db_manager.get_connection()
-        async with db.execute('SELECT COUNT(*) FROM users') as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        columns = ', '.join(sorted(ALLOWED_RANKING_FIELDS))
+        async with db_manager.reader() as db:
+            async with db.execute(f'SELECT user_id, username, {columns} FROM users') as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting ranking rows: {e}")
+        return []
+
+
+async def get_total_users(guild_id: Optional[str] = None) -> int:
+    """전체 사용자 수 (guild_id가 있으면 해당 길드의 사용자 수)"""
+    try:
+        if guild_id:
+            query = '''
+                SELECT COUNT(*)
+                FROM guild_members gm CROSS JOIN users u ON u.user_id = gm.user_id
+                WHERE gm.guild_id = ?
+            '''
+            params = (guild_id,)
+        else:
+            query = 'SELECT COUNT(*) FROM users'
+            params = ()
+        
+        async with db_manager.reader() as db:
+            async with db.execute(query, params) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 0
     except Exception as e:
         logger.error(f"Error getting total users: {e}")
         return 0
 
 
-async def update_donation_complete(user_id: str, amount: int, invoice: str, donation_address: str) -> bool:
-    """기부 완료 후 DB 업데이트"""
+# 이미 guild_members에 기록된 (guild_id, user_id) - 상호작용마다 쓰기 방지
+_known_guild_members = set()
+
+
+async def touch_guild_member(guild_id: str, user_id: str) -> bool:
+    """길드 멤버십 기록 (이미 알고 있으면 DB 접근 없음)"""
+    key = (guild_id, user_id)
+    if key in _known_guild_members:
+        return True
     try:
-        db = await db_manager.get_connection()
-        
-        # 사용자 통계 업데이트
-        await db.execute('''
-            UPDATE users 
-            SET accumulated_sats = accumulated_sats - ?,
-                total_donated_sats = total_donated_sats + ?,
-                total_donation_count = total_donation_count + 1
-            WHERE user_id = ?
-        ''', (amount, amount, user_id))
-        
-        # 기부 히스토리 추가
-        await db.execute('''
-            INSERT INTO donation_history 
-            (user_id, amount, lightning_address, donation_type, status, timestamp, lightning_invoice)
-            VALUES (?, ?, ?, 'manual', 'completed', ?, ?)
-        ''', (user_id, amount, donation_address, datetime.now().isoformat(), invoice))
-        
-        await db.commit()
-        logger.info(f"Donation completed: {user_id} - {amount} sats to {donation_address}")
+        async with db_manager.transaction() as db:
+            cursor = await db.execute('''
+                INSERT OR IGNORE INTO guild_members (guild_id, user_id, joined_at)
+                VALUES (?, ?, ?)
+            ''', (guild_id, user_id, config.local_now().isoformat()))
+            inserted = cursor.rowcount == 1
+        _known_guild_members.add(key)
+        if inserted:
+            _notify_membership(guild_id, user_id, True)
         return True
+    except Exception as e:
+        logger.error(f"Error recording guild member {guild_id}/{user_id}: {e}")
+        return False
+
+
+async def remove_guild_member(guild_id: str, user_id: str) -> bool:
+    """길드 탈퇴 시 멤버십 삭제"""
+    try:
+        async with db_manager.transaction() as db:
+            cursor = await db.execute(
+                'DELETE FROM guild_members WHERE guild_id = ? AND user_id = ?', (guild_id, user_id)
+            )
+            removed = cursor.rowcount == 1
+        _known_guild_members.discard((guild_id, user_id))
+        if removed:
+            _notify_membership(guild_id, user_id, False)
+        return True
+    except Exception as e:
+        logger.error(f"Error removing guild member {guild_id}/{user_id}: {e}")
+        return False
+
+
+async def remove_guild(guild_id: str) -> bool:
+    """봇이 길드에서 나가면 해당 길드 멤버십 전체 삭제"""
+    try:
+        async with db_manager.transaction() as db:
+            async with db.execute('SELECT user_id FROM guild_members WHERE guild_id = ?', (guild_id,)) as cursor:
+                user_ids = [row[0] for row in await cursor.fetchall()]
+            await db.execute('DELETE FROM guild_members WHERE guild_id = ?', (guild_id,))
+        for user_id in user_ids:
+            _known_guild_members.discard((guild_id, user_id))
+            _notify_membership(guild_id, user_id, False)
+        return True
+    except Exception as e:
+        logger.error(f"Error removing guild {guild_id}: {e}")
+        return False
+
+
+async def sync_guild_members(guild_id: str, member_ids: Iterable[str]) -> Tuple[int, int]:
+    """길드 멤버 목록으로 guild_members 맞추기 - (추가, 삭제) 수 반환
+
+    봇 배포 전부터 있던 사용자와 봇이 꺼져 있던 동안의 탈퇴를 반영한다.
+    users에 등록된 멤버만 한 번의 INSERT OR IGNORE ... SELECT로 추가하고,
+    목록에 없는 기존 멤버십은 삭제한 뒤 바뀐 행만 멤버십 리스너에 알린다.
+    """
+    try:
+        async with db_manager.transaction() as db:
+            await db.execute('CREATE TEMP TABLE IF NOT EXISTS guild_sync (user_id TEXT PRIMARY KEY)')
+            await db.execute('DELETE FROM guild_sync')
+            await db.executemany(
+                'INSERT OR IGNORE INTO guild_sync (user_id) VALUES (?)', ((user_id,) for user_id in member_ids)
+            )
+            
+            async with db.execute('''
+                INSERT OR IGNORE INTO guild_members (guild_id, user_id, joined_at)
+                SELECT ?, s.user_id, ?
+                FROM guild_sync s JOIN users u ON u.user_id = s.user_id
+                RETURNING user_id
+            ''', (guild_id, config.local_now().isoformat())) as cursor:
+                joined = [row[0] for row in await cursor.fetchall()]
+            
+            async with db.execute('''
+                DELETE FROM guild_members
+                WHERE guild_id = ? AND user_id NOT IN (SELECT user_id FROM guild_sync)
+                RETURNING user_id
+            ''', (guild_id,)) as cursor:
+                left = [row[0] for row in await cursor.fetchall()]
+            
+            await db.execute('DELETE FROM guild_sync')
+    except Exception as e:
+        logger.error(f"Error syncing guild members for {guild_id}: {e}")
+        return 0, 0
+    
+    for user_id in joined:
+        _known_guild_members.add((guild_id, user_id))
+        _notify_membership(guild_id, user_id, True)
+    for user_id in left:
+        _known_guild_members.discard((guild_id, user_id))
+        _notify_membership(guild_id, user_id, False)
+    if joined or left:
+        logger.info(f"Guild {guild_id} members synced: +{len(joined)} -{len(left)}")
+    return len(joined), len(left)
+
+
+async def get_guild_memberships() -> List[aiosqlite.Row]:
+    """전체 길드 멤버십 (메모리 리더보드 구성용)"""
+    try:
+        async with db_manager.reader() as db:
+            async with db.execute('SELECT guild_id, user_id FROM guild_members') as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting guild memberships: {e}")
+        return []
+
+
+async def iter_export_rows(table: str, scope: str, scope_id: Optional[str] = None,
+                           chunk_size: Optional[int] = None) -> AsyncIterator[List[aiosqlite.Row]]:
+    """내보내기 행을 chunk_size개씩 반환 (읽기 연결 하나에서 커서를 끝까지 읽음)
+
+    scope: 'user' (scope_id = user_id), 'guild' (scope_id = guild_id), 'all'
+    정렬은 인덱스 순서를 따르도록 골라 전체 결과를 정렬용으로 모아두지 않는다.
+    (user: (user_id, timestamp) 인덱스, guild: 멤버별로 이어 붙임, all: 기본 키 순)
+    """
+    if table not in EXPORT_COLUMNS:
+        raise ValueError(f"Invalid export table: {table}")
+    columns = ', '.join(f't.{column}' for column in EXPORT_COLUMNS[table])
+    
+    if scope == 'user':
+        query = f'SELECT {columns} FROM {table} t WHERE t.user_id = ? ORDER BY t.timestamp'
+        params = (scope_id,)
+    elif scope == 'guild':
+        # CROSS JOIN: 길드 멤버에서 시작해 사용자별 인덱스 범위를 차례로 읽음
+        query = f'''
+            SELECT {columns}
+            FROM guild_members g
+            CROSS JOIN {table} t ON t.user_id = g.user_id
+            WHERE g.guild_id = ?
+            ORDER BY g.user_id, t.timestamp
+        '''
+        params = (scope_id,)
+    elif scope == 'all':
+        query = f'SELECT {columns} FROM {table} t ORDER BY t.{EXPORT_COLUMNS[table][0]}'
+        params = ()
+    else:
+        raise ValueError(f"Invalid export scope: {scope}")
+    
+    chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+    async with db_manager.reader() as db:
+        async with db.execute(query, params) as cursor:
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+
+async def get_cache_value(key: str) -> Optional[str]:
+    """캐시 값 조회 (만료된 값은 None)"""
+    try:
+        async with db_manager.reader() as db:
+            async with db.execute(
+                'SELECT cache_value FROM app_cache WHERE cache_key = ? AND (expires_at IS NULL OR expires_at > ?)',
+                (key, config.local_now().isoformat())
+            ) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
+    except Exception as e:
+        logger.error(f"Error getting cache value {key}: {e}")
+        return None
+
+
+async def set_cache_value(key: str, value: str, ttl_seconds: Optional[int] = None) -> bool:
+    """캐시 값 저장 (ttl_seconds가 없으면 만료 없음)"""
+    try:
+        expires_at = None
+        if ttl_seconds:
+            expires_at = (config.local_now() + timedelta(seconds=ttl_seconds)).isoformat()
         
+        async with db_manager.transaction() as db:
+            await db.execute('''
+                INSERT INTO app_cache (cache_key, cache_value, expires_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    cache_value = excluded.cache_value,
+                    expires_at = excluded.expires_at
+            ''', (key, value, expires_at))
+        return True
     except Exception as e:
-        logger.error(f"Error updating donation complete: {e}")
+        logger.error(f"Error setting cache value {key}: {e}")
         return False
+
+
+async def delete_cache_value(key: str) -> bool:
+    """캐시 값 삭제"""
+    try:
+        async with db_manager.transaction() as db:
+            await db.execute('DELETE FROM app_cache WHERE cache_key = ?', (key,))
+        return True
+    except Exception as e:
+        logger.error(f"Error deleting cache value {key}: {e}")
+        return False
+
+
+# ==================== 기부 상태 머신 ====================
+
+async def create_donation(user_id: str, amount: int, invoice: str, payment_hash: str,
+                          lightning_address: str, donation_type: str = 'manual') -> Optional[int]:
+    """기부 생성 (invoice_created 상태) - donation_id 반환"""
+    try:
+        now = config.local_now().isoformat()
+        async with db_manager.transaction() as db:
+            cursor = await db.execute('''
+                INSERT INTO donation_history
+                (user_id, amount, lightning_address, lightning_invoice, payment_hash,
+                 donation_type, status, timestamp, updated_at, attempts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+            ''', (user_id, amount, lightning_address, invoice, payment_hash,
+                  donation_type, DONATION_INVOICE_CREATED, now, now))
+        logger.info(f"Donation created: #{cursor.lastrowid} {user_id} - {amount} sats")
+        return cursor.lastrowid
+    except Exception as e:
+        logger.error(f"Error creating donation for {user_id}: {e}")
+        return None
+
+
+async def get_donation(donation_id: int) -> Optional[aiosqlite.Row]:
+    """기부 조회"""
+    try:
+        async with db_manager.reader() as db:
+            async with db.execute('SELECT * FROM donation_history WHERE donation_id = ?', (donation_id,)) as cursor:
+                return await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error getting donation {donation_id}: {e}")
+        return None
+
+
+async def get_recent_donations(user_id: str, limit: int = 10) -> List[aiosqlite.Row]:
+    """완료된 최근 기부 내역"""
+    try:
+        async with db_manager.reader() as db:
+            placeholders = ', '.join('?' for _ in DONATION_DONE_STATES)
+            async with db.execute(f'''
+                SELECT * FROM donation_history
+                WHERE user_id = ? AND status IN ({placeholders})
+                ORDER BY timestamp DESC
+                LIMIT ?
+            ''', (user_id, *DONATION_DONE_STATES, limit)) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting recent donations for {user_id}: {e}")
+        return []
+
+
+async def get_unfinished_donations() -> List[aiosqlite.Row]:
+    """완료되지 않은 기부 목록 (재시작 시 이어서 처리)"""
+    try:
+        async with db_manager.reader() as db:
+            placeholders = ', '.join('?' for _ in DONATION_UNFINISHED_STATES)
+            async with db.execute(f'''
+                SELECT * FROM donation_history
+                WHERE status IN ({placeholders})
+                ORDER BY donation_id
+            ''', DONATION_UNFINISHED_STATES) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting unfinished donations: {e}")
+        return []
+
+
+async def _claim_row(table: str, key_column: str, row_id: int, owner: str, lease_seconds: int) -> bool:
+    """행 처리 권한 획득/연장 (다른 프로세스가 처리 중이면 False)"""
+    now = config.local_now()
+    async with db_manager.transaction() as db:
+        cursor = await db.execute(f'''
+            UPDATE {table}
+            SET locked_by = ?, lease_until = ?
+            WHERE {key_column} = ?
+              AND (locked_by IS NULL OR locked_by = ? OR lease_until < ?)
+        ''', (owner, (now + timedelta(seconds=lease_seconds)).isoformat(),
+              row_id, owner, now.isoformat()))
+    return cursor.rowcount == 1
+
+
+async def _release_row(table: str, key_column: str, row_id: int, owner: str):
+    """행 처리 권한 반납"""
+    async with db_manager.transaction() as db:
+        await db.execute(f'''
+            UPDATE {table}
+            SET locked_by = NULL, lease_until = NULL
+            WHERE {key_column} = ? AND locked_by = ?
+        ''', (row_id, owner))
+
+
+async def _transition_row(table: str, key_column: str, allowed_fields: set, row_id: int,
+                          from_status: str, to_status: str, fields: Dict[str, Any]) -> bool:
+    """상태 전이 (현재 상태가 from_status일 때만)"""
+    # Validate field names against whitelist to prevent SQL injection
+    for field in fields:
+        if field not in allowed_fields:
+            raise ValueError(f"Invalid {table} field name: {field}")
+    
+    assignments = ''.join(f', {field} = ?' for field in fields)
+    async with db_manager.transaction() as db:
+        cursor = await db.execute(f'''
+            UPDATE {table}
+            SET status = ?, updated_at = ?{assignments}
+            WHERE {key_column} = ? AND status = ?
+        ''', (to_status, config.local_now().isoformat(), *fields.values(), row_id, from_status))
+    
+    if cursor.rowcount != 1:
+        logger.warning(f"{table} #{row_id} is not in {from_status}, skipped -> {to_status}")
+        return False
+    logger.info(f"{table} #{row_id}: {from_status} -> {to_status}")
+    return True
+
+
+async def claim_donation(donation_id: int, owner: str, lease_seconds: int) -> bool:
+    """기부 처리 권한 획득/연장"""
+    try:
+        return await _claim_row('donation_history', 'donation_id', donation_id, owner, lease_seconds)
+    except Exception as e:
+        logger.error(f"Error claiming donation {donation_id}: {e}")
+        return False
+
+
+async def release_donation(donation_id: int, owner: str) -> bool:
+    """기부 처리 권한 반납"""
+    try:
+        await _release_row('donation_history', 'donation_id', donation_id, owner)
+        return True
+    except Exception as e:
+        logger.error(f"Error releasing donation {donation_id}: {e}")
+        return False
+
+
+async def update_donation_status(donation_id: int, from_status: str, to_status: str, **fields) -> bool:
+    """기부 상태 전이"""
+    try:
+        return await _transition_row('donation_history', 'donation_id', ALLOWED_DONATION_UPDATE_FIELDS,
+                                     donation_id, from_status, to_status, fields)
+    except Exception as e:
+        logger.error(f"Error updating donation {donation_id}: {e}")
+        return False
+
+
+# ==================== 묶음 전송 (payout) ====================
+
+async def create_payout(lightning_address: str, donation_ids: List[int]) -> Optional[int]:
+    """paid 상태 기부들을 하나의 payout으로 묶음 - 묶인 기부는 forwarding으로 전이"""
+    try:
+        async with db_manager.transaction() as db:
+            now = config.local_now().isoformat()
+            placeholders = ', '.join('?' for _ in donation_ids)
+            
+            async with db.execute(f'''
+                SELECT COALESCE(SUM(amount), 0), COUNT(*) FROM donation_history
+                WHERE donation_id IN ({placeholders}) AND status = ? AND payout_id IS NULL
+            ''', (*donation_ids, DONATION_PAID)) as cursor:
+                amount, count = await cursor.fetchone()
+            
+            if count == 0:
+                return None
+            
+            cursor = await db.execute('''
+                INSERT INTO donation_payouts
+                (lightning_address, amount, donation_count, status, attempts, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 0, ?, ?)
+            ''', (lightning_address, amount, count, PAYOUT_PENDING, now, now))
+            payout_id = cursor.lastrowid
+            
+            await db.execute(f'''
+                UPDATE donation_history
+                SET status = ?, payout_id = ?, updated_at = ?
+                WHERE donation_id IN ({placeholders}) AND status = ? AND payout_id IS NULL
+            ''', (DONATION_FORWARDING, payout_id, now, *donation_ids, DONATION_PAID))
+            
+        logger.info(f"Payout #{payout_id} created: {count} donation(s), {amount} sats to {lightning_address}")
+        return payout_id
+    except Exception as e:
+        logger.error(f"Error creating payout: {e}")
+        return None
+
+
+async def get_payout(payout_id: int) -> Optional[aiosqlite.Row]:
+    """payout 조회"""
+    try:
+        async with db_manager.reader() as db:
+            async with db.execute('SELECT * FROM donation_payouts WHERE payout_id = ?', (payout_id,)) as cursor:
+                return await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error getting payout {payout_id}: {e}")
+        return None
+
+
+async def claim_payout(payout_id: int, owner: str, lease_seconds: int) -> bool:
+    """payout 처리 권한 획득/연장"""
+    try:
+        return await _claim_row('donation_payouts', 'payout_id', payout_id, owner, lease_seconds)
+    except Exception as e:
+        logger.error(f"Error claiming payout {payout_id}: {e}")
+        return False
+
+
+async def release_payout(payout_id: int, owner: str) -> bool:
+    """payout 처리 권한 반납"""
+    try:
+        await _release_row('donation_payouts', 'payout_id', payout_id, owner)
+        return True
+    except Exception as e:
+        logger.error(f"Error releasing payout {payout_id}: {e}")
+        return False
+
+
+async def update_payout_status(payout_id: int, from_status: str, to_status: str, **fields) -> bool:
+    """payout 상태 전이"""
+    try:
+        return await _transition_row('donation_payouts', 'payout_id', ALLOWED_PAYOUT_UPDATE_FIELDS,
+                                     payout_id, from_status, to_status, fields)
+    except Exception as e:
+        logger.error(f"Error updating payout {payout_id}: {e}")
+        return False
+
+
+async def complete_payout(payout_id: int, fee: int) -> bool:
+    """전송 완료 - payout/기부 forwarded 전이와 사용자 통계 갱신을 한 트랜잭션으로"""
+    try:
+        async with db_manager.transaction() as db:
+            now = config.local_now().isoformat()
+            
+            cursor = await db.execute('''
+                UPDATE donation_payouts
+                SET status = ?, fee = ?, error_message = NULL, updated_at = ?
+                WHERE payout_id = ? AND status = ?
+            ''', (PAYOUT_FORWARDED, fee, now, payout_id, PAYOUT_FORWARDING))
+            
+            if cursor.rowcount != 1:
+                logger.warning(f"Payout #{payout_id} is not forwarding, skipped completion")
+                return False
+            
+            # 사용자별 기여분으로 통계 갱신 (기부 내역은 사용자별로 그대로 유지)
+            await db.execute('''
+                UPDATE users
+                SET accumulated_sats = accumulated_sats - d.amount,
+                    total_donated_sats = total_donated_sats + d.amount,
+                    total_donation_count = total_donation_count + d.count
+                FROM (
+                    SELECT user_id, SUM(amount) AS amount, COUNT(*) AS count
+                    FROM donation_history
+                    WHERE payout_id = ? AND status = ?
+                    GROUP BY user_id
+                ) AS d
+                WHERE users.user_id = d.user_id
+            ''', (payout_id, DONATION_FORWARDING))
+            
+            async with db.execute(
+                'SELECT DISTINCT user_id FROM donation_history WHERE payout_id = ?', (payout_id,)
+            ) as cursor:
+                user_ids = [row[0] for row in await cursor.fetchall()]
+            updated = await _fetch_users(db, user_ids)
+            
+            # 수수료는 금액 비율로 나눠 기록
+            await db.execute('''
+                UPDATE donation_history
+                SET status = ?, fee = ? * amount / (SELECT amount FROM donation_payouts WHERE payout_id = ?),
+                    error_message = NULL, updated_at = ?
+                WHERE payout_id = ? AND status = ?
+            ''', (DONATION_FORWARDED, fee, payout_id, now, payout_id, DONATION_FORWARDING))
+            
+        _notify_user_updates(updated)
+        logger.info(f"Payout #{payout_id}: {PAYOUT_FORWARDING} -> {PAYOUT_FORWARDED}")
+        return True
+    except Exception as e:
+        logger.error(f"Error completing payout {payout_id}: {e}")
+        return False
+
+
+async def fail_payout(payout_id: int, from_status: str, error_message: str) -> bool:
+    """전송 실패 - payout과 묶인 기부를 함께 failed로"""
+    try:
+        async with db_manager.transaction() as db:
+            now = config.local_now().isoformat()
+            
+            cursor = await db.execute('''
+                UPDATE donation_payouts
+                SET status = ?, error_message = ?, updated_at = ?
+                WHERE payout_id = ? AND status = ?
+            ''', (PAYOUT_FAILED, error_message, now, payout_id, from_status))
+            
+            if cursor.rowcount != 1:
+                return False
+            
+            await db.execute('''
+                UPDATE donation_history
+                SET status = ?, error_message = ?, updated_at = ?
+                WHERE payout_id = ? AND status = ?
+            ''', (DONATION_FAILED, error_message, now, payout_id, DONATION_FORWARDING))
+            
+        logger.warning(f"Payout #{payout_id}: {from_status} -> {PAYOUT_FAILED} ({error_message})")
+        return True
+    except Exception as e:
+        logger.error(f"Error failing payout {payout_id}: {e}")
+        return False
+
+
+async def requeue_failed_payouts(payout_id: Optional[int] = None) -> List[int]:
+    """failed payout(전체 또는 하나)을 다시 전송 대기로 - 다시 넣은 payout ID 반환
+
+    전송용 Invoice가 남아 있으면 forwarding으로 되돌려 같은 Invoice로 다시 전송한다
+    (이전 전송이 실제로 나갔다면 ALREADY_PAID로 완료 처리되어 두 번 보내지 않음).
+    """
+    try:
+        async with db_manager.transaction() as db:
+            now = config.local_now().isoformat()
+            params: tuple = (PAYOUT_FAILED,)
+            payout_filter = ''
+            if payout_id is not None:
+                payout_filter = ' AND payout_id = ?'
+                params += (payout_id,)
+            
+            async with db.execute(f'''
+                UPDATE donation_payouts
+                SET status = CASE WHEN forward_invoice IS NULL THEN ? ELSE ? END,
+                    attempts = 0, error_message = NULL, locked_by = NULL, lease_until = NULL, updated_at = ?
+                WHERE status = ?{payout_filter}
+                RETURNING payout_id
+            ''', (PAYOUT_PENDING, PAYOUT_FORWARDING, now, *params)) as cursor:
+                payout_ids = [row[0] for row in await cursor.fetchall()]
+            
+            if payout_ids:
+                placeholders = ', '.join('?' for _ in payout_ids)
+                await db.execute(f'''
+                    UPDATE donation_history
+                    SET status = ?, error_message = NULL, updated_at = ?
+                    WHERE payout_id IN ({placeholders}) AND status = ?
+                ''', (DONATION_FORWARDING, now, *payout_ids, DONATION_FAILED))
+        
+        for requeued in payout_ids:
+            logger.info(f"Payout #{requeued}: {PAYOUT_FAILED} -> requeued")
+        return payout_ids
+    except Exception as e:
+        logger.error(f"Error requeueing failed payouts: {e}")
+        return []
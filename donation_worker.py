@@ -0,0 +1,401 @@
+"""
+Exercise Donation Bot - Donation Worker
+donation_history 상태 머신 실행 (재시작 시 미완료 기부 이어서 처리)
+
+invoice_created → paid → forwarding → forwarded
+       └────────────┴──────────┴──────→ failed
+
+결제 확인된 기부는 ForwardingQueue에 모였다가 FORWARD_BATCH_SIZE건이 차거나
+FORWARD_BATCH_WINDOW초가 지나면 하나의 payout(donation_payouts)으로 한 번에 전송된다.
+전송 결과가 PENDING(진행 중)이면 다시 보내지 않고 forwarding에 둔 채 결과만 확인한다.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+import aiosqlite
+import config
+import database
+import lightning_blink as lightning
+
+logger = logging.getLogger(__name__)
+
+# Blink가 이미 결제된 Invoice를 다시 결제하려 할 때 돌려주는 상태
+FORWARD_SUCCESS_STATUSES = ('SUCCESS', 'ALREADY_PAID')
+
+# 결제가 Lightning 네트워크에서 진행 중 (자금이 이미 나갔을 수 있어 다시 보내지 않음)
+FORWARD_PENDING_STATUS = 'PENDING'
+# forwarding payout의 error_message에 남겨 재시작 후에도 재전송 대신 상태 확인
+PAYMENT_IN_FLIGHT = 'payment_in_flight'
+
+
+class ForwardingQueue:
+    """결제 확인된 기부를 모아 Lightning Address별로 한 번에 전송"""
+
+    def __init__(self, owner: str):
+        self.owner = owner
+        self.batch_size = config.FORWARD_BATCH_SIZE
+        self.batch_window = config.FORWARD_BATCH_WINDOW
+        self._buffers: Dict[str, List[Tuple[int, int, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._payouts: Dict[int, asyncio.Task] = {}
+        self._requeues: Set[asyncio.Task] = set()
+        self._batch_attempts: Dict[int, int] = {}  # payout 생성 실패 횟수 (기부 ID별)
+        self.stats = {'donations': 0, 'payouts': 0}
+
+    async def submit(self, donation: aiosqlite.Row):
+        """paid 기부를 대기열에 추가하고 묶음 전송이 끝날 때까지 대기"""
+        address = donation['lightning_address']
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(address, (donation['donation_id'], donation['amount'], future))
+        self.stats['donations'] += 1
+        await asyncio.shield(future)
+
+    def _enqueue(self, address: str, entry: Tuple[int, int, asyncio.Future]):
+        self._buffers.setdefault(address, []).append(entry)
+        if len(self._buffers[address]) >= self.batch_size or self.batch_window <= 0:
+            self._flush(address)
+        elif address not in self._timers:
+            self._timers[address] = asyncio.create_task(self._flush_later(address))
+
+    async def resume(self, payout_id: int):
+        """이미 묶인 payout 전송을 이어서 진행"""
+        await asyncio.shield(self._run_payout(payout_id))
+
+    async def stop(self):
+        tasks = list(self._timers.values()) + list(self._payouts.values()) + list(self._requeues)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _flush_later(self, address: str):
+        await asyncio.sleep(self.batch_window)
+        self._timers.pop(address, None)
+        self._flush(address)
+
+    def _flush(self, address: str):
+        timer = self._timers.pop(address, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+        batch = self._buffers.pop(address, [])
+        if batch:
+            asyncio.create_task(self._send_batch(address, batch))
+
+    async def _split_by_limit(self, address: str, batch: List[Tuple[int, int, asyncio.Future]]) -> List[List[int]]:
+        """받는 쪽 maxSendable을 넘지 않도록 기부 묶음 분할"""
+        try:
+            pay_info = await lightning.get_blink().resolve_lnurl_pay(address)
+            max_sats = pay_info["max_sendable"] // 1000
+        except Exception as e:
+            logger.warning(f"Could not resolve payout limits for {address}: {e}")
+            max_sats = 0
+
+        chunks: List[List[int]] = []
+        chunk_total = 0
+        for donation_id, amount, _ in batch:
+            if not chunks or (max_sats and chunk_total + amount > max_sats):
+                chunks.append([])
+                chunk_total = 0
+            chunks[-1].append(donation_id)
+            chunk_total += amount
+        return chunks
+
+    async def _send_batch(self, address: str, batch: List[Tuple[int, int, asyncio.Future]]):
+        entries = {donation_id: (donation_id, amount, future) for donation_id, amount, future in batch}
+        requeued: Set[int] = set()
+        try:
+            payout_tasks = []
+            unbatched: List[Tuple[int, int, asyncio.Future]] = []
+            for donation_ids in await self._split_by_limit(address, batch):
+                payout_id = await database.create_payout(address, donation_ids)
+                if payout_id is not None:
+                    self.stats['payouts'] += 1
+                    payout_tasks.append(self._run_payout(payout_id))
+                else:
+                    unbatched.extend(entries[donation_id] for donation_id in donation_ids)
+            if unbatched:
+                requeued = await self._retry_unbatched(address, unbatched)
+            await asyncio.gather(*payout_tasks)
+        except Exception as e:
+            logger.error(f"Payout batch for {address} failed: {e}")
+        finally:
+            for donation_id, _, future in batch:
+                if donation_id not in requeued and not future.done():
+                    future.set_result(None)
+
+    async def _retry_unbatched(self, address: str, entries: List[Tuple[int, int, asyncio.Future]]) -> Set[int]:
+        """payout으로 묶지 못한 기부 처리 - 대기열에 다시 넣은 기부 ID 반환
+
+        아직 paid로 남은 기부는 RETRY_DELAY 뒤 대기열에 다시 넣고,
+        FORWARD_MAX_ATTEMPTS번 실패하면 오류를 기록한 뒤 paid로 남겨 resume()에 맡긴다.
+        (이미 다른 payout에 묶인 기부는 그쪽에서 처리되므로 그대로 완료)
+        """
+        requeued: Set[int] = set()
+        for donation_id, amount, future in entries:
+            donation = await database.get_donation(donation_id)
+            if donation is None or donation['status'] != database.DONATION_PAID or donation['payout_id'] is not None:
+                self._batch_attempts.pop(donation_id, None)
+                continue
+
+            attempts = self._batch_attempts.get(donation_id, 0) + 1
+            if attempts >= config.FORWARD_MAX_ATTEMPTS:
+                self._batch_attempts.pop(donation_id, None)
+                logger.error(f"Donation #{donation_id} could not be added to a payout after {attempts} attempts")
+                await database.update_donation_status(
+                    donation_id, database.DONATION_PAID, database.DONATION_PAID,
+                    error_message='payout_create_failed'
+                )
+                continue
+
+            self._batch_attempts[donation_id] = attempts
+            logger.warning(f"Donation #{donation_id} could not be added to a payout, "
+                           f"retrying (attempt {attempts}/{config.FORWARD_MAX_ATTEMPTS})")
+            task = asyncio.create_task(self._requeue(address, (donation_id, amount, future), attempts))
+            self._requeues.add(task)
+            task.add_done_callback(self._requeues.discard)
+            requeued.add(donation_id)
+        return requeued
+
+    async def _requeue(self, address: str, entry: Tuple[int, int, asyncio.Future], attempts: int):
+        """잠시 뒤 대기열에 다시 넣음 (submit()의 대기 Future는 그대로 유지)"""
+        await asyncio.sleep(config.RETRY_DELAY * attempts)
+        self._enqueue(address, entry)
+
+    def _run_payout(self, payout_id: int) -> asyncio.Task:
+        """payout 처리 Task (같은 payout은 한 번만 실행)"""
+        task = self._payouts.get(payout_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._process_payout(payout_id))
+            self._payouts[payout_id] = task
+            task.add_done_callback(lambda _: self._payouts.pop(payout_id, None))
+        return task
+
+    async def _process_payout(self, payout_id: int):
+        try:
+            while True:
+                if not await database.claim_payout(payout_id, self.owner, config.DONATION_LEASE_SECONDS):
+                    logger.info(f"Payout #{payout_id} is being processed elsewhere")
+                    return
+
+                payout = await database.get_payout(payout_id)
+                if payout is None:
+                    return
+
+                status = payout['status']
+                if status == database.PAYOUT_PENDING:
+                    await self._prepare(payout)
+                elif status == database.PAYOUT_FORWARDING:
+                    await self._forward(payout)
+                else:
+                    return
+        finally:
+            await database.release_payout(payout_id, self.owner)
+
+    async def _prepare(self, payout: aiosqlite.Row):
+        """pending → forwarding (전송용 Invoice를 먼저 저장해 재시작 시 같은 Invoice로 재시도)"""
+        blink = lightning.get_blink()
+        try:
+            forward_invoice = await blink.get_lnurl_invoice_from_address(
+                payout['lightning_address'], payout['amount']
+            )
+        except Exception as e:
+            await self._record_error(payout, database.PAYOUT_PENDING, e)
+            return
+
+        await database.update_payout_status(
+            payout['payout_id'], database.PAYOUT_PENDING, database.PAYOUT_FORWARDING,
+            forward_invoice=forward_invoice
+        )
+
+    async def _forward(self, payout: aiosqlite.Row):
+        """forwarding → forwarded"""
+        payout_id = payout['payout_id']
+        forward_invoice = payout['forward_invoice']
+        blink = lightning.get_blink()
+
+        if payout['error_message'] == PAYMENT_IN_FLIGHT:
+            await self._check_in_flight(payout)
+            return
+
+        try:
+            fee = await blink.probe_invoice_fee(forward_invoice)
+            logger.info(f"Transfer fee: {fee} sats {'(FREE - Blink internal)' if fee == 0 else ''}")
+            status = await blink.pay_invoice(forward_invoice)
+        except Exception as e:
+            if 'expired' in str(e).lower():
+                # 결제되지 않은 채 만료된 Invoice - 새 Invoice로 다시 시도
+                await database.update_payout_status(
+                    payout_id, database.PAYOUT_FORWARDING, database.PAYOUT_PENDING,
+                    forward_invoice=None, error_message=str(e)
+                )
+                return
+            await self._record_error(payout, database.PAYOUT_FORWARDING, e)
+            return
+
+        if status in FORWARD_SUCCESS_STATUSES:
+            await database.complete_payout(payout_id, fee)
+        elif status == FORWARD_PENDING_STATUS:
+            await self._mark_in_flight(payout)
+        else:
+            await self._record_error(payout, database.PAYOUT_FORWARDING, Exception(f"status {status}"))
+
+    async def _mark_in_flight(self, payout: aiosqlite.Row):
+        """전송이 진행 중 - 재시도 횟수를 늘리지 않고 forwarding에 둔 채 상태만 다시 확인"""
+        payout_id = payout['payout_id']
+        logger.info(f"Payout #{payout_id} is in flight, checking again in {config.FORWARD_PENDING_CHECK_INTERVAL}s")
+        await database.update_payout_status(
+            payout_id, database.PAYOUT_FORWARDING, database.PAYOUT_FORWARDING,
+            error_message=PAYMENT_IN_FLIGHT
+        )
+        await asyncio.sleep(config.FORWARD_PENDING_CHECK_INTERVAL)
+
+    async def _check_in_flight(self, payout: aiosqlite.Row):
+        """진행 중이던 전송 결과 확인 - 성공이면 완료, 실패했거나 보낸 기록이 없을 때만 다시 전송"""
+        payout_id = payout['payout_id']
+        try:
+            sent = await lightning.get_blink().get_outgoing_payment(payout['forward_invoice'])
+        except Exception as e:
+            # 확인하지 못했으면 자금이 나갔을 수 있으므로 다시 보내지 않고 대기
+            logger.warning(f"Could not check in-flight payout #{payout_id}: {e}")
+            await asyncio.sleep(config.FORWARD_PENDING_CHECK_INTERVAL)
+            return
+
+        status = sent['status'] if sent else None
+        if status == 'SUCCESS':
+            await database.complete_payout(payout_id, sent['fee'])
+        elif status == FORWARD_PENDING_STATUS:
+            await asyncio.sleep(config.FORWARD_PENDING_CHECK_INTERVAL)
+        else:
+            # error_message가 바뀌어 다음 차례에는 같은 Invoice로 다시 전송
+            await self._record_error(payout, database.PAYOUT_FORWARDING,
+                                     Exception(f"in-flight payment ended with {status or 'no payment'}"))
+
+    async def _record_error(self, payout: aiosqlite.Row, status: str, error: Exception):
+        """전송 오류 기록 - 재시도 횟수를 넘기면 payout과 묶인 기부 모두 failed"""
+        payout_id = payout['payout_id']
+        attempts = (payout['attempts'] or 0) + 1
+        logger.warning(f"Payout #{payout_id} failed (attempt {attempts}/{config.FORWARD_MAX_ATTEMPTS}): {error}")
+
+        if attempts >= config.FORWARD_MAX_ATTEMPTS:
+            await database.fail_payout(payout_id, status, str(error))
+            return
+
+        await database.update_payout_status(
+            payout_id, status, status, attempts=attempts, error_message=str(error)
+        )
+        await asyncio.sleep(config.RETRY_DELAY * attempts)
+
+
+class DonationWorker:
+    """기부 한 건을 현재 상태부터 끝(forwarded/failed)까지 진행"""
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.forwarding_queue = ForwardingQueue(self.owner)
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def process(self, donation_id: int) -> asyncio.Task:
+        """기부 처리 시작 (이미 처리 중이면 같은 Task 반환)"""
+        task = self._tasks.get(donation_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._process(donation_id))
+            self._tasks[donation_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(donation_id, None))
+        return task
+
+    async def wait(self, donation_id: int) -> Optional[aiosqlite.Row]:
+        """기부 처리가 끝날 때까지 대기 후 최종 행 반환"""
+        return await asyncio.shield(self.process(donation_id))
+
+    async def resume(self) -> int:
+        """미완료 기부를 모두 이어서 처리"""
+        donations = await database.get_unfinished_donations()
+        for donation in donations:
+            self.process(donation['donation_id'])
+        if donations:
+            logger.info(f"Resuming {len(donations)} unfinished donation(s)")
+        return len(donations)
+
+    async def stop(self):
+        """처리 중인 작업 취소 - 임대가 만료되면 다음 실행(또는 다른 프로세스)이 이어서 처리"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.forwarding_queue.stop()
+
+    async def _process(self, donation_id: int) -> Optional[aiosqlite.Row]:
+        keep_lease: Optional[asyncio.Task] = None
+        try:
+            while True:
+                if not await database.claim_donation(donation_id, self.owner, config.DONATION_LEASE_SECONDS):
+                    logger.info(f"Donation #{donation_id} is being processed elsewhere")
+                    return await database.get_donation(donation_id)
+                if keep_lease is None:
+                    # 결제 대기와 전송 재시도가 임대보다 길어져도 다른 프로세스가 가져가지 않도록
+                    keep_lease = asyncio.create_task(self._keep_lease(donation_id))
+
+                donation = await database.get_donation(donation_id)
+                if donation is None:
+                    return None
+
+                status = donation['status']
+                if status == database.DONATION_INVOICE_CREATED:
+                    await self._await_payment(donation)
+                elif status == database.DONATION_PAID:
+                    await self.forwarding_queue.submit(donation)
+                elif status == database.DONATION_FORWARDING:
+                    await self.forwarding_queue.resume(donation['payout_id'])
+                else:
+                    return donation
+
+                if status != database.DONATION_INVOICE_CREATED:
+                    # 전송 단계가 끝났는데도 상태가 그대로면 (다른 프로세스 처리 중 등) 여기서 중단
+                    current = await database.get_donation(donation_id)
+                    if current is None or current['status'] == status:
+                        return current
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Donation #{donation_id} processing error: {e}")
+            return await database.get_donation(donation_id)
+        finally:
+            if keep_lease is not None:
+                keep_lease.cancel()
+                await asyncio.gather(keep_lease, return_exceptions=True)
+            await database.release_donation(donation_id, self.owner)
+
+    async def _keep_lease(self, donation_id: int):
+        """임대 기간의 1/3마다 기부 임대 연장"""
+        interval = max(config.DONATION_LEASE_SECONDS / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            if not await database.claim_donation(donation_id, self.owner, config.DONATION_LEASE_SECONDS):
+                logger.warning(f"⚠️ Lost lease on donation #{donation_id}")
+                return
+
+    async def _await_payment(self, donation: aiosqlite.Row):
+        """invoice_created → paid / failed"""
+        donation_id = donation['donation_id']
+        elapsed = (config.local_now() - datetime.fromisoformat(donation['timestamp'])).total_seconds()
+        # 재시작으로 타임아웃이 지났더라도 다운타임 중 결제됐을 수 있으므로 최소 한 번은 확인
+        timeout = max(config.PAYMENT_TIMEOUT - elapsed, config.PAYMENT_CHECK_INTERVAL * 2)
+
+        paid = await lightning.verify_payment(donation['lightning_invoice'], timeout=timeout)
+        if paid:
+            await database.update_donation_status(
+                donation_id, database.DONATION_INVOICE_CREATED, database.DONATION_PAID,
+                paid_at=config.local_now().isoformat()
+            )
+        else:
+            await database.update_donation_status(
+                donation_id, database.DONATION_INVOICE_CREATED, database.DONATION_FAILED,
+                error_message=database.DONATION_UNPAID_ERROR
+            )
+
+
+# 전역 기부 워커
+donation_worker = DonationWorker()
@@ -0,0 +1,336 @@
+"""
+Exercise Donation Bot - Leaderboard
+카테고리별 메모리 순위 구조 (top-N / 순위 조회를 DB 왕복 없이 O(log n))
+
+시작 시 users 전체로 한 번 구성하고, 이후에는 database의 users 변경 알림으로 해당 사용자만 갱신한다.
+길드별 순위는 길드 멤버만 담은 별도 파티션으로 관리해 길드 멤버 수에만 비례한다.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple, Any, Callable
+from sortedcontainers import SortedList
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+
+def _category_score(row, expression: str) -> float:
+    """users 행에서 카테고리 점수 계산 (SQL 정렬 식과 같은 순서로 더함)"""
+    if expression == database.DISTANCE_TOTAL_EXPRESSION:
+        return (row['total_walking_km'] + row['total_cycling_km']
+                + row['total_running_km'] + row['total_swimming_km'])
+    return row[expression]
+
+
+class CategoryRanking:
+    """카테고리 하나의 순위 (점수 내림차순 SortedList)"""
+
+    def __init__(self):
+        self._entries = SortedList()  # (-score, user_id)
+        self._scores: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def load(self, scores: Dict[str, float]):
+        """전체 점수로 다시 구성"""
+        self._scores = dict(scores)
+        self._entries = SortedList((-score, user_id) for user_id, score in self._scores.items())
+
+    def update(self, user_id: str, score: float):
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._entries.remove((-old, user_id))
+        self._entries.add((-score, user_id))
+        self._scores[user_id] = score
+
+    def remove(self, user_id: str):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._entries.remove((-old, user_id))
+
+    def score(self, user_id: str) -> Optional[float]:
+        return self._scores.get(user_id)
+
+    def top(self, limit: int) -> List[Tuple[str, float]]:
+        """점수가 0보다 큰 상위 사용자 (user_id, score) - 동점은 user_id 순"""
+        result = []
+        for neg_score, user_id in self._entries.islice(0, limit):
+            if -neg_score <= 0:
+                break
+            result.append((user_id, -neg_score))
+        return result
+
+    def rank_of_score(self, score: float) -> int:
+        """점수가 score보다 높은 사용자 수 + 1 (동점은 같은 순위)"""
+        # ''는 모든 user_id보다 작으므로 점수가 더 높은 항목 수만 셈
+        return self._entries.bisect_left((-score, '')) + 1
+
+    def rank(self, user_id: str) -> Optional[int]:
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return self.rank_of_score(score)
+
+
+def _new_partition() -> Dict[str, CategoryRanking]:
+    return {category: CategoryRanking() for category in database.LEADERBOARD_CATEGORIES}
+
+
+class LeaderboardEngine:
+    """database.LEADERBOARD_CATEGORIES 전체의 메모리 순위 (전체 + 길드별 파티션)"""
+
+    def __init__(self):
+        self._rankings = _new_partition()
+        self._guilds: Dict[str, Dict[str, CategoryRanking]] = {}
+        self._guild_members: Dict[str, Set[str]] = {}  # users에 아직 없는 멤버 포함
+        self._user_guilds: Dict[str, Set[str]] = {}
+        self._usernames: Dict[str, str] = {}
+        self._loaded = False
+        self._reloading: Optional[List[Callable[[], None]]] = None  # 다시 구성하는 동안 들어온 변경
+        self._verify_task = None
+        self.stats = {'updates': 0, 'checks': 0, 'mismatches': 0}
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def total_users(self) -> int:
+        return len(self._usernames)
+
+    def user_count(self, guild_id: Optional[str] = None) -> int:
+        """사용자 수 (guild_id가 있으면 users에 등록된 길드 멤버 수)"""
+        if not guild_id:
+            return self.total_users
+        partition = self._guilds.get(guild_id)
+        return len(partition['distance']) if partition else 0
+
+    async def load(self):
+        """users / guild_members 전체로 순위 구성"""
+        if not self._loaded:
+            database.add_user_listener(self.apply_user)
+            database.add_membership_listener(self.apply_membership)
+
+        self._reloading = []
+        try:
+            rows = await database.get_ranking_rows()
+            memberships = await database.get_guild_memberships()
+
+            scores = {}
+            for category, expression in database.LEADERBOARD_CATEGORIES.items():
+                scores[category] = {row['user_id']: _category_score(row, expression) for row in rows}
+                self._rankings[category].load(scores[category])
+            self._usernames = {row['user_id']: row['username'] for row in rows}
+
+            self._guild_members = {}
+            self._user_guilds = {}
+            for membership in memberships:
+                self._guild_members.setdefault(membership['guild_id'], set()).add(membership['user_id'])
+                self._user_guilds.setdefault(membership['user_id'], set()).add(membership['guild_id'])
+
+            self._guilds = {}
+            for guild_id, members in self._guild_members.items():
+                partition = _new_partition()
+                for category, ranking in partition.items():
+                    ranking.load({
+                        user_id: scores[category][user_id]
+                        for user_id in members if user_id in scores[category]
+                    })
+                self._guilds[guild_id] = partition
+            self._loaded = True
+
+            # 조회 이후 커밋된 변경이 스냅샷에 덮이지 않도록 다시 적용
+            for apply in self._reloading:
+                apply()
+        finally:
+            self._reloading = None
+        logger.info(f"Leaderboard loaded: {len(rows)} users, {len(self._guilds)} guilds, "
+                    f"{len(self._rankings)} categories")
+
+    def apply_user(self, row):
+        """users 행 변경 반영 (database 리스너)"""
+        if self._reloading is not None:
+            self._reloading.append(lambda: self._apply(row))
+        if self._loaded:
+            self._apply(row)
+
+    def apply_membership(self, guild_id: str, user_id: str, joined: bool):
+        """길드 멤버십 변경 반영 (database 리스너)"""
+        if self._reloading is not None:
+            self._reloading.append(lambda: self._apply_membership(guild_id, user_id, joined))
+        if self._loaded:
+            self._apply_membership(guild_id, user_id, joined)
+
+    def _apply(self, row):
+        user_id = row['user_id']
+        partitions = [self._guilds[guild_id] for guild_id in self._user_guilds.get(user_id, ())
+                      if guild_id in self._guilds]
+        for category, expression in database.LEADERBOARD_CATEGORIES.items():
+            score = _category_score(row, expression)
+            self._rankings[category].update(user_id, score)
+            for partition in partitions:
+                partition[category].update(user_id, score)
+        self._usernames[user_id] = row['username']
+        self.stats['updates'] += 1
+
+    def _apply_membership(self, guild_id: str, user_id: str, joined: bool):
+        if joined:
+            self._guild_members.setdefault(guild_id, set()).add(user_id)
+            self._user_guilds.setdefault(user_id, set()).add(guild_id)
+            partition = self._guilds.setdefault(guild_id, _new_partition())
+            for category, ranking in partition.items():
+                score = self._rankings[category].score(user_id)
+                if score is not None:
+                    ranking.update(user_id, score)
+            return
+
+        self._guild_members.get(guild_id, set()).discard(user_id)
+        self._user_guilds.get(user_id, set()).discard(guild_id)
+        partition = self._guilds.get(guild_id)
+        if partition is not None:
+            for ranking in partition.values():
+                ranking.remove(user_id)
+        if not self._guild_members.get(guild_id):
+            self._guild_members.pop(guild_id, None)
+            self._guilds.pop(guild_id, None)
+
+    def get_leaderboard(self, category: str = 'distance', limit: int = 10,
+                        guild_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """상위 사용자 (database.get_leaderboard와 같은 키)"""
+        partition = self._guilds.get(guild_id, {}) if guild_id else self._rankings
+        ranking = partition.get(category)
+        if ranking is None:
+            return []
+        return [
+            {'user_id': user_id, 'username': self._usernames.get(user_id), 'total': score}
+            for user_id, score in ranking.top(limit)
+        ]
+
+    def get_user_rank(self, user_id: str, category: str = 'distance',
+                      guild_id: Optional[str] = None) -> Optional[int]:
+        ranking = self._rankings.get(category)
+        if ranking is None:
+            return None
+        if not guild_id:
+            return ranking.rank(user_id)
+
+        # 길드 안 순위는 (멤버가 아니어도) 내 점수보다 높은 길드 멤버 수로 계산
+        score = ranking.score(user_id)
+        if score is None:
+            return None
+        partition = self._guilds.get(guild_id)
+        return partition[category].rank_of_score(score) if partition else 1
+
+    async def verify(self, repair: bool = True) -> List[str]:
+        """DB와 점수/멤버십 비교 - 불일치 목록 반환 (repair면 DB 기준으로 다시 구성)"""
+        rows = await database.get_ranking_rows()
+        if not rows and self.total_users:
+            # 조회 실패로 빈 결과가 온 경우 메모리 순위를 비우지 않음
+            logger.warning("Leaderboard consistency check skipped: no rows from database")
+            return []
+        memberships = await database.get_guild_memberships()
+        self.stats['checks'] += 1
+
+        mismatches = []
+        if len(rows) != self.total_users:
+            mismatches.append(f"user count {self.total_users} != {len(rows)}")
+
+        for row in rows:
+            for category, expression in database.LEADERBOARD_CATEGORIES.items():
+                expected = _category_score(row, expression)
+                actual = self._rankings[category].score(row['user_id'])
+                if actual != expected:
+                    mismatches.append(f"{category}/{row['user_id']}: {actual} != {expected}")
+
+        expected_members = {(m['guild_id'], m['user_id']) for m in memberships}
+        actual_members = {(guild_id, user_id)
+                          for guild_id, members in self._guild_members.items() for user_id in members}
+        if expected_members != actual_members:
+            mismatches.append(f"guild memberships differ by {len(expected_members ^ actual_members)}")
+
+        for guild_id, partition in self._guilds.items():
+            for category, ranking in partition.items():
+                for user_id in self._guild_members.get(guild_id, ()):
+                    if ranking.score(user_id) != self._rankings[category].score(user_id):
+                        mismatches.append(f"{guild_id}/{category}/{user_id}: partition out of sync")
+
+        if mismatches:
+            self.stats['mismatches'] += len(mismatches)
+            logger.warning(f"⚠️ Leaderboard out of sync ({len(mismatches)} mismatches): {mismatches[:5]}")
+            if repair:
+                await self.load()
+        return mismatches
+
+    def start_verifier(self, interval: Optional[int] = None):
+        """주기적 일치 검사 시작"""
+        if interval is None:
+            interval = config.LEADERBOARD_VERIFY_INTERVAL
+        if interval > 0 and (self._verify_task is None or self._verify_task.done()):
+            self._verify_task = asyncio.create_task(self._verify_loop(interval))
+
+    async def stop(self):
+        if self._verify_task is not None:
+            self._verify_task.cancel()
+            try:
+                await self._verify_task
+            except asyncio.CancelledError:
+                pass
+            self._verify_task = None
+
+    async def _verify_loop(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.verify()
+            except Exception as e:
+                logger.error(f"Leaderboard consistency check failed: {e}")
+
+
+# 전역 리더보드
+leaderboard = LeaderboardEngine()
+
+
+def _use_memory() -> bool:
+    return config.LEADERBOARD_MEMORY_ENABLED and leaderboard.loaded
+
+
+async def get_leaderboard(category: str = 'distance', limit: int = 10,
+                          guild_id: Optional[str] = None) -> List[Any]:
+    """메모리 리더보드가 준비됐으면 메모리에서, 아니면 DB에서 조회"""
+    if _use_memory():
+        return leaderboard.get_leaderboard(category, limit, guild_id)
+    return await database.get_leaderboard(category, limit, guild_id)
+
+
+async def get_user_rank(user_id: str, category: str = 'distance',
+                        guild_id: Optional[str] = None) -> Optional[int]:
+    """메모리 리더보드가 준비됐으면 메모리에서, 아니면 DB에서 조회"""
+    if _use_memory():
+        return leaderboard.get_user_rank(user_id, category, guild_id)
+    return await database.get_user_rank(user_id, category, guild_id)
+
+
+async def get_total_users(guild_id: Optional[str] = None) -> int:
+    """메모리 리더보드가 준비됐으면 메모리에서, 아니면 DB에서 조회"""
+    if _use_memory():
+        return leaderboard.user_count(guild_id)
+    return await database.get_total_users(guild_id)
+
+
+async def get_user_stats_with_ranks(user_id: str, guild_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """사용자 통계 + 카테고리별 순위 + 사용자 수 (DB 조회 1회)"""
+    if _use_memory():
+        stats = await database.get_user_stats(user_id)
+        if stats is None:
+            return None
+        stats['ranks'] = {
+            category: leaderboard.get_user_rank(user_id, category, guild_id)
+            for category in database.LEADERBOARD_CATEGORIES
+        }
+        stats['total_users'] = leaderboard.user_count(guild_id)
+        return stats
+    return await database.get_user_stats_with_ranks(user_id, guild_id)
@@ -5,14 +5,254 @@ Blink GraphQL API를 사용한 Lightning 결제 처리 (CitadelPay 방식)
 import aiohttp
 import asyncio
 import logging
+import time
 import qrcode
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Callable, Awaitable
 import config
+import database
+from payment_watcher import InvoiceWatcher
 
 logger = logging.getLogger(__name__)
 
 
+# ==================== 공유 HTTP 세션 ====================
+
+_http_session: Optional[aiohttp.ClientSession] = None
+_http_stats = {
+    'requests': 0,
+    'in_flight': 0,
+    'peak_in_flight': 0,
+    'connections_created': 0,
+    'connections_reused': 0,
+}
+
+
+def _build_trace_config() -> aiohttp.TraceConfig:
+    """연결 생성/재사용 횟수 추적용 TraceConfig"""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        _http_stats['requests'] += 1
+        _http_stats['in_flight'] += 1
+        _http_stats['peak_in_flight'] = max(_http_stats['peak_in_flight'], _http_stats['in_flight'])
+
+    async def on_request_done(session, ctx, params):
+        _http_stats['in_flight'] -= 1
+
+    async def on_connection_create_end(session, ctx, params):
+        # 새 TCP(+TLS) 핸드셰이크 발생
+        _http_stats['connections_created'] += 1
+
+    async def on_connection_reuseconn(session, ctx, params):
+        _http_stats['connections_reused'] += 1
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_done)
+    trace_config.on_request_exception.append(on_request_done)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    return trace_config
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """봇 전체에서 공유하는 HTTP 세션 (커넥션 풀 + keep-alive + DNS 캐시)"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=config.HTTP_POOL_SIZE,
+            limit_per_host=config.HTTP_POOL_SIZE_PER_HOST,
+            keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=config.HTTP_DNS_CACHE_TTL,
+            use_dns_cache=True,
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=30),
+            trace_configs=[_build_trace_config()],
+        )
+        logger.info(
+            f"HTTP session created (pool={config.HTTP_POOL_SIZE}, "
+            f"per_host={config.HTTP_POOL_SIZE_PER_HOST})"
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """공유 HTTP 세션 종료 (봇 종료 시 호출)"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        logger.info(f"HTTP session stats: {get_http_stats()}")
+        await _http_session.close()
+        logger.info("HTTP session closed")
+    _http_session = None
+
+
+def get_http_stats() -> Dict[str, Any]:
+    """핸드셰이크/커넥션 재사용/풀 사용량 통계"""
+    stats = dict(_http_stats)
+    stats['pool_limit'] = config.HTTP_POOL_SIZE
+    stats['pool_limit_per_host'] = config.HTTP_POOL_SIZE_PER_HOST
+    return stats
+
+
+# ==================== QR 코드 렌더링 ====================
+
+def render_qr_png(invoice: str, optimize: bool = False) -> bytes:
+    """Invoice QR 코드 PNG 렌더링 (워커 스레드/프로세스에서 실행)"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(invoice.upper())
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white").get_image()
+    
+    buffer = BytesIO()
+    if optimize:
+        # qrcode 이미지는 이미 1bit(mode '1')이므로 변환 없이 압축만 최적화
+        img.save(buffer, format='PNG', optimize=True)
+    else:
+        img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class QrCache:
+    """렌더링된 QR PNG LRU 캐시 (Invoice 기준)"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+    
+    def get(self, invoice: str) -> Optional[bytes]:
+        png = self._entries.get(invoice)
+        if png is None:
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(invoice)
+        self.stats['hits'] += 1
+        return png
+    
+    def put(self, invoice: str, png: bytes):
+        if self.max_size <= 0:
+            return
+        self._entries[invoice] = png
+        self._entries.move_to_end(invoice)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+_qr_cache = QrCache(config.QR_CACHE_SIZE)
+_qr_executor: Optional[Executor] = None
+
+
+def _get_qr_executor() -> Executor:
+    """QR 렌더링용 워커 풀 (QR_RENDER_EXECUTOR=thread|process)"""
+    global _qr_executor
+    if _qr_executor is None:
+        if config.QR_RENDER_EXECUTOR == 'process':
+            _qr_executor = ProcessPoolExecutor(max_workers=config.QR_RENDER_WORKERS)
+        else:
+            _qr_executor = ThreadPoolExecutor(max_workers=config.QR_RENDER_WORKERS, thread_name_prefix='qr')
+    return _qr_executor
+
+
+def close_qr_executor():
+    """QR 워커 풀 종료 (봇 종료 시 호출)"""
+    global _qr_executor
+    if _qr_executor is not None:
+        _qr_executor.shutdown(wait=False)
+        _qr_executor = None
+
+
+WALLET_ID_CACHE_KEY = 'blink_btc_wallet_id'
+
+
+class LnurlError(Exception):
+    """받는 쪽이 확정적으로 거부한 LNURL 조회 (잘못된 주소, 404, status ERROR)
+
+    타임아웃/5xx/연결 오류 같은 일시적 오류와 달리 다시 조회해도 같으므로 실패 캐시 대상이다.
+    """
+
+
+class LnurlPayCache:
+    """LNURL-pay 정보 TTL/LRU 캐시 (확정적인 실패는 오류 메시지만 짧게 캐시)"""
+    
+    def __init__(self, max_size: int = None, ttl: int = None, negative_ttl: int = None):
+        self.max_size = max_size or config.LNURL_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else config.LNURL_CACHE_TTL
+        self.negative_ttl = negative_ttl if negative_ttl is not None else config.LNURL_NEGATIVE_CACHE_TTL
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'invalidations': 0}
+    
+    def get(self, address: str) -> Optional[Any]:
+        """캐시된 정보 (실패 캐시는 오류 메시지 str) - 없거나 만료되면 None"""
+        entry = self._entries.get(address)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(address, None)
+            self.stats['misses'] += 1
+            return None
+        
+        self._entries.move_to_end(address)
+        if isinstance(entry[1], str):
+            self.stats['negative_hits'] += 1
+        else:
+            self.stats['hits'] += 1
+        return entry[1]
+    
+    def put(self, address: str, pay_info: Dict[str, Any]):
+        self._store(address, pay_info, self.ttl)
+    
+    def put_failure(self, address: str, message: str):
+        self._store(address, message, self.negative_ttl)
+    
+    def invalidate(self, address: str):
+        if self._entries.pop(address, None) is not None:
+            self.stats['invalidations'] += 1
+    
+    def _store(self, address: str, value: Any, ttl: int):
+        if ttl <= 0:
+            return
+        self._entries[address] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(address)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+# Blink가 지갑 ID를 거부할 때의 GraphQL 오류 code
+# (잔액 부족 등 다른 오류는 지갑 ID를 바꿔도 같으므로 결제를 다시 보내지 않음)
+WALLET_ERROR_CODES = frozenset({
+    'INVALID_WALLET_ID',
+    'WALLET_NOT_FOUND',
+    'COULD_NOT_FIND_WALLET_FROM_ID',
+})
+
+
+class BlinkApiError(Exception):
+    """Blink GraphQL 오류 (오류 code 포함)"""
+    
+    def __init__(self, message: str, code: Optional[str] = None):
+        super().__init__(message)
+        self.code = code
+
+
+def _error_code(error: Dict[str, Any]) -> Optional[str]:
+    """GraphQL 오류의 code (payload errors는 code, 최상위 errors는 extensions.code)"""
+    code = error.get("code") or (error.get("extensions") or {}).get("code")
+    return str(code).upper() if code else None
+
+
+def _is_wallet_error(error: Exception) -> bool:
+    """Blink가 지갑 ID를 거부한 오류인지 확인"""
+    return isinstance(error, BlinkApiError) and error.code in WALLET_ERROR_CODES
+
+
 class BlinkPayment:
     """Blink GraphQL API를 사용한 Lightning 결제 처리"""
     
@@ -24,9 +264,24 @@ class BlinkPayment:
             "X-API-KEY": self.api_key
         }
         self.btc_wallet_id = None  # 캐시
+        self.lnurl_cache = LnurlPayCache()
         self.max_retries = config.MAX_RETRIES
         self.retry_delay = config.RETRY_DELAY
     
+    async def _post_graphql(self, payload: dict) -> Dict[str, Any]:
+        """GraphQL POST 1회 실행 - 응답 JSON(data + errors) 그대로 반환"""
+        session = await get_http_session()
+        async with session.post(
+            self.api_endpoint,
+            json=payload,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=30)
+        ) as response:
+            if response.status == 200:
+                return await response.json()
+            text = await response.text()
+            raise Exception(f"HTTP {response.status}: {text}")
+    
     async def _graphql_request(self, query: str, variables: dict = None, retries: int = None) -> Dict[str, Any]:
         """GraphQL 요청 실행 (재시도 로직 포함)"""
         if retries is None:
@@ -41,21 +296,10 @@ class BlinkPayment:
         
         for attempt in range(retries):
             try:
-                timeout = aiohttp.ClientTimeout(total=30)
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.post(
-                        self.api_endpoint,
-                        json=payload,
-                        headers=self.headers
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if "errors" in data:
-                                raise Exception(f"GraphQL Error: {data['errors']}")
-                            return data.get("data")
-                        else:
-                            text = await response.text()
-                            raise Exception(f"HTTP {response.status}: {text}")
+                data = await self._post_graphql(payload)
+                if "errors" in data:
+                    raise BlinkApiError(f"GraphQL Error: {data['errors']}", _error_code(data['errors'][0]))
+                return data.get("data")
                             
             except Exception as e:
                 last_error = e
@@ -68,10 +312,16 @@ class BlinkPayment:
         raise last_error
     
     async def get_btc_wallet_id(self) -> str:
-        """BTC 지갑 ID 가져오기 (캐시)"""
+        """BTC 지갑 ID 가져오기 (메모리 → DB 캐시 → API 순)"""
         if self.btc_wallet_id:
             return self.btc_wallet_id
         
+        cached = await database.get_cache_value(WALLET_ID_CACHE_KEY)
+        if cached:
+            self.btc_wallet_id = cached
+            logger.info(f"BTC wallet loaded from cache: {cached[:8]}...")
+            return self.btc_wallet_id
+        
         query = """
         query Me {
           me {
@@ -97,15 +347,39 @@ class BlinkPayment:
         for wallet in wallets:
             if wallet.get("walletCurrency") == "BTC":
                 self.btc_wallet_id = wallet["id"]
+                await database.set_cache_value(
+                    WALLET_ID_CACHE_KEY, self.btc_wallet_id, config.WALLET_ID_CACHE_TTL
+                )
                 logger.info(f"BTC wallet found: {self.btc_wallet_id[:8]}...")
                 return self.btc_wallet_id
         
         raise Exception("BTC wallet not found")
     
+    async def invalidate_wallet_id(self):
+        """지갑 ID 캐시 무효화 (메모리 + DB)"""
+        self.btc_wallet_id = None
+        await database.delete_cache_value(WALLET_ID_CACHE_KEY)
+    
+    async def _with_wallet(self, operation: Callable[[str], Awaitable[Any]]) -> Any:
+        """지갑 ID로 작업 실행 - Blink가 지갑 ID를 거부한 경우에만 캐시 갱신 후 1회 재시도"""
+        wallet_id = await self.get_btc_wallet_id()
+        try:
+            return await operation(wallet_id)
+        except Exception as e:
+            if not _is_wallet_error(e):
+                raise
+            logger.warning(f"Wallet rejected by Blink ({e.code}), refreshing wallet id: {e}")
+            await self.invalidate_wallet_id()
+            wallet_id = await self.get_btc_wallet_id()
+            return await operation(wallet_id)
+    
     async def create_invoice(self, amount_sats: int, memo: str = None) -> Dict[str, Any]:
         """Lightning Invoice 생성"""
-        wallet_id = await self.get_btc_wallet_id()
-        
+        return await self._with_wallet(
+            lambda wallet_id: self._create_invoice(wallet_id, amount_sats, memo)
+        )
+    
+    async def _create_invoice(self, wallet_id: str, amount_sats: int, memo: str = None) -> Dict[str, Any]:
         mutation = """
         mutation LnInvoiceCreate($input: LnInvoiceCreateInput!) {
           lnInvoiceCreate(input: $input) {
@@ -116,6 +390,7 @@ class BlinkPayment:
             }
             errors {
               message
+              code
             }
           }
         }
@@ -135,9 +410,10 @@ class BlinkPayment:
             payload = result["lnInvoiceCreate"]
             
             if payload.get("errors") and len(payload["errors"]) > 0:
-                error_msg = payload["errors"][0].get("message") or "lnInvoiceCreate 오류"
+                error = payload["errors"][0]
+                error_msg = error.get("message") or "lnInvoiceCreate 오류"
                 logger.error(f"Invoice creation error: {error_msg}")
-                raise Exception(error_msg)
+                raise BlinkApiError(error_msg, _error_code(error))
             
             invoice = payload.get("invoice")
             
@@ -175,6 +451,31 @@ class BlinkPayment:
         result = await self._graphql_request(query, variables, retries=1)  # 상태 확인은 재시도 불필요
         return result.get("lnInvoicePaymentStatusByPaymentRequest")
     
+    async def get_invoice_statuses(self, payment_requests: List[str]) -> Dict[str, Optional[str]]:
+        """여러 Invoice 결제 상태를 alias로 묶어 한 번의 요청으로 조회"""
+        var_defs = []
+        fields = []
+        variables = {}
+        for idx, payment_request in enumerate(payment_requests):
+            var_defs.append(f"$in{idx}: LnInvoicePaymentStatusByPaymentRequestInput!")
+            fields.append(f"i{idx}: lnInvoicePaymentStatusByPaymentRequest(input: $in{idx}) {{ status }}")
+            variables[f"in{idx}"] = {"paymentRequest": payment_request}
+        
+        query = f"query InvoiceStatuses({', '.join(var_defs)}) {{ {' '.join(fields)} }}"
+        response = await self._post_graphql({"query": query, "variables": variables})
+        
+        # 일부 Invoice 오류는 해당 alias만 null로 오므로 나머지 결과는 그대로 사용
+        data = response.get("data") or {}
+        if response.get("errors"):
+            if not data:
+                raise Exception(f"GraphQL Error: {response['errors']}")
+            logger.debug(f"Batched status query returned partial errors: {response['errors']}")
+        
+        return {
+            payment_request: (data.get(f"i{idx}") or {}).get("status")
+            for idx, payment_request in enumerate(payment_requests)
+        }
+    
     async def check_payment(self, payment_request: str, max_attempts: int = None, interval: int = None) -> bool:
         """결제 완료 확인 - 폴링"""
         if max_attempts is None:
@@ -210,39 +511,76 @@ class BlinkPayment:
         logger.warning(f"Payment check timeout after {max_attempts} attempts")
         return False
     
-    async def get_lnurl_invoice_from_address(self, lightning_address: str, amount_sats: int) -> str:
-        """Lightning Address에서 Invoice 요청"""
+    async def resolve_lnurl_pay(self, lightning_address: str) -> Dict[str, Any]:
+        """Lightning Address → LNURL-pay 정보 (callback, min/maxSendable) - 캐시 사용"""
+        cached = self.lnurl_cache.get(lightning_address)
+        if cached is not None:
+            if isinstance(cached, str):
+                # 매번 새 예외로 (같은 인스턴스를 다시 raise하면 traceback이 계속 쌓임)
+                raise LnurlError(cached)
+            return cached
+        
+        try:
+            pay_info = await self._fetch_lnurl_pay(lightning_address)
+        except LnurlError as e:
+            # 일시적 오류는 캐시하지 않음 (한 번의 네트워크 오류로 주소가 막히지 않도록)
+            self.lnurl_cache.put_failure(lightning_address, str(e))
+            raise
+        
+        self.lnurl_cache.put(lightning_address, pay_info)
+        return pay_info
+    
+    async def _fetch_lnurl_pay(self, lightning_address: str) -> Dict[str, Any]:
         parts = lightning_address.split("@")
-        if len(parts) != 2:
-            raise Exception("Invalid Lightning Address format")
+        if len(parts) != 2 or not all(parts):
+            raise LnurlError("Invalid Lightning Address format")
         
         username, domain = parts
         lnurl_url = f"https://{domain}/.well-known/lnurlp/{username}"
         
-        logger.info(f"Requesting invoice from {lightning_address} for {amount_sats} sats")
-        
-        timeout = aiohttp.ClientTimeout(total=10)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            # LNURL 정보 가져오기
-            async with session.get(lnurl_url) as response:
-                if response.status != 200:
-                    raise Exception(f"LNURL request failed: {response.status}")
-                
-                data = await response.json()
-                
-                if data.get("status") == "ERROR":
-                    raise Exception(data.get("reason") or "LNURL error")
-                
-                callback_url = data.get("callback")
-                if not callback_url:
-                    raise Exception("No callback URL in LNURL response")
+        session = await get_http_session()
+        async with session.get(lnurl_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status == 404:
+                raise LnurlError(f"Lightning Address not found: {lightning_address}")
+            if response.status != 200:
+                raise Exception(f"LNURL request failed: {response.status}")
+            
+            data = await response.json()
             
-            # Invoice 요청
-            amount_msat = amount_sats * 1000
+            if data.get("status") == "ERROR":
+                raise LnurlError(data.get("reason") or "LNURL error")
             
+            callback_url = data.get("callback")
+            if not callback_url:
+                raise Exception("No callback URL in LNURL response")
+        
+        return {
+            "callback": callback_url,
+            "min_sendable": int(data.get("minSendable") or 1000),
+            "max_sendable": int(data.get("maxSendable") or 0),
+        }
+    
+    async def get_lnurl_invoice_from_address(self, lightning_address: str, amount_sats: int) -> str:
+        """Lightning Address에서 Invoice 요청"""
+        logger.info(f"Requesting invoice from {lightning_address} for {amount_sats} sats")
+        
+        pay_info = await self.resolve_lnurl_pay(lightning_address)
+        
+        # 금액 범위는 요청 전에 확인
+        amount_msat = amount_sats * 1000
+        if amount_msat < pay_info["min_sendable"] or (pay_info["max_sendable"] and amount_msat > pay_info["max_sendable"]):
+            raise Exception(
+                f"Amount {amount_sats} sats out of range for {lightning_address} "
+                f"({pay_info['min_sendable'] // 1000}-{pay_info['max_sendable'] // 1000} sats)"
+            )
+        
+        # Invoice 요청
+        try:
+            session = await get_http_session()
             async with session.get(
-                callback_url,
-                params={"amount": amount_msat}
+                pay_info["callback"],
+                params={"amount": amount_msat},
+                timeout=aiohttp.ClientTimeout(total=10)
             ) as response:
                 if response.status != 200:
                     raise Exception(f"Invoice request failed: {response.status}")
@@ -255,9 +593,13 @@ class BlinkPayment:
                 invoice = invoice_data.get("pr")
                 if not invoice:
                     raise Exception("No invoice in response")
-                
-                logger.info(f"Invoice received from {lightning_address}")
-                return invoice
+        except Exception:
+            # callback이 바뀌었을 수 있으므로 다음 요청은 LNURL 정보부터 다시 조회
+            self.lnurl_cache.invalidate(lightning_address)
+            raise
+        
+        logger.info(f"Invoice received from {lightning_address}")
+        return invoice
     
     async def probe_invoice_fee(self, payment_request: str) -> int:
         """Invoice 수수료 예측"""
@@ -303,8 +645,11 @@ class BlinkPayment:
     
     async def pay_invoice(self, payment_request: str) -> str:
         """Invoice 결제"""
-        wallet_id = await self.get_btc_wallet_id()
-        
+        return await self._with_wallet(
+            lambda wallet_id: self._pay_invoice(wallet_id, payment_request)
+        )
+    
+    async def _pay_invoice(self, wallet_id: str, payment_request: str) -> str:
         mutation = """
         mutation LnInvoicePaymentSend($input: LnInvoicePaymentInput!) {
           lnInvoicePaymentSend(input: $input) {
@@ -335,7 +680,7 @@ class BlinkPayment:
                 error = payload["errors"][0]
                 error_msg = error.get("message") or "Payment failed"
                 logger.error(f"Payment error: {error_msg}")
-                raise Exception(error_msg)
+                raise BlinkApiError(error_msg, _error_code(error))
             
             status = payload.get("status")
             logger.info(f"Payment result: {status}")
@@ -343,50 +688,111 @@ class BlinkPayment:
         else:
             raise Exception("Invalid payment response")
     
-    def generate_qr_code(self, invoice: str) -> BytesIO:
-        """Invoice QR 코드 생성"""
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
+    async def get_outgoing_payment(self, payment_request: str) -> Optional[Dict[str, Any]]:
+        """보낸 결제 상태 조회 - {'status', 'fee'} (보낸 기록이 없으면 None)"""
+        return await self._with_wallet(
+            lambda wallet_id: self._get_outgoing_payment(wallet_id, payment_request)
         )
-        qr.add_data(invoice.upper())
-        qr.make(fit=True)
+    
+    async def _get_outgoing_payment(self, wallet_id: str, payment_request: str) -> Optional[Dict[str, Any]]:
+        query = """
+        query OutgoingPayment($walletId: WalletId!, $paymentRequest: LnPaymentRequest!) {
+          me {
+            defaultAccount {
+              walletById(walletId: $walletId) {
+                transactionsByPaymentRequest(paymentRequest: $paymentRequest) {
+                  status
+                  direction
+                  settlementFee
+                }
+              }
+            }
+          }
+        }
+        """
         
-        img = qr.make_image(fill_color="black", back_color="white")
+        variables = {"walletId": wallet_id, "paymentRequest": payment_request}
+        result = await self._graphql_request(query, variables, retries=1)
         
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
+        wallet = (((result or {}).get("me") or {}).get("defaultAccount") or {}).get("walletById") or {}
+        sends = [tx for tx in wallet.get("transactionsByPaymentRequest") or [] if tx.get("direction") == "SEND"]
+        if not sends:
+            return None
         
-        return buffer
+        # 재시도로 여러 건이면 성공 > 진행 중 > 실패 순으로 판단
+        for status in ("SUCCESS", "PENDING", "FAILURE"):
+            for tx in sends:
+                if tx.get("status") == status:
+                    return {"status": status, "fee": abs(tx.get("settlementFee") or 0)}
+        return {"status": sends[0].get("status"), "fee": 0}
+    
+    def generate_qr_code(self, invoice: str) -> BytesIO:
+        """Invoice QR 코드 생성 (동기 - 이벤트 루프에서는 generate_qr_code_async 사용)"""
+        png = _qr_cache.get(invoice)
+        if png is None:
+            png = render_qr_png(invoice, config.QR_OPTIMIZE_PNG)
+            _qr_cache.put(invoice, png)
+        return BytesIO(png)
+    
+    async def generate_qr_code_async(self, invoice: str) -> BytesIO:
+        """Invoice QR 코드 생성 (워커 풀에서 렌더링, 결과 캐시)"""
+        png = _qr_cache.get(invoice)
+        if png is None:
+            loop = asyncio.get_running_loop()
+            png = await loop.run_in_executor(_get_qr_executor(), render_qr_png, invoice, config.QR_OPTIMIZE_PNG)
+            _qr_cache.put(invoice, png)
+        return BytesIO(png)
 
 
 # ==================== 헬퍼 함수 ====================
 
+_blink: Optional[BlinkPayment] = None
+
+
+def get_blink() -> BlinkPayment:
+    """프로세스 전체에서 공유하는 BlinkPayment 인스턴스"""
+    global _blink
+    if _blink is None:
+        _blink = BlinkPayment()
+    return _blink
+
+
+_invoice_watcher: Optional[InvoiceWatcher] = None
+
+
+def get_invoice_watcher() -> InvoiceWatcher:
+    """대기 중인 모든 Invoice를 확인하는 공유 watcher"""
+    global _invoice_watcher
+    if _invoice_watcher is None:
+        _invoice_watcher = InvoiceWatcher(get_blink(), get_http_session)
+    return _invoice_watcher
+
+
+async def stop_invoice_watcher():
+    """Invoice watcher 종료 (봇 종료 시 호출)"""
+    if _invoice_watcher is not None:
+        await _invoice_watcher.stop()
+
+
 async def create_lightning_payment(amount_sats: int, comment: str = None) -> tuple:
     """Lightning 결제 생성"""
-    blink = BlinkPayment()
+    blink = get_blink()
     
     result = await blink.create_invoice(amount_sats, comment)
     invoice = result['invoice']
     payment_hash = result['payment_hash']
     
-    qr_buffer = blink.generate_qr_code(invoice)
+    qr_buffer = await blink.generate_qr_code_async(invoice)
     
     return invoice, qr_buffer, payment_hash
 
 
 async def verify_payment(payment_request: str, timeout: int = None) -> bool:
-    """결제 확인"""
+    """결제 확인 - 공유 watcher에 등록 후 결과 대기"""
     if timeout is None:
         timeout = config.PAYMENT_TIMEOUT
     
-    blink = BlinkPayment()
-    max_attempts = timeout // config.PAYMENT_CHECK_INTERVAL
-    
-    return await blink.check_payment(payment_request, max_attempts, interval=config.PAYMENT_CHECK_INTERVAL)
+    return await get_invoice_watcher().wait_for_payment(payment_request, timeout)
 
 
 async def send_to_lightning_address(destination: str, amount_sats: int, memo: str = None) -> Dict[str, Any]:
@@ -396,7 +802,7 @@ async def send_to_lightning_address(destination: str, amount_sats: int, memo: st
     Returns:
         dict: {'status': 'SUCCESS', 'fee': ..., 'invoice': ...}
     """
-    blink = BlinkPayment()
+    blink = get_blink()
     
     logger.info(f"Sending {amount_sats} sats to {destination}")
     
@@ -0,0 +1,131 @@
+"""
+Exercise Donation Bot - Management CLI
+봇을 띄우지 않고 DB 관리 작업 실행
+
+사용법:
+  python manage.py migrate
+  python manage.py backfill-rollups [--since YYYY-MM-DD]
+  python manage.py backfill-streaks   (봇을 멈춘 상태에서 실행)
+  python manage.py export [--user ID | --guild ID] [--table TABLE] [--format csv|parquet] [--output DIR]
+  python manage.py requeue-payouts [--payout ID]
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import date
+import config
+import database  # config 로드 시 로깅 설정
+import data_export
+
+
+async def cmd_migrate(args) -> int:
+    version = await database.run_migrations()
+    print(f"✅ Schema version: v{version}")
+    return 0
+
+
+async def cmd_backfill_rollups(args) -> int:
+    await database.run_migrations()
+    count = await database.rebuild_daily_rollups(args.since)
+    print(f"✅ Rebuilt {count} daily rollup rows")
+    return 0
+
+
+async def cmd_backfill_streaks(args) -> int:
+    # 별도 프로세스라 실행 중인 봇의 사용자 캐시/메모리 리더보드에는 변경이 전달되지 않음
+    await database.run_migrations()
+    count = await database.rebuild_streaks()
+    print(f"✅ Updated streak days for {count} users")
+    if count:
+        print("ℹ️ A running bot keeps serving its cached streak days - restart it to pick up the changes")
+    return 0
+
+
+async def cmd_export(args) -> int:
+    if args.user:
+        scope, scope_id = 'user', args.user
+    elif args.guild:
+        scope, scope_id = 'guild', args.guild
+    else:
+        scope, scope_id = 'all', None
+    tables = list(data_export.EXPORT_TABLES) if args.table == 'all' else [args.table]
+
+    os.makedirs(args.output, exist_ok=True)
+    today = config.local_now().date().isoformat()
+    prefix = f"{scope}_{scope_id}_{today}" if scope_id else f"all_{today}"
+    try:
+        results = await data_export.export_data(args.output, tables, args.format, scope, scope_id, prefix)
+    except data_export.ExportError as e:
+        print(f"❌ {e}")
+        return 1
+    for path, count in results.values():
+        print(f"✅ {path}: {count} rows")
+    return 0
+
+
+async def cmd_requeue_payouts(args) -> int:
+    # 실행 중인 봇은 시작할 때만 미완료 기부를 이어받으므로 재시작해야 전송됨
+    await database.run_migrations()
+    payout_ids = await database.requeue_failed_payouts(args.payout)
+    if not payout_ids:
+        print("ℹ️ No failed payouts to requeue")
+        return 1 if args.payout is not None else 0
+    for payout_id in payout_ids:
+        print(f"✅ Requeued payout #{payout_id}")
+    print("ℹ️ Restart the bot to send the requeued payouts")
+    return 0
+
+
+def parse_day(value: str) -> str:
+    """YYYY-MM-DD 형식 확인"""
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date (YYYY-MM-DD): {value}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Exercise Donation Bot management commands")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate = subparsers.add_parser('migrate', help="apply pending schema migrations")
+    migrate.set_defaults(handler=cmd_migrate)
+
+    backfill = subparsers.add_parser('backfill-rollups', help="rebuild daily exercise rollups from exercise_logs")
+    backfill.add_argument('--since', type=parse_day, help="only rebuild days on or after this date")
+    backfill.set_defaults(handler=cmd_backfill_rollups)
+
+    streaks = subparsers.add_parser('backfill-streaks', help="recompute streak_days for all users from exercise_logs (run with the bot stopped)")
+    streaks.set_defaults(handler=cmd_backfill_streaks)
+
+    export = subparsers.add_parser('export', help="export exercise_logs / donation_history to CSV or Parquet")
+    target = export.add_mutually_exclusive_group()
+    target.add_argument('--user', help="only this user's rows")
+    target.add_argument('--guild', help="only rows of this guild's members")
+    export.add_argument('--table', choices=('all',) + data_export.EXPORT_TABLES, default='all')
+    export.add_argument('--format', choices=data_export.EXPORT_FORMATS, default='csv')
+    export.add_argument('--output', default='.', help="output directory")
+    export.set_defaults(handler=cmd_export)
+
+    requeue = subparsers.add_parser('requeue-payouts', help="send failed payouts again (all, or one with --payout)")
+    requeue.add_argument('--payout', type=int, help="only this payout id")
+    requeue.set_defaults(handler=cmd_requeue_payouts)
+
+    return parser
+
+
+async def run(args) -> int:
+    try:
+        return await args.handler(args)
+    finally:
+        await database.db_manager.close()
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""
+Exercise Donation Bot - Payment Watcher
+대기 중인 Invoice 결제 상태 확인 (WebSocket 구독 + 일괄 폴링 fallback)
+"""
+import aiohttp
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Callable, Awaitable, Set
+import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingInvoice:
+    """확인 대기 중인 Invoice"""
+    future: asyncio.Future
+    deadline: float
+
+
+SUBSCRIPTION_QUERY = """
+subscription LnInvoicePaymentStatusByPaymentRequest($input: LnInvoicePaymentStatusByPaymentRequestInput!) {
+  lnInvoicePaymentStatusByPaymentRequest(input: $input) {
+    status
+    errors {
+      message
+    }
+  }
+}
+"""
+
+
+class InvoiceWatcher:
+    """
+    대기 중인 Invoice를 등록받아 결제 상태 확인
+
+    기본은 WebSocket(graphql-transport-ws) 하나에 모든 Invoice를 구독해 결제 즉시 완료 처리한다.
+    구독 연결이 끊긴 동안에는 한 번의 GraphQL 요청(alias 배치)으로 폴링하며,
+    연결 중에도 누락 대비로 PAYMENT_WS_FALLBACK_INTERVAL마다 한 번씩 폴링한다.
+    """
+
+    def __init__(
+        self,
+        blink,
+        session_factory: Callable[[], Awaitable[aiohttp.ClientSession]],
+        ws_endpoint: Optional[str] = None,
+        use_subscriptions: Optional[bool] = None,
+    ):
+        self.blink = blink
+        self.session_factory = session_factory
+        self.ws_endpoint = ws_endpoint or config.BLINK_WS_ENDPOINT
+        if use_subscriptions is None:
+            use_subscriptions = config.PAYMENT_SUBSCRIPTIONS_ENABLED
+        self.use_subscriptions = use_subscriptions
+        self.base_interval = config.PAYMENT_CHECK_INTERVAL
+        self.max_interval = config.PAYMENT_CHECK_MAX_INTERVAL
+        self.fallback_interval = config.PAYMENT_WS_FALLBACK_INTERVAL
+        self.batch_size = config.PAYMENT_BATCH_SIZE
+        self.interval = self.base_interval
+        self._pending: Dict[str, PendingInvoice] = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._background: Set[asyncio.Task] = set()  # 구독/구독 해제 전송
+
+        # WebSocket 구독 상태
+        self._ws_task = None
+        self._ws_wakeup = asyncio.Event()
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._subscriptions: Dict[str, str] = {}  # subscription id -> payment_request
+        self._subscription_ids: Dict[str, str] = {}  # payment_request -> subscription id
+        self._next_subscription_id = 0
+
+        self.stats = {
+            'polls': 0,
+            'requests': 0,
+            'errors': 0,
+            'paid': 0,
+            'expired': 0,
+            'timeouts': 0,
+            'ws_connects': 0,
+            'ws_events': 0,
+            'ws_errors': 0,
+        }
+
+    @property
+    def subscriptions_ready(self) -> bool:
+        return self._ws is not None and not self._ws.closed
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def watch(self, payment_request: str, timeout: float) -> asyncio.Future:
+        """Invoice 등록 - 결제되면 True, 만료/타임아웃이면 False로 완료되는 Future 반환"""
+        entry = self._pending.get(payment_request)
+        if entry is not None:
+            return entry.future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[payment_request] = PendingInvoice(future=future, deadline=loop.time() + timeout)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+        if self.use_subscriptions:
+            if self._ws_task is None or self._ws_task.done():
+                self._ws_task = asyncio.create_task(self._run_subscriptions())
+            self._ws_wakeup.set()
+            if self.subscriptions_ready:
+                self._spawn(self._subscribe(payment_request))
+        return future
+
+    async def wait_for_payment(self, payment_request: str, timeout: float) -> bool:
+        """결제 완료까지 대기"""
+        # 호출자가 취소되어도 공유 Future는 유지
+        return await asyncio.shield(self.watch(payment_request, timeout))
+
+    async def stop(self):
+        """루프 종료 - 대기 중인 Future는 취소"""
+        tasks = [task for task in (self._task, self._ws_task) if task is not None] + list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._ws_task = None
+        self._background.clear()
+
+        for entry in self._pending.values():
+            if not entry.future.done():
+                entry.future.cancel()
+        self._pending.clear()
+        logger.info(f"Invoice watcher stopped: {self.stats}")
+
+    def _resolve(self, payment_request: str, result: bool):
+        entry = self._pending.pop(payment_request, None)
+        if entry is not None and not entry.future.done():
+            entry.future.set_result(result)
+
+        subscription_id = self._subscription_ids.pop(payment_request, None)
+        if subscription_id is not None:
+            self._subscriptions.pop(subscription_id, None)
+            if self.subscriptions_ready:
+                self._spawn(self._send_ws({"id": subscription_id, "type": "complete"}))
+
+    def _spawn(self, coro):
+        """백그라운드 전송 작업 - stop()에서 취소되고 예외는 로그로 남김"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._on_background_done)
+
+    def _on_background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.stats['ws_errors'] += 1
+            logger.warning(f"Invoice subscription task failed: {task.exception()}")
+
+    def _expire_overdue(self):
+        now = asyncio.get_running_loop().time()
+        for payment_request, entry in list(self._pending.items()):
+            if entry.future.done():
+                self._pending.pop(payment_request, None)
+            elif now >= entry.deadline:
+                self.stats['timeouts'] += 1
+                logger.warning("Payment check timeout")
+                self._resolve(payment_request, False)
+
+    async def _poll_once(self):
+        """대기 중인 Invoice 전체를 배치 단위로 조회"""
+        payment_requests = list(self._pending)
+        self.stats['polls'] += 1
+
+        for start in range(0, len(payment_requests), self.batch_size):
+            batch = payment_requests[start:start + self.batch_size]
+            self.stats['requests'] += 1
+            statuses = await self.blink.get_invoice_statuses(batch)
+            self._apply_statuses(statuses)
+
+    def _apply_statuses(self, statuses: Dict[str, Any]):
+        for payment_request, status in statuses.items():
+            if status == "PAID":
+                self.stats['paid'] += 1
+                logger.info("✅ Payment confirmed: PAID")
+                self._resolve(payment_request, True)
+            elif status == "EXPIRED":
+                self.stats['expired'] += 1
+                logger.warning("❌ Invoice expired")
+                self._resolve(payment_request, False)
+
+    async def _run(self):
+        logger.info("Invoice watcher started")
+        while True:
+            if not self._pending:
+                # 대기 중인 Invoice가 없으면 API 요청 없이 대기
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await self._wait_next_poll()
+            self._expire_overdue()
+            if not self._pending:
+                continue
+
+            try:
+                await self._poll_once()
+                self.interval = self.base_interval
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.interval = min(self.interval * 2, self.max_interval)
+                logger.warning(f"Batched payment check failed, next check in {self.interval}s: {e}")
+
+    async def _wait_next_poll(self):
+        """다음 폴링까지 대기 (그 사이 타임아웃이 지난 Invoice는 바로 만료 처리)
+
+        구독이 살아 있으면 폴링은 누락 대비용으로만 드물게 실행한다.
+        대기 중에 구독 연결이 끊기면(_wakeup) 남은 시간을 폴링 간격 기준으로 다시 계산해
+        fallback 폴링이 PAYMENT_WS_FALLBACK_INTERVAL만큼 밀리지 않게 하고,
+        가장 이른 타임아웃에도 깨어나 만료 통보가 폴링 간격만큼 늦지 않게 한다.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        while True:
+            self._expire_overdue()
+            if not self._pending:
+                return
+            delay = self.fallback_interval if self.subscriptions_ready else self.interval
+            poll_at = started + delay
+            now = loop.time()
+            if poll_at <= now:
+                return
+            wake_at = min(poll_at, min(entry.deadline for entry in self._pending.values()))
+            # wait_for는 깨우기와 취소가 겹치면 취소를 삼킬 수 있어 asyncio.wait 사용
+            self._wakeup.clear()
+            wakeup = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait((wakeup,), timeout=max(wake_at - now, 0))
+            finally:
+                wakeup.cancel()
+
+    # ==================== WebSocket 구독 ====================
+
+    async def _send_ws(self, message: Dict[str, Any]):
+        try:
+            if self.subscriptions_ready:
+                await self._ws.send_json(message)
+        except Exception as e:
+            logger.debug(f"WebSocket send failed: {e}")
+
+    async def _subscribe(self, payment_request: str):
+        """Invoice 하나를 현재 WebSocket 연결에 구독"""
+        if payment_request not in self._pending or payment_request in self._subscription_ids:
+            return
+
+        self._next_subscription_id += 1
+        subscription_id = str(self._next_subscription_id)
+        self._subscriptions[subscription_id] = payment_request
+        self._subscription_ids[payment_request] = subscription_id
+
+        await self._send_ws({
+            "id": subscription_id,
+            "type": "subscribe",
+            "payload": {
+                "query": SUBSCRIPTION_QUERY,
+                "variables": {"input": {"paymentRequest": payment_request}}
+            }
+        })
+
+    async def _handle_ws_message(self, message: Dict[str, Any]):
+        message_type = message.get("type")
+
+        if message_type == "ping":
+            await self._send_ws({"type": "pong"})
+            return
+
+        subscription_id = message.get("id")
+        payment_request = self._subscriptions.get(subscription_id)
+        if payment_request is None:
+            return
+
+        if message_type == "next":
+            self.stats['ws_events'] += 1
+            data = (message.get("payload") or {}).get("data") or {}
+            status = (data.get("lnInvoicePaymentStatusByPaymentRequest") or {}).get("status")
+            logger.debug(f"🔍 Blink invoice status (ws): {status}")
+            self._apply_statuses({payment_request: status})
+        elif message_type in ("error", "complete"):
+            # 구독이 서버에서 끝난 Invoice는 폴링으로 확인
+            if message_type == "error":
+                self.stats['ws_errors'] += 1
+                logger.warning(f"Invoice subscription error: {message.get('payload')}")
+            self._subscriptions.pop(subscription_id, None)
+            self._subscription_ids.pop(payment_request, None)
+
+    async def _connect_and_listen(self):
+        """WebSocket 연결 후 대기 중인 Invoice를 모두 구독하고 이벤트 수신"""
+        session = await self.session_factory()
+        async with session.ws_connect(
+            self.ws_endpoint,
+            protocols=("graphql-transport-ws",),
+            timeout=10
+        ) as ws:
+            await ws.send_json({
+                "type": "connection_init",
+                "payload": {"X-API-KEY": self.blink.api_key}
+            })
+            ack = await ws.receive_json(timeout=10)
+            if ack.get("type") != "connection_ack":
+                raise Exception(f"Unexpected WebSocket handshake response: {ack}")
+
+            self._ws = ws
+            self.stats['ws_connects'] += 1
+            logger.info(f"Invoice subscription connected ({len(self._pending)} pending)")
+
+            for payment_request in list(self._pending):
+                await self._subscribe(payment_request)
+
+            while True:
+                try:
+                    msg = await ws.receive(timeout=config.PAYMENT_WS_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not self._pending:
+                        # 대기 중인 Invoice가 없으면 연결을 닫아 유휴 트래픽 제거
+                        logger.debug("Invoice subscription idle, closing")
+                        return
+                    continue
+
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    await self._handle_ws_message(json.loads(msg.data))
+                elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED,
+                                  aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                    raise Exception(f"WebSocket closed ({msg.type.name})")
+
+    async def _run_subscriptions(self):
+        reconnect_delay = 1
+        while True:
+            if not self._pending:
+                self._ws_wakeup.clear()
+                await self._ws_wakeup.wait()
+                continue
+
+            try:
+                await self._connect_and_listen()
+                reconnect_delay = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['ws_errors'] += 1
+                logger.warning(f"Invoice subscription failed, polling until reconnect in {reconnect_delay}s: {e}")
+                await asyncio.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, self.max_interval)
+            finally:
+                self._ws = None
+                self._subscriptions.clear()
+                self._subscription_ids.clear()
+                # 폴링 루프가 fallback 간격으로 자고 있으면 깨워 바로 폴링으로 전환
+                self._wakeup.set()
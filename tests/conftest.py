@@ -0,0 +1,37 @@
+import asyncio
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 실제 DB를 건드리지 않도록 config 로드 전에 임시 경로 지정
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='bot_tests_'), 'test.db'))
+
+
+@pytest.fixture
+def run_db():
+    """빈 DB에서 코루틴 함수를 실행하는 함수 (끝나면 연결 종료)"""
+    import config
+    import database
+
+    def run(coro_fn):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(config.DATABASE_PATH + suffix):
+                os.remove(config.DATABASE_PATH + suffix)
+        # 이전 테스트 DB의 행이 프로세스 캐시에 남지 않도록
+        database.user_cache._entries.clear()
+        database._known_guild_members.clear()
+
+        async def main():
+            await database.init_db()
+            try:
+                return await coro_fn()
+            finally:
+                await database.exercise_log_batcher.close()
+                await database.db_manager.close()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,124 @@
+"""목표액 자동 기부 작업 - 기부 결과를 기다리는 동안 임대 유지"""
+import asyncio
+import auto_donation
+import config
+import database
+
+USER_ID = '200000000000000001'
+
+
+async def insert_job() -> int:
+    now = config.local_now().isoformat()
+    await database.create_user(USER_ID, 'donor')
+    async with database.db_manager.transaction() as db:
+        cursor = await db.execute('''
+            INSERT INTO auto_donation_jobs (user_id, trigger_sats, status, created_at, updated_at)
+            VALUES (?, 1000, ?, ?, ?)
+        ''', (USER_ID, database.AUTO_JOB_PENDING, now, now))
+    return cursor.lastrowid
+
+
+def test_lease_is_renewed_while_waiting_for_donation(monkeypatch, run_db):
+    monkeypatch.setattr(config, 'DONATION_LEASE_SECONDS', 1)
+
+    async def slow_wait(donation_id):
+        # 결제 대기 + 전송 재시도가 임대(1초)보다 길게 걸림
+        await asyncio.sleep(2.5)
+        return {'status': database.DONATION_FORWARDED}
+
+    monkeypatch.setattr(auto_donation.donation_worker, 'wait', slow_wait)
+
+    async def scenario():
+        queue = auto_donation.ThresholdDonationQueue()
+        job_id = await insert_job()
+        job = await database.claim_auto_donation_job(queue.owner, config.DONATION_LEASE_SECONDS)
+        assert job['job_id'] == job_id
+        await database.update_auto_donation_job(job_id, database.AUTO_JOB_RUNNING, donation_id=1)
+
+        finish = asyncio.create_task(queue._finish(job_id, 1))
+        for _ in range(4):
+            await asyncio.sleep(0.5)
+            # 다른 프로세스의 fallback 조회가 작업을 다시 가져가지 못함
+            assert await database.claim_auto_donation_job('other-owner', config.DONATION_LEASE_SECONDS) is None
+        await finish
+
+        async with database.db_manager.reader() as db:
+            async with db.execute('SELECT * FROM auto_donation_jobs WHERE job_id = ?', (job_id,)) as cursor:
+                row = await cursor.fetchone()
+        assert row['status'] == database.AUTO_JOB_DONE
+        assert row['attempts'] == 1
+        assert row['locked_by'] is None
+
+    run_db(scenario)
+
+
+async def open_jobs() -> int:
+    async with database.db_manager.reader() as db:
+        async with db.execute('SELECT COUNT(*) FROM auto_donation_jobs WHERE user_id = ? AND status = ?',
+                              (USER_ID, database.AUTO_JOB_PENDING)) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def issue_job_invoice(owner: str) -> int:
+    """대기 작업을 가져가 Invoice를 만든 상태로 (워커의 _process 대신)"""
+    job = await database.claim_auto_donation_job(owner, config.DONATION_LEASE_SECONDS)
+    donation_id = await database.create_donation(USER_ID, job['trigger_sats'], f"lnbc{job['job_id']}",
+                                                 f"hash{job['job_id']}", 'a@b.c', 'auto_threshold')
+    await database.update_auto_donation_job(job['job_id'], database.AUTO_JOB_RUNNING, donation_id=donation_id)
+    return job['job_id'], donation_id
+
+
+def test_unpaid_threshold_invoice_is_not_reissued_on_every_log(run_db):
+    async def scenario():
+        await database.create_user(USER_ID, 'donor')
+        await database.update_auto_donate_setting(USER_ID, True, database.AUTO_DONATE_THRESHOLD,
+                                                  target_amount=1000)
+        await database.log_exercise(USER_ID, 'walking', 10, '', 1000)
+        assert await open_jobs() == 1
+
+        job_id, donation_id = await issue_job_invoice('worker')
+        # 결제를 기다리는 동안 (작업이 중간에 끝났더라도) 새 작업 없음
+        await database.update_auto_donation_job(job_id, database.AUTO_JOB_FAILED, error_message='donation_invoice_created')
+        await database.log_exercise(USER_ID, 'walking', 1, '', 100)
+        assert await open_jobs() == 0
+
+        # 결제되지 않고 끝난 Invoice - 목표액만큼 더 쌓이기 전에는 다시 발급하지 않음
+        await database.update_donation_status(donation_id, database.DONATION_INVOICE_CREATED,
+                                              database.DONATION_FAILED, error_message=database.DONATION_UNPAID_ERROR)
+        for _ in range(8):
+            await database.log_exercise(USER_ID, 'walking', 1, '', 100)
+        assert await open_jobs() == 0  # 누적 1900 < 1000 + 1000
+        user = await database.log_exercise(USER_ID, 'walking', 1, '', 100)
+        assert user['accumulated_sats'] == 2000
+        assert await open_jobs() == 1
+
+        # 전송 실패 등 결제된 뒤의 실패는 억제하지 않음
+        job_id, donation_id = await issue_job_invoice('worker')
+        await database.update_auto_donation_job(job_id, database.AUTO_JOB_FAILED, error_message='donation_failed')
+        await database.update_donation_status(donation_id, database.DONATION_INVOICE_CREATED,
+                                              database.DONATION_FAILED, error_message='forward failed')
+        await database.log_exercise(USER_ID, 'walking', 1, '', 100)
+        assert await open_jobs() == 1
+
+    run_db(scenario)
+
+
+def test_saving_settings_reissues_unpaid_threshold_invoice(run_db):
+    async def scenario():
+        await database.create_user(USER_ID, 'donor')
+        await database.update_auto_donate_setting(USER_ID, True, database.AUTO_DONATE_THRESHOLD,
+                                                  target_amount=1000)
+        await database.log_exercise(USER_ID, 'walking', 10, '', 1000)
+        job_id, donation_id = await issue_job_invoice('worker')
+        await database.update_donation_status(donation_id, database.DONATION_INVOICE_CREATED,
+                                              database.DONATION_FAILED, error_message=database.DONATION_UNPAID_ERROR)
+        await database.update_auto_donation_job(job_id, database.AUTO_JOB_FAILED, error_message='donation_failed')
+
+        await database.log_exercise(USER_ID, 'walking', 1, '', 100)
+        assert await open_jobs() == 0
+        # 사용자가 설정을 다시 저장하면 바로 다시 발급
+        await database.update_auto_donate_setting(USER_ID, True, database.AUTO_DONATE_THRESHOLD,
+                                                  target_amount=1000)
+        assert await open_jobs() == 1
+
+    run_db(scenario)
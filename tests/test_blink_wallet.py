@@ -0,0 +1,99 @@
+"""BlinkPayment 지갑 ID 갱신 - 지갑 ID 거부 오류에만 결제를 다시 보냄"""
+import asyncio
+import pytest
+import lightning_blink
+from lightning_blink import BlinkApiError, BlinkPayment
+
+
+def make_blink(monkeypatch, responses):
+    """lnInvoicePaymentSend 응답을 차례로 돌려주는 BlinkPayment"""
+    blink = BlinkPayment()
+    sent = []
+    invalidated = []
+    wallet_ids = iter(['wallet-old', 'wallet-new'])
+
+    async def get_btc_wallet_id():
+        if blink.btc_wallet_id is None:
+            blink.btc_wallet_id = next(wallet_ids)
+        return blink.btc_wallet_id
+
+    async def invalidate_wallet_id():
+        invalidated.append(blink.btc_wallet_id)
+        blink.btc_wallet_id = None
+
+    async def graphql_request(query, variables=None, retries=None):
+        sent.append(variables['input']['walletId'])
+        return {'lnInvoicePaymentSend': responses.pop(0)}
+
+    monkeypatch.setattr(blink, 'get_btc_wallet_id', get_btc_wallet_id)
+    monkeypatch.setattr(blink, 'invalidate_wallet_id', invalidate_wallet_id)
+    monkeypatch.setattr(blink, '_graphql_request', graphql_request)
+    return blink, sent, invalidated
+
+
+def test_balance_error_is_not_resent(monkeypatch):
+    blink, sent, invalidated = make_blink(monkeypatch, [
+        {'status': 'FAILURE', 'errors': [{'message': 'Insufficient balance in wallet', 'code': 'INSUFFICIENT_BALANCE'}]},
+    ])
+    with pytest.raises(BlinkApiError) as exc_info:
+        asyncio.run(blink.pay_invoice('lnbc1balance'))
+    assert exc_info.value.code == 'INSUFFICIENT_BALANCE'
+    assert sent == ['wallet-old']
+    assert invalidated == []
+
+
+def test_wallet_error_refreshes_and_resends_once(monkeypatch):
+    blink, sent, invalidated = make_blink(monkeypatch, [
+        {'status': 'FAILURE', 'errors': [{'message': 'Invalid wallet', 'code': 'INVALID_WALLET_ID'}]},
+        {'status': 'SUCCESS', 'errors': []},
+    ])
+    assert asyncio.run(blink.pay_invoice('lnbc1wallet')) == 'SUCCESS'
+    assert sent == ['wallet-old', 'wallet-new']
+    assert invalidated == ['wallet-old']
+
+
+def test_top_level_error_code():
+    error = {'message': 'Not found', 'extensions': {'code': 'wallet_not_found'}}
+    assert lightning_blink._error_code(error) == 'WALLET_NOT_FOUND'
+    assert lightning_blink._is_wallet_error(BlinkApiError('x', lightning_blink._error_code(error)))
+    assert not lightning_blink._is_wallet_error(Exception('wallet is empty'))
+
+
+@pytest.mark.parametrize('response', [
+    None,
+    {'me': None},
+    {'me': {'defaultAccount': None}},
+    {'me': {'defaultAccount': {'walletById': None}}},
+    {'me': {'defaultAccount': {'walletById': {'transactionsByPaymentRequest': None}}}},
+])
+def test_outgoing_payment_missing_fields(monkeypatch, response):
+    # 응답에 null이 섞여 있으면 보낸 기록 없음으로 처리
+    blink = BlinkPayment()
+
+    async def get_btc_wallet_id():
+        return 'wallet'
+
+    async def graphql_request(query, variables=None, retries=None):
+        return response
+
+    monkeypatch.setattr(blink, 'get_btc_wallet_id', get_btc_wallet_id)
+    monkeypatch.setattr(blink, '_graphql_request', graphql_request)
+    assert asyncio.run(blink.get_outgoing_payment('lnbc1missing')) is None
+
+
+def test_outgoing_payment_prefers_success(monkeypatch):
+    blink = BlinkPayment()
+
+    async def get_btc_wallet_id():
+        return 'wallet'
+
+    async def graphql_request(query, variables=None, retries=None):
+        return {'me': {'defaultAccount': {'walletById': {'transactionsByPaymentRequest': [
+            {'status': 'FAILURE', 'direction': 'SEND', 'settlementFee': 0},
+            {'status': 'SUCCESS', 'direction': 'SEND', 'settlementFee': -3},
+            {'status': 'SUCCESS', 'direction': 'RECEIVE', 'settlementFee': 0},
+        ]}}}}
+
+    monkeypatch.setattr(blink, 'get_btc_wallet_id', get_btc_wallet_id)
+    monkeypatch.setattr(blink, '_graphql_request', graphql_request)
+    assert asyncio.run(blink.get_outgoing_payment('lnbc1retried')) == {'status': 'SUCCESS', 'fee': 3}
@@ -0,0 +1,86 @@
+"""데이터 내보내기 - fetchmany 묶음 단위로 읽어도 CSV/Parquet에 모든 행과 헤더가 들어감"""
+import csv
+import os
+import pytest
+import config
+import data_export
+import database
+
+USER_ID = '300000000000000001'
+OTHER_ID = '300000000000000002'
+GUILD_ID = '930000000000000001'
+CHUNK_SIZE = 7
+ROWS = 23  # 묶음 크기의 배수가 아니도록
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, 'EXPORT_CHUNK_SIZE', CHUNK_SIZE)
+
+
+async def seed():
+    for user_id in (USER_ID, OTHER_ID):
+        await database.create_user(user_id, f'user{user_id[-1]}')
+    await database.touch_guild_member(GUILD_ID, USER_ID)
+    async with database.db_manager.transaction() as db:
+        await db.executemany('''
+            INSERT INTO exercise_logs (user_id, exercise_type, value, unit, calculated_sats, memo, timestamp)
+            VALUES (?, 'walking', ?, 'km', ?, ?, ?)
+        ''', [(USER_ID, i + 0.5, i * 10, f'메모 {i}', f'2026-01-01T00:00:{i:02d}') for i in range(ROWS)]
+            + [(OTHER_ID, 1.0, 10, '', '2026-01-01T00:00:00')])
+
+
+def test_iter_export_rows_chunks(run_db):
+    async def scenario():
+        await seed()
+        return [
+            [len(rows) async for rows in database.iter_export_rows('exercise_logs', 'user', USER_ID)],
+            [len(rows) async for rows in database.iter_export_rows('exercise_logs', 'guild', GUILD_ID)],
+            [len(rows) async for rows in database.iter_export_rows('exercise_logs', 'all')],
+        ]
+
+    user_chunks, guild_chunks, all_chunks = run_db(scenario)
+    assert user_chunks == [7, 7, 7, 2]
+    assert guild_chunks == [7, 7, 7, 2]
+    assert all_chunks == [7, 7, 7, 3]
+
+
+def test_export_csv(run_db, tmp_path):
+    async def scenario():
+        await seed()
+        return await data_export.export_data(str(tmp_path), ['exercise_logs', 'donation_history'],
+                                             'csv', 'user', USER_ID, prefix='test')
+
+    results = run_db(scenario)
+    path, count = results['exercise_logs']
+    assert path == os.path.join(str(tmp_path), 'test_exercise_logs.csv')
+    assert count == ROWS
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.reader(f))
+    assert tuple(rows[0]) == database.EXPORT_COLUMNS['exercise_logs']
+    assert len(rows) == ROWS + 1
+    assert [row[6] for row in rows[1:]] == [f'메모 {i}' for i in range(ROWS)]
+
+    # 기록이 없으면 헤더만
+    path, count = results['donation_history']
+    assert count == 0
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        assert list(csv.reader(f)) == [list(database.EXPORT_COLUMNS['donation_history'])]
+
+
+def test_export_parquet(run_db, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'logs.parquet')
+
+    async def scenario():
+        await seed()
+        return await data_export.export_table(path, 'exercise_logs', 'parquet', 'user', USER_ID)
+
+    assert run_db(scenario) == ROWS
+    parquet = pq.ParquetFile(path)
+    assert tuple(parquet.schema_arrow.names) == database.EXPORT_COLUMNS['exercise_logs']
+    assert parquet.metadata.num_rows == ROWS
+    assert parquet.metadata.num_row_groups == 4  # 묶음마다 row group 하나
+    table = parquet.read()
+    assert table.column('value').to_pylist() == [i + 0.5 for i in range(ROWS)]
+    assert table.column('calculated_sats').to_pylist() == [i * 10 for i in range(ROWS)]
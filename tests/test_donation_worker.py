@@ -0,0 +1,291 @@
+"""DonationWorker 상태 머신과 ForwardingQueue - 진행 중(PENDING) 전송, payout 생성 실패, 임대"""
+import asyncio
+import config
+import database
+import donation_worker
+from donation_worker import DonationWorker, ForwardingQueue
+
+USER_ID = '100000000000000001'
+ADDRESS = 'donate@example.com'
+
+
+class FakeBlink:
+    def __init__(self, pay_statuses, outgoing):
+        self.pay_statuses = list(pay_statuses)
+        self.outgoing = list(outgoing)
+        self.paid = []
+
+    async def resolve_lnurl_pay(self, address):
+        return {'max_sendable': 10 ** 12}
+
+    async def get_lnurl_invoice_from_address(self, address, amount):
+        return f'lnbcforward{amount}'
+
+    async def probe_invoice_fee(self, payment_request):
+        return 0
+
+    async def pay_invoice(self, payment_request):
+        self.paid.append(payment_request)
+        return self.pay_statuses.pop(0)
+
+    async def get_outgoing_payment(self, payment_request):
+        return self.outgoing.pop(0)
+
+
+def setup(monkeypatch, blink):
+    monkeypatch.setattr(donation_worker.lightning, 'get_blink', lambda: blink)
+    monkeypatch.setattr(config, 'FORWARD_BATCH_WINDOW', 0)
+    monkeypatch.setattr(config, 'FORWARD_PENDING_CHECK_INTERVAL', 0)
+    monkeypatch.setattr(config, 'RETRY_DELAY', 0)
+    monkeypatch.setattr(config, 'FORWARD_MAX_ATTEMPTS', 2)
+
+
+async def new_donation(amount: int = 1000) -> int:
+    await database.create_user(USER_ID, 'donor')
+    return await database.create_donation(USER_ID, amount, 'lnbcinvoice', 'hash', ADDRESS)
+
+
+async def paid_donation(amount: int = 1000):
+    donation_id = await new_donation(amount)
+    await database.update_donation_status(donation_id, database.DONATION_INVOICE_CREATED, database.DONATION_PAID)
+    return await database.get_donation(donation_id)
+
+
+def pay_invoice_with(monkeypatch, paid: bool, delay: float = 0):
+    """결제 확인(verify_payment) 결과 고정"""
+    checked = []
+
+    async def verify_payment(payment_request, timeout=None):
+        checked.append(payment_request)
+        await asyncio.sleep(delay)
+        return paid
+
+    monkeypatch.setattr(donation_worker.lightning, 'verify_payment', verify_payment)
+    return checked
+
+
+def test_pending_payment_is_rechecked_not_resent(monkeypatch, run_db):
+    blink = FakeBlink(
+        pay_statuses=['PENDING'],
+        outgoing=[{'status': 'PENDING', 'fee': 0}, {'status': 'PENDING', 'fee': 0}, {'status': 'SUCCESS', 'fee': 3}],
+    )
+    setup(monkeypatch, blink)
+
+    async def scenario():
+        donation = await paid_donation()
+        await ForwardingQueue('test-owner').submit(donation)
+
+        donation = await database.get_donation(donation['donation_id'])
+        payout = await database.get_payout(donation['payout_id'])
+        # 재시도 한도(2)보다 많이 확인했지만 한 번만 보냈고 실패 처리되지 않음
+        assert blink.paid == ['lnbcforward1000']
+        assert blink.outgoing == []
+        assert payout['status'] == database.PAYOUT_FORWARDED
+        assert payout['fee'] == 3
+        assert payout['attempts'] == 0
+        assert donation['status'] == database.DONATION_FORWARDED
+
+    run_db(scenario)
+
+
+def test_failed_in_flight_payment_is_resent(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=['PENDING', 'SUCCESS'], outgoing=[{'status': 'FAILURE', 'fee': 0}])
+    setup(monkeypatch, blink)
+    monkeypatch.setattr(config, 'FORWARD_MAX_ATTEMPTS', 3)
+
+    async def scenario():
+        donation = await paid_donation()
+        await ForwardingQueue('test-owner').submit(donation)
+
+        donation = await database.get_donation(donation['donation_id'])
+        assert blink.paid == ['lnbcforward1000', 'lnbcforward1000']
+        assert donation['status'] == database.DONATION_FORWARDED
+
+    run_db(scenario)
+
+
+def test_create_payout_failure_requeues(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=['SUCCESS'], outgoing=[])
+    setup(monkeypatch, blink)
+
+    create_payout = database.create_payout
+    calls = []
+
+    async def flaky_create_payout(address, donation_ids):
+        calls.append(list(donation_ids))
+        if len(calls) == 1:
+            return None  # DB 오류 등으로 묶지 못함
+        return await create_payout(address, donation_ids)
+
+    monkeypatch.setattr(database, 'create_payout', flaky_create_payout)
+
+    async def scenario():
+        donation = await paid_donation()
+        await ForwardingQueue('test-owner').submit(donation)
+
+        donation = await database.get_donation(donation['donation_id'])
+        assert len(calls) == 2
+        assert donation['status'] == database.DONATION_FORWARDED
+
+    run_db(scenario)
+
+
+def test_create_payout_failure_gives_up_with_error(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=[], outgoing=[])
+    setup(monkeypatch, blink)
+
+    async def failing_create_payout(address, donation_ids):
+        return None
+
+    monkeypatch.setattr(database, 'create_payout', failing_create_payout)
+
+    async def scenario():
+        donation = await paid_donation()
+        await ForwardingQueue('test-owner').submit(donation)
+
+        # 한도까지 실패하면 오류를 남기고 paid로 두어 resume()에 맡김
+        donation = await database.get_donation(donation['donation_id'])
+        assert donation['status'] == database.DONATION_PAID
+        assert donation['error_message'] == 'payout_create_failed'
+
+    run_db(scenario)
+
+
+def test_failed_payout_requeue_resends_same_invoice(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=['FAILURE', 'FAILURE', 'ALREADY_PAID'], outgoing=[])
+    setup(monkeypatch, blink)
+
+    async def scenario():
+        donation = await paid_donation()
+        await ForwardingQueue('test-owner').submit(donation)
+
+        donation = await database.get_donation(donation['donation_id'])
+        payout_id = donation['payout_id']
+        assert donation['status'] == database.DONATION_FAILED
+        assert (await database.get_payout(payout_id))['status'] == database.PAYOUT_FAILED
+
+        # 관리자가 다시 전송 대기로 되돌리면 같은 Invoice로 이어서 전송
+        assert await database.requeue_failed_payouts() == [payout_id]
+        assert await database.requeue_failed_payouts() == []
+        payout = await database.get_payout(payout_id)
+        assert payout['status'] == database.PAYOUT_FORWARDING
+        assert payout['attempts'] == 0
+        donation = await database.get_donation(donation['donation_id'])
+        assert donation['status'] == database.DONATION_FORWARDING
+
+        await ForwardingQueue('test-owner').resume(payout_id)
+        donation = await database.get_donation(donation['donation_id'])
+        assert blink.paid == ['lnbcforward1000'] * 3
+        assert donation['status'] == database.DONATION_FORWARDED
+
+    run_db(scenario)
+
+
+def test_invoice_created_to_forwarded(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=['SUCCESS'], outgoing=[])
+    setup(monkeypatch, blink)
+    checked = pay_invoice_with(monkeypatch, paid=True)
+
+    async def scenario():
+        donation_id = await new_donation()
+        donation = await DonationWorker().wait(donation_id)
+
+        assert checked == ['lnbcinvoice']
+        assert donation['status'] == database.DONATION_FORWARDED
+        assert donation['paid_at'] is not None
+        assert (await database.get_donation(donation_id))['locked_by'] is None
+        payout = await database.get_payout(donation['payout_id'])
+        assert payout['status'] == database.PAYOUT_FORWARDED
+        user = await database.get_user(USER_ID)
+        assert user['total_donated_sats'] == 1000
+        assert user['total_donation_count'] == 1
+
+    run_db(scenario)
+
+
+def test_unpaid_invoice_fails(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=[], outgoing=[])
+    setup(monkeypatch, blink)
+    pay_invoice_with(monkeypatch, paid=False)
+
+    async def scenario():
+        donation = await DonationWorker().wait(await new_donation())
+
+        assert donation['status'] == database.DONATION_FAILED
+        assert donation['paid_at'] is None
+        assert donation['error_message'] == 'payment_not_received'
+        assert donation['payout_id'] is None
+        assert blink.paid == []
+
+    run_db(scenario)
+
+
+def test_paid_forwarding_fails_after_max_attempts(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=['FAILURE', 'FAILURE'], outgoing=[])
+    setup(monkeypatch, blink)
+    pay_invoice_with(monkeypatch, paid=True)
+
+    async def scenario():
+        donation = await DonationWorker().wait(await new_donation())
+
+        assert blink.paid == ['lnbcforward1000', 'lnbcforward1000']
+        assert donation['status'] == database.DONATION_FAILED
+        assert donation['paid_at'] is not None
+        assert donation['error_message'] == 'status FAILURE'
+        payout = await database.get_payout(donation['payout_id'])
+        assert payout['status'] == database.PAYOUT_FAILED
+        # 전송되지 않았으므로 누적액은 그대로
+        assert (await database.get_user(USER_ID))['total_donated_sats'] == 0
+
+    run_db(scenario)
+
+
+def test_lease_is_renewed_while_waiting_for_payment(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=['SUCCESS'], outgoing=[])
+    setup(monkeypatch, blink)
+    monkeypatch.setattr(config, 'DONATION_LEASE_SECONDS', 2)
+    # 결제 대기가 임대(2초)보다 길게 걸림
+    pay_invoice_with(monkeypatch, paid=True, delay=3.5)
+
+    async def scenario():
+        donation_id = await new_donation()
+        worker = DonationWorker()
+        task = worker.process(donation_id)
+        taken = []
+        # 결제가 끝나 다음 단계로 넘어가기 전(3.5초)까지, 임대(2초)가 지난 뒤에도 확인
+        for _ in range(6):
+            await asyncio.sleep(0.5)
+            # 재시작한 프로세스의 resume()이나 다른 워커가 같은 기부를 가져가지 못함
+            taken.append(await database.claim_donation(donation_id, 'other-owner', 2))
+        donation = await task
+
+        assert not any(taken)
+        assert donation['status'] == database.DONATION_FORWARDED
+        assert blink.paid == ['lnbcforward1000']
+        assert (await database.get_donation(donation_id))['locked_by'] is None
+
+    run_db(scenario)
+
+
+def test_expired_lease_is_taken_over(monkeypatch, run_db):
+    blink = FakeBlink(pay_statuses=['SUCCESS'], outgoing=[])
+    setup(monkeypatch, blink)
+    pay_invoice_with(monkeypatch, paid=True)
+
+    async def scenario():
+        donation_id = await new_donation()
+        # 다른 프로세스가 처리 중이면 건드리지 않음
+        assert await database.claim_donation(donation_id, 'crashed-owner', 60)
+        donation = await DonationWorker().wait(donation_id)
+        assert donation['status'] == database.DONATION_INVOICE_CREATED
+        assert donation['locked_by'] == 'crashed-owner'
+
+        # 그 프로세스가 죽어 임대가 만료되면 resume()이 이어서 처리
+        assert await database.claim_donation(donation_id, 'crashed-owner', -1)
+        worker = DonationWorker()
+        assert await worker.resume() == 1
+        donation = await worker.wait(donation_id)
+        assert donation['status'] == database.DONATION_FORWARDED
+        assert blink.paid == ['lnbcforward1000']
+
+    run_db(scenario)
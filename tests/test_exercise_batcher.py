@@ -0,0 +1,130 @@
+"""ExerciseLogBatcher - 묶음 커밋, 기록별 SAVEPOINT, close() 시 남은 기록 커밋"""
+import asyncio
+import pytest
+import database
+from database import ExerciseLogBatcher
+
+USER_A = '500000000000000001'
+USER_B = '500000000000000002'
+
+
+async def create_users():
+    for user_id in (USER_A, USER_B):
+        await database.create_user(user_id, f'user{user_id[-1]}')
+
+
+async def fetch_one(query: str, *params):
+    async with database.db_manager.reader() as db:
+        async with db.execute(query, params) as cursor:
+            return await cursor.fetchone()
+
+
+def test_failing_entry_rolls_back_to_its_savepoint(run_db):
+    async def scenario():
+        await create_users()
+        # 사용자 총계를 갱신한 뒤 운동 로그 저장에서 실패하도록 (부분 반영이 되돌려지는지 확인)
+        async with database.db_manager.transaction() as db:
+            await db.execute('''
+                CREATE TEMP TRIGGER fail_exercise_log BEFORE INSERT ON exercise_logs
+                WHEN NEW.memo = 'fail'
+                BEGIN SELECT RAISE(ABORT, 'rejected'); END
+            ''')
+
+        batcher = ExerciseLogBatcher(window_ms=50, max_size=10)
+        results = await asyncio.gather(
+            batcher.submit(USER_A, 'running', 5.0, 'ok', 50),
+            batcher.submit(USER_B, 'running', 3.0, 'fail', 30),
+            batcher.submit(USER_A, 'cycling', 2.0, 'ok', 20),
+            return_exceptions=True,
+        )
+        await batcher.close()
+
+        assert isinstance(results[1], Exception)
+        assert results[0]['accumulated_sats'] == 50
+        assert results[2]['accumulated_sats'] == 70
+        assert batcher.stats['batches'] == 1
+        assert batcher.stats['logs'] == 3
+        assert batcher.stats['failed'] == 1
+
+        # 실패한 기록은 사용자 총계/로그/일별 집계 모두 반영되지 않음
+        user_b = await database.get_user(USER_B)
+        assert user_b['accumulated_sats'] == 0
+        assert user_b['total_running_km'] == 0
+        assert user_b['last_exercise_date'] is None
+        assert (await fetch_one('SELECT COUNT(*) FROM exercise_logs WHERE user_id = ?', USER_B))[0] == 0
+        assert (await fetch_one('SELECT COUNT(*) FROM exercise_daily_rollups WHERE user_id = ?', USER_B))[0] == 0
+
+        # 같은 묶음의 다른 기록은 커밋됨
+        assert (await fetch_one('SELECT COUNT(*) FROM exercise_logs WHERE user_id = ?', USER_A))[0] == 2
+        user_a = await database.get_user(USER_A)
+        assert user_a['accumulated_sats'] == 70
+
+    run_db(scenario)
+
+
+def test_futures_resolve_with_their_own_totals(run_db):
+    async def scenario():
+        await create_users()
+        batcher = ExerciseLogBatcher(window_ms=50, max_size=10)
+        results = await asyncio.gather(
+            batcher.submit(USER_A, 'running', 1.0, None, 10),
+            batcher.submit(USER_B, 'walking', 2.0, None, 20),
+            batcher.submit(USER_A, 'running', 3.0, None, 30),
+            batcher.submit(USER_A, 'swimming', 0.5, None, 40),
+        )
+        await batcher.close()
+
+        assert batcher.stats['batches'] == 1
+        # 각 호출자는 자기 기록까지 반영된 행을 받음 (제출 순서대로 누적)
+        assert [(row['user_id'], row['accumulated_sats']) for row in results] == [
+            (USER_A, 10), (USER_B, 20), (USER_A, 40), (USER_A, 80),
+        ]
+        assert results[0]['total_running_km'] == pytest.approx(1.0)
+        assert results[2]['total_running_km'] == pytest.approx(4.0)
+        assert results[3]['total_swimming_km'] == pytest.approx(0.5)
+        assert results[1]['total_walking_km'] == pytest.approx(2.0)
+
+    run_db(scenario)
+
+
+def test_max_size_splits_batches(run_db):
+    async def scenario():
+        await create_users()
+        batcher = ExerciseLogBatcher(window_ms=10_000, max_size=2)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await asyncio.gather(*(
+            batcher.submit(USER_A, 'running', 1.0, None, 10) for _ in range(4)
+        ))
+        await batcher.close()
+
+        # 가득 차면 대기 시간을 기다리지 않고 바로 커밋
+        assert loop.time() - started < 5
+        assert batcher.stats['batches'] == 2
+        assert batcher.stats['largest_batch'] == 2
+        assert [row['accumulated_sats'] for row in results] == [10, 20, 30, 40]
+
+    run_db(scenario)
+
+
+def test_close_flushes_pending_queue(run_db):
+    async def scenario():
+        await create_users()
+        batcher = ExerciseLogBatcher(window_ms=10_000, max_size=100)
+        submits = [
+            asyncio.create_task(batcher.submit(USER_A, 'running', 1.0, None, 10)),
+            asyncio.create_task(batcher.submit(USER_B, 'walking', 1.0, None, 5)),
+        ]
+        await asyncio.sleep(0)
+        assert not any(task.done() for task in submits)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await batcher.close()
+        assert loop.time() - started < 5
+
+        assert all(task.done() for task in submits)
+        assert [task.result()['accumulated_sats'] for task in submits] == [10, 5]
+        assert (await fetch_one('SELECT COUNT(*) FROM exercise_logs'))[0] == 2
+
+    run_db(scenario)
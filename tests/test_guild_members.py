@@ -0,0 +1,31 @@
+"""길드 멤버 목록으로 guild_members 맞추기"""
+import database
+
+GUILD_ID = '900000000000000001'
+
+
+def test_sync_guild_members(monkeypatch, run_db):
+    events = []
+    monkeypatch.setattr(database, '_membership_listeners', [lambda *event: events.append(event)])
+
+    async def scenario():
+        for user_id in ('1', '2', '3'):
+            await database.create_user(user_id, f'user{user_id}')
+        # 3은 봇이 꺼져 있던 동안 나감, 1과 2는 배포 전부터 있던 멤버
+        await database.touch_guild_member(GUILD_ID, '3')
+        await database.touch_guild_member('900000000000000002', '1')
+        events.clear()
+
+        # 4는 users에 없는 멤버 - 기록하지 않음
+        assert await database.sync_guild_members(GUILD_ID, ['1', '2', '4']) == (2, 1)
+        assert sorted(events) == [(GUILD_ID, '1', True), (GUILD_ID, '2', True), (GUILD_ID, '3', False)]
+
+        memberships = {(row['guild_id'], row['user_id']) for row in await database.get_guild_memberships()}
+        assert memberships == {(GUILD_ID, '1'), (GUILD_ID, '2'), ('900000000000000002', '1')}
+
+        # 다시 맞춰도 바뀐 것이 없으면 알림 없음
+        events.clear()
+        assert await database.sync_guild_members(GUILD_ID, ['1', '2', '4']) == (0, 0)
+        assert events == []
+
+    run_db(scenario)
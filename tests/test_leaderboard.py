@@ -0,0 +1,118 @@
+"""LeaderboardEngine - 메모리 순위가 SQL 경로와 같은 결과를 내고 리스너로 길드 파티션이 맞춰지는지"""
+import pytest
+import database
+from leaderboard import LeaderboardEngine
+
+GUILD_A = '910000000000000001'
+GUILD_B = '910000000000000002'
+GUILD_EMPTY = '910000000000000003'
+
+# user_id -> (걷기, 자전거, 달리기, 수영 km, 웨이트 kg, 기부 sats, 기부 횟수, 연속일)
+USERS = {
+    '1': (1.5, 0, 3.5, 0, 100, 5000, 2, 3),
+    '2': (0, 5, 0, 0, 100, 5000, 1, 3),       # 1과 거리/웨이트/기부액 동점
+    '3': (0, 0, 0, 0, 0, 0, 0, 0),           # 기록 없음 - 상위 목록에서 제외
+    '4': (10.25, 0, 0, 0.75, 50, 21000, 5, 7),
+    '5': (0, 0, 12, 0, 0, 100, 1, 1),
+    '6': (0, 0, 0, 2, 300, 0, 0, 12),
+}
+MEMBERSHIPS = {GUILD_A: ('1', '2', '3', '4'), GUILD_B: ('2', '5', '6')}
+
+
+@pytest.fixture(autouse=True)
+def isolated_listeners(monkeypatch):
+    # 테스트에서 만든 엔진의 리스너 등록이 다음 테스트로 넘어가지 않도록 (사용자 캐시 리스너는 유지)
+    monkeypatch.setattr(database, '_user_listeners', list(database._user_listeners))
+    monkeypatch.setattr(database, '_membership_listeners', list(database._membership_listeners))
+
+
+async def seed():
+    for user_id, values in USERS.items():
+        await database.create_user(user_id, f'user{user_id}')
+        async with database.db_manager.transaction() as db:
+            await db.execute('''
+                UPDATE users
+                SET total_walking_km = ?, total_cycling_km = ?, total_running_km = ?, total_swimming_km = ?,
+                    total_weight_kg = ?, total_donated_sats = ?, total_donation_count = ?, streak_days = ?
+                WHERE user_id = ?
+            ''', (*values, user_id))
+    for guild_id, user_ids in MEMBERSHIPS.items():
+        for user_id in user_ids:
+            await database.touch_guild_member(guild_id, user_id)
+
+
+async def assert_matches_sql(engine: LeaderboardEngine, limit: int = 10):
+    """모든 카테고리/범위에서 top-N, 순위, 사용자 수가 SQL 경로와 같은지"""
+    user_ids = [row['user_id'] for row in await database.get_ranking_rows()]
+    for guild_id in (None, GUILD_A, GUILD_B, GUILD_EMPTY):
+        assert engine.user_count(guild_id) == await database.get_total_users(guild_id), guild_id
+        for category in database.LEADERBOARD_CATEGORIES:
+            expected = [(row['user_id'], row['username'], row['total'])
+                        for row in await database.get_leaderboard(category, limit, guild_id)]
+            actual = [(row['user_id'], row['username'], row['total'])
+                      for row in engine.get_leaderboard(category, limit, guild_id)]
+            assert actual == expected, (guild_id, category)
+            for user_id in user_ids:
+                assert engine.get_user_rank(user_id, category, guild_id) == \
+                    await database.get_user_rank(user_id, category, guild_id), (guild_id, category, user_id)
+
+
+async def loaded_engine() -> LeaderboardEngine:
+    await seed()
+    engine = LeaderboardEngine()
+    await engine.load()
+    return engine
+
+
+def test_ranks_and_top_n_match_sql(run_db):
+    async def scenario():
+        engine = await loaded_engine()
+        await assert_matches_sql(engine)
+        await assert_matches_sql(engine, limit=2)
+
+        # 동점은 같은 순위, 목록에서는 user_id 순
+        assert engine.get_user_rank('1', 'weight') == engine.get_user_rank('2', 'weight') == 2
+        assert [row['user_id'] for row in engine.get_leaderboard('weight', 3)] == ['6', '1', '2']
+        assert [row['user_id'] for row in engine.get_leaderboard('donation', 3)] == ['4', '1', '2']
+        # 점수 0인 사용자는 목록에는 없지만 순위는 있음
+        assert '3' not in [row['user_id'] for row in engine.get_leaderboard('distance', 10)]
+        assert engine.get_user_rank('3', 'distance') == len(USERS)
+        # 길드 밖 사용자의 길드 순위는 내 점수보다 높은 길드 멤버 수 + 1
+        assert engine.get_user_rank('5', 'distance', GUILD_A) == 1
+        assert await engine.verify(repair=False) == []
+
+    run_db(scenario)
+
+
+def test_listener_updates_keep_partitions_in_sync(run_db):
+    async def scenario():
+        engine = await loaded_engine()
+
+        # 운동 기록 → 전체와 속한 길드 파티션 모두 갱신 (동점이 깨짐)
+        await database.log_exercise('2', 'running', 0.5, None, 50)
+        assert engine.get_user_rank('2', 'distance', GUILD_B) == 2
+        await assert_matches_sql(engine)
+
+        # 새 사용자 + 길드 입장
+        await database.create_user('7', 'user7')
+        await database.log_exercise('7', 'cycling', 30, None, 300)
+        await assert_matches_sql(engine)
+        await database.touch_guild_member(GUILD_A, '7')
+        assert engine.get_leaderboard('distance', 1, GUILD_A)[0]['user_id'] == '7'
+        await assert_matches_sql(engine)
+
+        # 탈퇴, 멤버 목록 동기화, 길드 삭제
+        await database.remove_guild_member(GUILD_A, '4')
+        await assert_matches_sql(engine)
+        await database.sync_guild_members(GUILD_B, ['5', '6', '1'])
+        await assert_matches_sql(engine)
+        await database.touch_guild_member(GUILD_EMPTY, '5')
+        assert engine.user_count(GUILD_EMPTY) == 1
+        await assert_matches_sql(engine)
+        await database.remove_guild(GUILD_EMPTY)
+        assert engine.user_count(GUILD_EMPTY) == 0
+        await assert_matches_sql(engine)
+
+        assert await engine.verify(repair=False) == []
+
+    run_db(scenario)
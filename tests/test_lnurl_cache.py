@@ -0,0 +1,73 @@
+"""LNURL-pay 캐시 - 확정적인 실패만 캐시하고 매번 새 예외로 다시 알림"""
+import asyncio
+import aiohttp
+import pytest
+from lightning_blink import BlinkPayment, LnurlError
+
+ADDRESS = 'donate@example.com'
+PAY_INFO = {'callback': 'https://example.com/cb', 'min_sendable': 1000, 'max_sendable': 10 ** 9}
+
+
+def make_blink(monkeypatch, results):
+    """_fetch_lnurl_pay가 results를 차례로 돌려주거나 raise하는 BlinkPayment"""
+    blink = BlinkPayment()
+    fetched = []
+
+    async def fetch_lnurl_pay(address):
+        fetched.append(address)
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(blink, '_fetch_lnurl_pay', fetch_lnurl_pay)
+    return blink, fetched
+
+
+def test_definitive_error_is_cached_and_raised_fresh(monkeypatch):
+    blink, fetched = make_blink(monkeypatch, [LnurlError('Lightning Address not found')])
+
+    errors = []
+    for _ in range(3):
+        with pytest.raises(LnurlError, match='not found') as exc_info:
+            asyncio.run(blink.resolve_lnurl_pay(ADDRESS))
+        errors.append(exc_info.value)
+
+    assert fetched == [ADDRESS]
+    assert blink.lnurl_cache.stats['negative_hits'] == 2
+    # 캐시에서 나온 예외는 매번 새 인스턴스라 traceback이 쌓이지 않음
+    assert errors[1] is not errors[2]
+    assert traceback_depth(errors[2]) == traceback_depth(errors[1])
+
+
+def traceback_depth(error: BaseException) -> int:
+    depth = 0
+    tb = error.__traceback__
+    while tb is not None:
+        depth += 1
+        tb = tb.tb_next
+    return depth
+
+
+@pytest.mark.parametrize('error', [
+    asyncio.TimeoutError(),
+    aiohttp.ClientConnectionError('connection reset'),
+    Exception('LNURL request failed: 503'),
+])
+def test_transient_error_is_not_cached(monkeypatch, error):
+    blink, fetched = make_blink(monkeypatch, [error, dict(PAY_INFO)])
+
+    with pytest.raises(type(error)):
+        asyncio.run(blink.resolve_lnurl_pay(ADDRESS))
+    # 바로 다음 조회는 다시 요청해 성공
+    assert asyncio.run(blink.resolve_lnurl_pay(ADDRESS)) == PAY_INFO
+    assert asyncio.run(blink.resolve_lnurl_pay(ADDRESS)) == PAY_INFO
+    assert fetched == [ADDRESS, ADDRESS]
+    assert blink.lnurl_cache.stats['negative_hits'] == 0
+
+
+def test_invalid_address_is_definitive():
+    with pytest.raises(LnurlError):
+        asyncio.run(BlinkPayment()._fetch_lnurl_pay('not-an-address'))
+    with pytest.raises(LnurlError):
+        asyncio.run(BlinkPayment()._fetch_lnurl_pay('@example.com'))
@@ -0,0 +1,223 @@
+"""InvoiceWatcher - 프로세스 내 가짜 graphql-transport-ws 서버로 구독/결제/재연결/폴링 fallback 확인"""
+import asyncio
+from typing import Dict, List, Optional, Set
+import aiohttp
+from aiohttp import web
+from payment_watcher import InvoiceWatcher
+
+API_KEY = 'test-api-key'
+
+
+class FakeBlinkServer:
+    """Blink WebSocket 구독 API 흉내 (graphql-transport-ws)"""
+
+    def __init__(self):
+        self.statuses: Dict[str, str] = {}  # payment_request -> 상태 (폴링 응답에도 사용)
+        self.subscriptions: Dict[str, str] = {}  # subscription id -> payment_request
+        self.subscribed: List[str] = []  # 받은 subscribe 순서대로
+        self.completed: List[str] = []
+        self.connections = 0
+        self.accepting = True
+        self._sockets: Set[web.WebSocketResponse] = set()
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ''
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/graphql', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}/graphql'
+
+    async def stop(self):
+        await self.drop()
+        await self._runner.cleanup()
+
+    async def drop(self):
+        """열린 연결을 모두 끊음 (네트워크 단절 흉내)"""
+        for ws in list(self._sockets):
+            await ws.close()
+        self.subscriptions.clear()
+
+    async def pay(self, payment_request: str):
+        """결제 완료 - 구독 중이면 next 이벤트 전송"""
+        self.statuses[payment_request] = 'PAID'
+        for subscription_id, subscribed in list(self.subscriptions.items()):
+            if subscribed == payment_request:
+                for ws in self._sockets:
+                    await ws.send_json({
+                        'id': subscription_id,
+                        'type': 'next',
+                        'payload': {'data': {'lnInvoicePaymentStatusByPaymentRequest': {'status': 'PAID', 'errors': []}}},
+                    })
+
+    async def _handle(self, request: web.Request):
+        if not self.accepting:
+            raise web.HTTPServiceUnavailable()
+
+        ws = web.WebSocketResponse(protocols=('graphql-transport-ws',))
+        await ws.prepare(request)
+        self.connections += 1
+        self._sockets.add(ws)
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                message = msg.json()
+                if message['type'] == 'connection_init':
+                    assert message['payload']['X-API-KEY'] == API_KEY
+                    await ws.send_json({'type': 'connection_ack'})
+                elif message['type'] == 'subscribe':
+                    payment_request = message['payload']['variables']['input']['paymentRequest']
+                    self.subscriptions[message['id']] = payment_request
+                    self.subscribed.append(payment_request)
+                elif message['type'] == 'complete':
+                    self.subscriptions.pop(message['id'], None)
+                    self.completed.append(message['id'])
+        finally:
+            self._sockets.discard(ws)
+        return ws
+
+
+class FakeBlink:
+    """BlinkPayment 대역 - 폴링은 서버의 상태표를 그대로 돌려줌"""
+
+    def __init__(self, server: FakeBlinkServer):
+        self.api_key = API_KEY
+        self.server = server
+        self.polled: List[List[str]] = []
+
+    async def get_invoice_statuses(self, payment_requests: List[str]) -> Dict[str, Optional[str]]:
+        self.polled.append(list(payment_requests))
+        return {pr: self.server.statuses.get(pr, 'PENDING') for pr in payment_requests}
+
+
+async def wait_until(predicate, timeout: float = 5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            raise AssertionError('condition not met in time')
+        await asyncio.sleep(0.01)
+
+
+def run_with_watcher(scenario, interval: float = 0.1, fallback_interval: float = 60):
+    """가짜 서버 + InvoiceWatcher를 띄우고 scenario(server, blink, watcher) 실행"""
+    async def main():
+        server = FakeBlinkServer()
+        await server.start()
+        session = aiohttp.ClientSession()
+
+        async def session_factory():
+            return session
+
+        blink = FakeBlink(server)
+        watcher = InvoiceWatcher(blink, session_factory, ws_endpoint=server.url, use_subscriptions=True)
+        watcher.base_interval = watcher.interval = interval
+        watcher.fallback_interval = fallback_interval
+        try:
+            await asyncio.wait_for(scenario(server, blink, watcher), 10)
+        finally:
+            await watcher.stop()
+            await session.close()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_subscribe_and_paid():
+    async def scenario(server, blink, watcher):
+        future = watcher.watch('lnbc1paid', timeout=30)
+        await wait_until(lambda: server.subscribed == ['lnbc1paid'])
+        assert watcher.subscriptions_ready
+
+        await server.pay('lnbc1paid')
+        assert await future is True
+        # 구독 이벤트만으로 완료 - 폴링 없음, 서버 구독도 정리
+        assert blink.polled == []
+        assert watcher.stats['ws_events'] == 1
+        await wait_until(lambda: server.subscriptions == {})
+
+    run_with_watcher(scenario)
+
+
+def test_reconnect_resubscribes_pending():
+    async def scenario(server, blink, watcher):
+        future = watcher.watch('lnbc1reconnect', timeout=30)
+        await wait_until(lambda: server.subscribed == ['lnbc1reconnect'])
+
+        await server.drop()
+        await wait_until(lambda: server.connections == 2 and len(server.subscribed) == 2, timeout=5)
+        assert server.subscribed == ['lnbc1reconnect', 'lnbc1reconnect']
+
+        await server.pay('lnbc1reconnect')
+        assert await future is True
+        assert watcher.stats['ws_connects'] == 2
+
+    run_with_watcher(scenario)
+
+
+def test_fallback_polling_without_websocket():
+    async def scenario(server, blink, watcher):
+        server.accepting = False
+        future = watcher.watch('lnbc1poll', timeout=30)
+        await wait_until(lambda: watcher.stats['ws_errors'] >= 1)
+        assert not watcher.subscriptions_ready
+
+        server.statuses['lnbc1poll'] = 'PAID'
+        assert await future is True
+        assert blink.polled
+
+    run_with_watcher(scenario)
+
+
+def test_disconnect_wakes_fallback_polling():
+    async def scenario(server, blink, watcher):
+        future = watcher.watch('lnbc1dropped', timeout=30)
+        await wait_until(lambda: server.subscribed == ['lnbc1dropped'])
+        # 폴링 루프가 fallback 간격(60초)으로 자는 중에 연결이 끊기고 결제됨
+        await asyncio.sleep(0.2)
+        polls_before = len(blink.polled)
+        server.accepting = False
+        server.statuses['lnbc1dropped'] = 'PAID'
+        await server.drop()
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert await future is True
+        assert loop.time() - started < 2
+        assert len(blink.polled) == polls_before + 1
+
+    run_with_watcher(scenario)
+
+
+def test_stop_cancels_background_sends():
+    async def scenario(server, blink, watcher):
+        watcher.watch('lnbc1stop', timeout=30)
+        await wait_until(lambda: server.subscribed == ['lnbc1stop'])
+        watcher.watch('lnbc1late', timeout=30)
+        assert watcher._background
+        await watcher.stop()
+        assert not watcher._background
+
+    run_with_watcher(scenario)
+
+
+def test_timeout_is_reported_without_waiting_for_fallback_poll():
+    async def scenario(server, blink, watcher):
+        future = watcher.watch('lnbc1unpaid', timeout=0.5)
+        await wait_until(lambda: server.subscribed == ['lnbc1unpaid'])
+
+        # 구독 중이라 다음 폴링은 60초 뒤지만 타임아웃(0.5초)에 맞춰 만료
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert await future is False
+        assert loop.time() - started < 2
+        assert watcher.stats['timeouts'] == 1
+        assert blink.polled == []
+        await wait_until(lambda: server.subscriptions == {})
+
+    run_with_watcher(scenario)
@@ -0,0 +1,29 @@
+"""QR 렌더링 (bench_qr.py와 같은 경로)"""
+from io import BytesIO
+from PIL import Image
+from lightning_blink import render_qr_png
+
+INVOICE = 'lnbc10u1p' + 'q' * 290
+
+
+def _open(png: bytes) -> Image.Image:
+    img = Image.open(BytesIO(png))
+    img.load()
+    return img
+
+
+def test_render_default():
+    img = _open(render_qr_png(INVOICE))
+    assert img.format == 'PNG'
+    assert img.mode == '1'
+
+
+def test_render_optimized():
+    default_png = render_qr_png(INVOICE)
+    optimized_png = render_qr_png(INVOICE, optimize=True)
+    img = _open(optimized_png)
+    assert img.format == 'PNG'
+    assert img.mode == '1'
+    # 압축만 다르고 픽셀은 같아야 함
+    assert img.tobytes() == _open(default_png).tobytes()
+    assert len(optimized_png) <= len(default_png)
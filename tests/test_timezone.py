@@ -0,0 +1,57 @@
+"""TZ 설정 - 저장 시각은 local_now() 기준이고, config import가 프로세스 시계(TZ 환경 변수)를 바꾸지 않음"""
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+import config
+import database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK = '''
+import os
+from datetime import datetime, timezone
+import config
+offset = config.local_now() - datetime.now(timezone.utc).replace(tzinfo=None)
+print(os.environ.get('TZ'), round(offset.total_seconds() / 3600))
+'''
+
+
+def run_check(tz):
+    env = {key: value for key, value in os.environ.items() if key != 'TZ'}
+    if tz is not None:
+        env['TZ'] = tz
+    result = subprocess.run([sys.executable, '-c', CHECK], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    process_tz, offset = result.stdout.strip().splitlines()[-1].split()
+    return process_tz, int(offset)
+
+
+def test_default_timezone_does_not_touch_process_clock():
+    # 기본값(Asia/Seoul)은 local_now()에만 적용되고 TZ 환경 변수는 설정하지 않음
+    assert run_check(None) == ('None', 9)
+
+
+def test_configured_timezone():
+    process_tz, offset = run_check('Asia/Kolkata')
+    assert process_tz == 'Asia/Kolkata'
+    assert offset in (5, 6)  # +5:30
+
+
+def test_timestamps_use_local_now(run_db):
+    async def scenario():
+        await database.create_user('1', 'user')
+        await database.touch_guild_member('900000000000000001', '1')
+        donation_id = await database.create_donation('1', 100, 'lnbc1', 'hash1', 'a@b.c')
+        user = await database.get_user('1')
+        async with database.db_manager.reader() as db:
+            async with db.execute('SELECT timestamp FROM donation_history WHERE donation_id = ?',
+                                  (donation_id,)) as cursor:
+                donation = await cursor.fetchone()
+            async with db.execute('SELECT joined_at FROM guild_members') as cursor:
+                member = await cursor.fetchone()
+        return user['created_at'], donation['timestamp'], member['joined_at']
+
+    now = config.local_now()
+    for stored in run_db(scenario):
+        assert abs(datetime.fromisoformat(stored) - now) < timedelta(minutes=1)
@@ -0,0 +1,120 @@
+"""운동 기록 파일 가져오기 - CSV/GPX/FIT 파싱, 잘못된 줄 건너뛰기, 다시 가져오기 중복 방지"""
+import os
+import pytest
+import database
+from workout_import import WorkoutImportError, parse_workout_file
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+USER_ID = '400000000000000001'
+TIMEZONE = 'Asia/Seoul'
+
+
+def parse(filename: str, file_format: str, default_type=None):
+    return parse_workout_file(os.path.join(FIXTURES, filename), file_format, default_type, timezone_name=TIMEZONE)
+
+
+def test_parse_csv():
+    rows, skipped = parse('workouts.csv', 'csv')
+    assert skipped == 0
+    # 별칭(걷기, Ride) 해석, 값 반올림, UTC 시각은 설정 시간대로 변환
+    assert rows == [
+        ('running', 5.2, '2024-03-01T06:00:00', '아침 달리기'),
+        ('walking', 3.46, '2024-03-01T19:00:00', None),
+        ('cycling', 20.0, '2024-03-02T16:30:00', '출근'),
+        ('weight', 120.0, '2024-03-03T10:00:00', '스쿼트'),
+    ]
+
+
+def test_parse_gpx():
+    rows, skipped = parse('workout.gpx', 'gpx')
+    # 시각이 없는 트랙은 건너뜀
+    assert skipped == 1
+    assert [(exercise_type, logged_at, memo) for exercise_type, _, logged_at, memo in rows] == [
+        ('running', '2024-03-02T06:00:00', '한강 달리기'),
+        ('cycling', '2024-03-02T18:00:00', 'Evening ride'),
+    ]
+    assert rows[0][1] == pytest.approx(2.22, abs=0.01)
+    assert rows[1][1] == pytest.approx(9.97, abs=0.01)
+
+
+def test_parse_fit():
+    pytest.importorskip('fitparse')
+    rows, skipped = parse('workout.fit', 'fit')
+    # sport가 generic인 세션은 종류를 알 수 없어 건너뜀
+    assert skipped == 1
+    assert rows == [
+        ('running', 5.0, '2024-03-01T15:00:00', None),
+        ('cycling', 20.5, '2024-03-02T16:30:00', None),
+    ]
+
+    rows, skipped = parse('workout.fit', 'fit', default_type='walking')
+    assert skipped == 0
+    assert rows[-1] == ('walking', 3.0, '2024-03-03T17:00:00', None)
+
+
+def test_malformed_rows_are_skipped():
+    rows, skipped = parse('workouts_malformed.csv', 'csv')
+    # 숫자 아님, 모르는 운동, 0 이하, 범위 초과, 날짜 오류, 열 부족
+    assert rows == [('running', 5.2, '2024-03-01T06:00:00', '정상')]
+    assert skipped == 6
+
+
+def test_malformed_files_are_rejected(tmp_path):
+    no_value = tmp_path / 'no_value.csv'
+    no_value.write_text('date,type\n2024-03-01,running\n', encoding='utf-8')
+    with pytest.raises(WorkoutImportError):
+        parse_workout_file(str(no_value), 'csv', timezone_name=TIMEZONE)
+
+    no_type = tmp_path / 'no_type.csv'
+    no_type.write_text('date,value\n2024-03-01T06:00:00,5\n', encoding='utf-8')
+    with pytest.raises(WorkoutImportError):
+        parse_workout_file(str(no_type), 'csv', timezone_name=TIMEZONE)
+    # 종류 열이 없으면 선택한 종류로 가져옴
+    assert parse_workout_file(str(no_type), 'csv', 'running', timezone_name=TIMEZONE)[0] == [
+        ('running', 5.0, '2024-03-01T06:00:00', None)
+    ]
+
+    broken = tmp_path / 'broken.gpx'
+    broken.write_text('<gpx><trk><trkseg><trkpt lat="1" lon="2">', encoding='utf-8')
+    with pytest.raises(WorkoutImportError):
+        parse_workout_file(str(broken), 'gpx', timezone_name=TIMEZONE)
+
+    with pytest.raises(WorkoutImportError):
+        parse_workout_file(os.path.join(FIXTURES, 'workouts.csv'), 'csv', timezone_name=TIMEZONE, max_rows=2)
+
+
+@pytest.mark.parametrize('filename, file_format', [
+    ('workouts.csv', 'csv'),
+    ('workout.gpx', 'gpx'),
+    ('workout.fit', 'fit'),
+])
+def test_reimport_inserts_nothing(run_db, filename, file_format):
+    if file_format == 'fit':
+        pytest.importorskip('fitparse')
+    rows, _ = parse(filename, file_format)
+
+    async def count_logs() -> int:
+        async with database.db_manager.reader() as db:
+            async with db.execute('SELECT COUNT(*) FROM exercise_logs WHERE user_id = ?', (USER_ID,)) as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def scenario():
+        await database.create_user(USER_ID, 'importer')
+        for exercise_type in ('walking', 'cycling', 'running', 'weight'):
+            await database.update_donation_setting(USER_ID, exercise_type, 10)
+
+        first = await database.import_exercise_logs(USER_ID, rows)
+        assert first['imported'] == len(rows)
+        assert first['duplicates'] == 0
+        assert first['sats'] > 0
+        assert await count_logs() == len(rows)
+
+        again = await database.import_exercise_logs(USER_ID, rows)
+        assert again['imported'] == 0
+        assert again['duplicates'] == len(rows)
+        assert again['sats'] == 0
+        assert await count_logs() == len(rows)
+        # 사용자 총계도 그대로
+        assert again['user']['accumulated_sats'] == first['user']['accumulated_sats']
+
+    run_db(scenario)
@@ -0,0 +1,263 @@
+"""
+Exercise Donation Bot - Workout Import
+운동 기록 파일 (CSV / GPX / FIT) 파싱
+
+파일은 디스크에서 한 줄(한 요소)씩 읽어 큰 파일도 메모리에 통째로 올리지 않으며,
+파싱은 이벤트 루프를 막지 않도록 별도 프로세스(IMPORT_WORKERS)에서 실행된다.
+결과는 (운동 종류, 값, 기록 시각, 메모) 목록으로 database.import_exercise_logs에 넘긴다.
+"""
+import asyncio
+import csv
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import iterparse
+from zoneinfo import ZoneInfo
+import config
+
+try:
+    from fitparse import FitFile
+except ImportError:  # FIT 가져오기는 선택 기능
+    FitFile = None
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FORMATS = ('csv', 'gpx', 'fit')
+
+# 파일에 적힌 운동 이름 → EXERCISE_TYPES 키 (GPX/FIT 앱별 표기 포함)
+EXERCISE_TYPE_ALIASES = {
+    'walk': 'walking', 'hiking': 'walking', 'hike': 'walking',
+    'bike': 'cycling', 'biking': 'cycling', 'ride': 'cycling', 'road_biking': 'cycling',
+    'mountain_biking': 'cycling', 'run': 'running', 'trail_running': 'running',
+    'swim': 'swimming', 'open_water_swimming': 'swimming', 'lap_swimming': 'swimming',
+    'strength': 'weight', 'strength_training': 'weight',
+}
+for _key, _ex_type in config.EXERCISE_TYPES.items():
+    EXERCISE_TYPE_ALIASES[_key] = _key
+    EXERCISE_TYPE_ALIASES[_ex_type['name']] = _key
+
+# CSV 헤더 별칭
+CSV_COLUMNS = {
+    'date': ('date', 'timestamp', 'time', '날짜', '일시'),
+    'type': ('type', 'exercise_type', 'activity', '종류', '운동'),
+    'value': ('value', 'distance', 'km', 'weight', 'kg', '값', '거리', '무게'),
+    'memo': ('memo', 'note', 'notes', '메모'),
+}
+
+EARTH_RADIUS_KM = 6371.0088
+
+# (운동 종류, 값, 기록 시각 ISO, 메모)
+WorkoutRow = Tuple[str, float, str, Optional[str]]
+
+
+class WorkoutImportError(Exception):
+    """파일 전체를 가져올 수 없음 (메시지는 사용자에게 그대로 표시)"""
+
+
+def detect_format(filename: str) -> Optional[str]:
+    """확장자로 파일 형식 판단"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in SUPPORTED_FORMATS else None
+
+
+def resolve_exercise_type(name: Optional[str]) -> Optional[str]:
+    """운동 이름 → EXERCISE_TYPES 키 (모르는 이름이면 None)"""
+    if not name:
+        return None
+    name = name.strip()
+    return EXERCISE_TYPE_ALIASES.get(name) or EXERCISE_TYPE_ALIASES.get(name.lower().replace(' ', '_'))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """두 좌표 사이 거리 (km)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def to_local_timestamp(value, tz: ZoneInfo, assume_utc: bool = False) -> str:
+    """시각 → 설정 시간대 기준 naive ISO 문자열 (DB 저장 형식)
+
+    시간대 정보가 없는 값은 assume_utc면 UTC, 아니면 이미 현지 시각으로 본다.
+    """
+    if isinstance(value, str):
+        value = value.strip()
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None and assume_utc:
+        value = value.replace(tzinfo=timezone.utc)
+    if value.tzinfo is not None:
+        value = value.astimezone(tz).replace(tzinfo=None)
+    return value.isoformat()
+
+
+def valid_value(exercise_type: str, value: float) -> bool:
+    """직접 입력과 같은 범위만 허용"""
+    return 0 < value <= config.EXERCISE_MAX_VALUES.get(exercise_type, 1000)
+
+
+def _iter_csv(path: str, default_type: Optional[str], tz: ZoneInfo) -> Iterator[Optional[WorkoutRow]]:
+    """CSV 한 줄씩 (읽을 수 없는 줄은 None)"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        headers = {name.strip().lower(): name for name in reader.fieldnames or []}
+        columns = {}
+        for column, aliases in CSV_COLUMNS.items():
+            columns[column] = next((headers[alias] for alias in aliases if alias in headers), None)
+        if columns['date'] is None or columns['value'] is None:
+            raise WorkoutImportError("CSV에 날짜(date)와 값(value) 열이 필요합니다.")
+        if columns['type'] is None and default_type is None:
+            raise WorkoutImportError("CSV에 종류(type) 열이 없으면 가져올 운동 종류를 선택하세요.")
+
+        for record in reader:
+            try:
+                exercise_type = resolve_exercise_type(record[columns['type']]) if columns['type'] else default_type
+                value = float(record[columns['value']])
+                if exercise_type is None or not valid_value(exercise_type, value):
+                    yield None
+                    continue
+                memo = None
+                if columns['memo']:
+                    memo = (record[columns['memo']] or '').strip()[:100] or None
+                yield exercise_type, round(value, 2), to_local_timestamp(record[columns['date']], tz), memo
+            except (TypeError, ValueError):
+                yield None
+
+
+def _iter_gpx(path: str, default_type: Optional[str], tz: ZoneInfo) -> Iterator[Optional[WorkoutRow]]:
+    """GPX 트랙(trk)마다 한 건 - 트랙 포인트를 읽는 즉시 거리만 누적하고 버림"""
+    track_type = track_name = started_at = None
+    distance = 0.0
+    previous = None
+    segment = None
+    in_point = False
+
+    for event, elem in iterparse(path, events=('start', 'end')):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if event == 'start':
+            if tag == 'trk':
+                track_type = track_name = started_at = None
+                distance = 0.0
+            elif tag == 'trkseg':
+                segment = elem
+                previous = None
+            elif tag == 'trkpt':
+                in_point = True
+            continue
+
+        if tag == 'trkpt':
+            in_point = False
+            try:
+                point = (float(elem.get('lat')), float(elem.get('lon')))
+            except (TypeError, ValueError):
+                point = None
+            if point is not None:
+                if previous is not None:
+                    distance += haversine_km(*previous, *point)
+                previous = point
+                if started_at is None:
+                    time_elem = next((child for child in elem if child.tag.rsplit('}', 1)[-1] == 'time'), None)
+                    if time_elem is not None and time_elem.text:
+                        started_at = time_elem.text
+            elem.clear()
+            if segment is not None:
+                segment.remove(elem)
+        elif in_point:
+            continue
+        elif tag == 'trkseg':
+            segment = None
+        elif tag == 'type' and track_type is None:
+            track_type = elem.text
+        elif tag == 'name' and track_name is None:
+            track_name = elem.text
+        elif tag == 'trk':
+            exercise_type = resolve_exercise_type(track_type) or default_type
+            value = round(distance, 2)
+            if started_at is None or exercise_type is None or exercise_type == 'weight' \
+                    or not valid_value(exercise_type, value):
+                yield None
+            else:
+                try:
+                    memo = (track_name or '').strip()[:100] or None
+                    yield exercise_type, value, to_local_timestamp(started_at, tz, assume_utc=True), memo
+                except ValueError:
+                    yield None
+            elem.clear()
+
+
+def _iter_fit(path: str, default_type: Optional[str], tz: ZoneInfo) -> Iterator[Optional[WorkoutRow]]:
+    """FIT 세션(session)마다 한 건 (fitparse 필요)"""
+    if FitFile is None:
+        raise WorkoutImportError("FIT 파일을 가져오려면 서버에 fitparse 패키지가 설치되어 있어야 합니다.")
+
+    try:
+        for session in FitFile(path).get_messages('session'):
+            fields = session.get_values()
+            exercise_type = resolve_exercise_type(str(fields.get('sport') or '')) or default_type
+            started_at = fields.get('start_time')
+            value = round((fields.get('total_distance') or 0) / 1000, 2)  # m → km
+            if started_at is None or exercise_type is None or exercise_type == 'weight' \
+                    or not valid_value(exercise_type, value):
+                yield None
+                continue
+            yield exercise_type, value, to_local_timestamp(started_at, tz, assume_utc=True), None
+    except WorkoutImportError:
+        raise
+    except Exception as e:
+        raise WorkoutImportError(f"FIT 파일을 읽을 수 없습니다: {e}")
+
+
+PARSERS = {'csv': _iter_csv, 'gpx': _iter_gpx, 'fit': _iter_fit}
+
+
+def parse_workout_file(path: str, file_format: str, default_type: Optional[str] = None,
+                       timezone_name: str = config.TIMEZONE,
+                       max_rows: int = config.IMPORT_MAX_ROWS) -> Tuple[List[WorkoutRow], int]:
+    """파일 파싱 - (가져올 기록 목록, 건너뛴 줄 수) 반환 (워커 프로세스에서 실행)"""
+    tz = ZoneInfo(timezone_name)
+    rows: List[WorkoutRow] = []
+    skipped = 0
+    try:
+        for row in PARSERS[file_format](path, default_type, tz):
+            if row is None:
+                skipped += 1
+                continue
+            rows.append(row)
+            if len(rows) > max_rows:
+                raise WorkoutImportError(f"한 번에 최대 {max_rows:,}건까지 가져올 수 있습니다.")
+    except (UnicodeDecodeError, csv.Error, SyntaxError) as e:
+        # SyntaxError: iterparse의 ParseError
+        raise WorkoutImportError(f"파일 형식이 올바르지 않습니다: {e}")
+    return rows, skipped
+
+
+_import_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_import_executor() -> ProcessPoolExecutor:
+    """파일 파싱 워커 프로세스 풀 (처음 사용할 때 생성)"""
+    global _import_executor
+    if _import_executor is None:
+        _import_executor = ProcessPoolExecutor(max_workers=config.IMPORT_WORKERS)
+    return _import_executor
+
+
+def close_import_executor():
+    """파싱 워커 종료"""
+    global _import_executor
+    if _import_executor is not None:
+        _import_executor.shutdown(wait=False)
+        _import_executor = None
+
+
+async def parse_in_worker(path: str, file_format: str,
+                          default_type: Optional[str] = None) -> Tuple[List[WorkoutRow], int]:
+    """워커 프로세스에서 파일 파싱"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_import_executor(), parse_workout_file, path, file_format, default_type,
+        config.TIMEZONE, config.IMPORT_MAX_ROWS
+    )